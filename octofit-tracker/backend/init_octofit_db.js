@@ -15,6 +15,9 @@ async function initDb() {
 		await db.createCollection("workouts");
 
 		await db.collection("users").createIndex({ "email": 1 }, { unique: true });
+		await db.collection("activity").createIndex({ "date": -1, "id": -1 });
+		await db.collection("activity").createIndex({ "user_id": 1, "date": -1 });
+		await db.collection("activity").createIndex({ "activity_type": 1, "date": -1 });
 		console.log("Database initialized successfully.");
 	} catch (err) {
 		console.error("Error initializing database:", err);
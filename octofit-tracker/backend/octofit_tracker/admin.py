@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, ActivityRollup, Leaderboard, Workout
 
 admin.site.register(User)
 admin.site.register(Team)
 admin.site.register(Activity)
+admin.site.register(ActivityRollup)
 admin.site.register(Leaderboard)
 admin.site.register(Workout)
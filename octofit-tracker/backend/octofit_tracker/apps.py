@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Connect the model signal handlers that keep derived data in sync
+        from . import signals  # noqa: F401
+        # Write log records from a background thread, see octofit_tracker.logs
+        from .logs import start
+
+        start()
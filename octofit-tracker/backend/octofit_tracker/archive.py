@@ -0,0 +1,421 @@
+"""Compressed, append-only archive of cold activity history.
+
+``compact`` (``manage.py compact_activities``) moves activities dated before
+the month ``HORIZON_DAYS`` ago out of the ``Activity`` table into per-month
+files under ``DIR``, and replaces them in the database by per-user monthly
+``ActivitySummary`` totals. The hot table, and its indexes, then only hold
+recent activity.
+
+Each file is a zip archive with one deflated member per column, so readers
+decompress only the columns they need. Integer columns (``id``, ``user_id``,
+``duration`` and ``date`` as microseconds since the epoch) are packed
+little-endian 64 bit arrays; text columns are dictionary encoded. Files are
+never modified once written: compacting a month again adds a file, listed
+in ``ArchiveSegment`` like the others, with the range of user ids it holds.
+Decoded columns are cached per process up to ``COLUMN_CACHE_BYTES``, which
+is safe because the files are immutable.
+
+Compaction leaves derived data alone: leaderboard points and rollups already
+count the archived activities, and ``user_totals`` adds the summaries to the
+live totals. The rows are written and deleted with bulk operations that send
+no model signals, so nothing is recomputed.
+
+Readers merge archived rows back in: ``select`` lazily yields archived
+activities matching ``filters.activity_criteria`` in ``(date, id)`` order,
+one month at a time, for the activity list, retrieve and export.
+"""
+import heapq
+import json
+import os
+import sys
+import threading
+import zipfile
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import datetime, time, timedelta
+from itertools import groupby
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import versions
+from .models import Activity, ActivitySummary, ArchiveSegment
+
+DEFAULTS = {
+    # Directory of the archive files, defaults to BASE_DIR / "archive"
+    'DIR': None,
+    # Activities older than this are archived, a whole month at a time
+    'HORIZON_DAYS': 365,
+    # Most activities written to one file
+    'SEGMENT_ROWS': 100000,
+    # Memory for decoded columns kept per process, least recently used go first
+    'COLUMN_CACHE_BYTES': 64 * 1024 * 1024,
+}
+COLUMNS = ('id', 'user_id', 'activity_type', 'duration', 'date', 'idempotency_key')
+_TEXT_COLUMNS = ('activity_type', 'idempotency_key')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+FORMAT_VERSION = 1
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_ARCHIVE', {})}
+
+
+def archive_dir():
+    return Path(get_config()['DIR'] or Path(settings.BASE_DIR) / 'archive')
+
+
+def month_of(moment):
+    """First day of the UTC month of an aware datetime"""
+    return moment.astimezone(timezone.utc).date().replace(day=1)
+
+
+def _next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def _month_range(month):
+    """Aware ``[start, end)`` datetimes of ``month``"""
+    start = datetime.combine(month, time.min, tzinfo=timezone.utc)
+    return start, datetime.combine(_next_month(month), time.min, tzinfo=timezone.utc)
+
+
+def horizon(now=None):
+    """First month that is not archived, ``HORIZON_DAYS`` back from ``now``"""
+    now = now or timezone.now()
+    return month_of(now - timedelta(days=get_config()['HORIZON_DAYS']))
+
+
+# Files
+
+def _pack(values, typecode='q'):
+    packed = array(typecode, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data, typecode='q'):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def write_segment(month, rows):
+    """Write ``COLUMNS`` tuples of ``month`` to a new file, returning its relative path.
+
+    The name is derived from the ids it holds, so writing the same rows again
+    after an interrupted compaction replaces the file instead of adding one.
+    """
+    columns = dict(zip(COLUMNS, zip(*rows)))
+    path = f'{month:%Y-%m}/activities-{columns["id"][0]}-{columns["id"][-1]}.zip'
+    target = archive_dir() / path
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_suffix('.partial')
+    with zipfile.ZipFile(partial, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('meta.json', json.dumps({
+            'format': FORMAT_VERSION, 'month': month.isoformat(), 'rows': len(rows), 'columns': COLUMNS,
+        }))
+        for name, values in columns.items():
+            if name in _TEXT_COLUMNS:
+                dictionary = list(dict.fromkeys(values))
+                codes = {value: code for code, value in enumerate(dictionary)}
+                archive.writestr(f'{name}.dict', json.dumps(dictionary))
+                archive.writestr(name, _pack([codes[value] for value in values], 'l'))
+            elif name == 'date':
+                archive.writestr(name, _pack([(value - _EPOCH) // timedelta(microseconds=1) for value in values]))
+            else:
+                archive.writestr(name, _pack(values))
+    with open(partial, 'rb') as written:
+        os.fsync(written.fileno())
+    os.replace(partial, target)
+    return path
+
+
+class _ColumnCache:
+    """Decoded columns, least recently used first, bounded by their estimated size in bytes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, values, size, limit):
+        with self._lock:
+            if key in self._entries or size > limit:
+                return
+            self._entries[key] = (values, size)
+            self.bytes += size
+            while self.bytes > limit:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+_columns = _ColumnCache()
+
+
+def _column_bytes(name, values):
+    """Approximate memory held by a decoded column"""
+    # Text values are shared with the file's dictionary
+    item = 0 if name in _TEXT_COLUMNS else sys.getsizeof(values[0]) if values else 0
+    return sys.getsizeof(values) + item * len(values)
+
+
+def read_column(path, name):
+    """The decoded ``name`` column of the file at ``path``, as a tuple"""
+    path = str(archive_dir() / path)
+    values = _columns.get((path, name))
+    if values is None:
+        values = _read_column(path, name)
+        _columns.put((path, name), values, _column_bytes(name, values), get_config()['COLUMN_CACHE_BYTES'])
+    return values
+
+
+def _read_column(path, name):
+    with zipfile.ZipFile(path) as archive:
+        if name in _TEXT_COLUMNS:
+            dictionary = json.loads(archive.read(f'{name}.dict'))
+            return tuple(dictionary[code] for code in _unpack(archive.read(name), 'l'))
+        values = _unpack(archive.read(name))
+    if name == 'date':
+        return tuple(_EPOCH + timedelta(microseconds=value) for value in values)
+    return tuple(values)
+
+
+# Reads
+
+def _segments_queryset(since, until, user_ids):
+    queryset = ArchiveSegment.objects.order_by('month', 'first_id')
+    if since is not None:
+        queryset = queryset.filter(month__gte=month_of(since))
+    if until is not None:
+        queryset = queryset.filter(month__lte=month_of(until))
+    if user_ids is not None:
+        queryset = queryset.exclude(min_user_id__gt=max(user_ids)).exclude(max_user_id__lt=min(user_ids))
+    return queryset
+
+
+def segments(since=None, until=None, user_ids=None):
+    """Archive files that may hold activities dated between ``since`` and ``until`` of ``user_ids``"""
+    if user_ids is not None and not user_ids:
+        return []
+    return [segment for segment in _segments_queryset(since, until, user_ids) if _may_hold(segment, user_ids)]
+
+
+async def asegments(since=None, until=None, user_ids=None):
+    """``segments`` for async callers"""
+    if user_ids is not None and not user_ids:
+        return []
+    return [segment async for segment in _segments_queryset(since, until, user_ids) if _may_hold(segment, user_ids)]
+
+
+async def aholds_id(activity_id):
+    """Whether an archive file may hold the activity ``activity_id``"""
+    return await ArchiveSegment.objects.filter(first_id__lte=activity_id, last_id__gte=activity_id).aexists()
+
+
+def _may_hold(segment, user_ids):
+    """Whether the user id range of ``segment`` holds any of ``user_ids``"""
+    if user_ids is None or segment.min_user_id is None:
+        return True
+    return any(segment.min_user_id <= user_id <= segment.max_user_id for user_id in user_ids)
+
+
+def boundary():
+    """First month after the archived ones, None without an archive"""
+    latest = ArchiveSegment.objects.order_by('-month').values_list('month', flat=True).first()
+    return None if latest is None else _next_month(latest)
+
+
+def _order(path):
+    """Positions of the rows of the file at ``path`` in ``(date, id)`` order.
+
+    Files are written in id order; the permutation is computed once and
+    cached with the decoded columns.
+    """
+    key = (str(archive_dir() / path), '#order')
+    order = _columns.get(key)
+    if order is None:
+        dates, ids = read_column(path, 'date'), read_column(path, 'id')
+        order = array('q', sorted(range(len(ids)), key=lambda position: (dates[position], ids[position])))
+        _columns.put(key, order, sys.getsizeof(order), get_config()['COLUMN_CACHE_BYTES'])
+    return order
+
+
+def _segment_rows(segment, criteria, descending, after, columns):
+    """Yield the matching rows of one file in ``(date, id)`` order, building each row only when it is reached"""
+    path = segment.path
+    order = _order(path)
+    dates, ids = read_column(path, 'date'), read_column(path, 'id')
+    since, until = criteria.get('since'), criteria.get('until')
+    start = 0 if since is None else bisect_left(order, since, key=dates.__getitem__)
+    stop = len(order) if until is None else bisect_right(order, until, key=dates.__getitem__)
+    if after is not None:
+        row_key = lambda position: (dates[position], ids[position])  # noqa: E731
+        if descending:
+            stop = min(stop, bisect_left(order, after, start, stop, key=row_key))
+        else:
+            start = max(start, bisect_right(order, after, start, stop, key=row_key))
+    if start >= stop:
+        return
+    positions = reversed(order[start:stop]) if descending else order[start:stop]
+    user_ids, activity_type = criteria.get('user_ids'), criteria.get('activity_type')
+    users = None if user_ids is None else read_column(path, 'user_id')
+    types = None if activity_type is None else read_column(path, 'activity_type')
+    data = None
+    for position in positions:
+        if users is not None and users[position] not in user_ids:
+            continue
+        if types is not None and types[position] != activity_type:
+            continue
+        if data is None:
+            data = [(name, read_column(path, name)) for name in columns]
+        yield {name: values[position] for name, values in data}
+
+
+def select(criteria, descending=False, after=None, columns=COLUMNS, files=None):
+    """Yield the archived activities matching ``criteria`` as dicts, in ``(date, id)`` order.
+
+    ``after`` is a ``(date, id)`` key to resume strictly after. Months
+    outside the date range and the cursor, and files outside the user
+    range, are skipped unopened. Within a month the files are merged lazily:
+    each is walked in ``(date, id)`` order from the bisected start of the
+    range and cursor, so a reader that stops after a page has built only
+    the rows of that page.
+    """
+    user_ids = criteria.get('user_ids')
+    if files is None:
+        files = segments(criteria.get('since'), criteria.get('until'), user_ids)
+    lower, upper = criteria.get('since'), criteria.get('until')
+    if after is not None:
+        if descending:
+            upper = after[0] if upper is None else min(upper, after[0])
+        else:
+            lower = after[0] if lower is None else max(lower, after[0])
+    columns = list(dict.fromkeys([*columns, 'id', 'date']))
+    months = [list(month_files) for _, month_files in groupby(files, key=lambda segment: segment.month)]
+    for month_files in (reversed(months) if descending else months):
+        start, end = _month_range(month_files[0].month)
+        if (lower is not None and end <= lower) or (upper is not None and start > upper):
+            continue
+        readers = [
+            _segment_rows(segment, criteria, descending, after, columns)
+            for segment in month_files if _may_hold(segment, user_ids)
+        ]
+        yield from heapq.merge(*readers, key=lambda row: (row['date'], row['id']), reverse=descending)
+
+
+def get(activity_id, columns=COLUMNS):
+    """The archived activity ``activity_id`` as a dict, or None"""
+    for segment in ArchiveSegment.objects.filter(first_id__lte=activity_id, last_id__gte=activity_id):
+        ids = read_column(segment.path, 'id')
+        try:
+            position = ids.index(activity_id)
+        except ValueError:
+            continue
+        return {name: read_column(segment.path, name)[position] for name in columns}
+    return None
+
+
+# Compaction
+
+def compact(before=None, segment_rows=None):
+    """Archive the activities dated before the month ``before``, returning how many moved"""
+    before = before or horizon()
+    segment_rows = segment_rows or get_config()['SEGMENT_ROWS']
+    cutoff = _month_range(before)[0]
+    moved = 0
+    while True:
+        oldest = Activity.objects.filter(date__lt=cutoff).order_by('date').values_list('date', flat=True).first()
+        if oldest is None:
+            return moved
+        month = month_of(oldest)
+        start, end = _month_range(month)
+        rows = list(
+            Activity.objects.filter(date__gte=start, date__lt=min(end, cutoff))
+            .order_by('id').values_list(*COLUMNS)[:segment_rows]
+        )
+        moved += _archive(month, rows)
+
+
+def _archive(month, rows):
+    path = write_segment(month, rows)
+    totals = defaultdict(lambda: [0, 0])
+    for _, user_id, activity_type, duration, _, _ in rows:
+        total = totals[(user_id, activity_type)]
+        total[0] += int(duration or 0)
+        total[1] += 1
+    ids = [row[0] for row in rows]
+    with transaction.atomic():
+        user_ids = [row[1] for row in rows]
+        ArchiveSegment.objects.update_or_create(path=path, defaults={
+            'month': month, 'row_count': len(rows), 'first_id': ids[0], 'last_id': ids[-1],
+            'min_user_id': min(user_ids), 'max_user_id': max(user_ids),
+        })
+        _add_summaries(month, totals)
+        for start in range(0, len(ids), 500):
+            # Nothing references activities, and the derived data must not
+            # see these rows go: delete without collecting or signalling
+            queryset = Activity.objects.filter(id__in=ids[start:start + 500])
+            queryset._raw_delete(queryset.db)
+        versions.bump('activity')
+    return len(rows)
+
+
+def _add_summaries(month, totals):
+    existing = set(
+        ActivitySummary.objects.filter(month=month, user_id__in={user_id for user_id, _ in totals})
+        .values_list('user_id', 'activity_type')
+    )
+    for (user_id, activity_type), (duration, count) in totals.items():
+        if (user_id, activity_type) in existing:
+            ActivitySummary.objects.filter(user_id=user_id, month=month, activity_type=activity_type).update(
+                total_duration=F('total_duration') + duration, activity_count=F('activity_count') + count,
+            )
+    ActivitySummary.objects.bulk_create([
+        ActivitySummary(user_id=user_id, month=month, activity_type=activity_type,
+                        total_duration=duration, activity_count=count)
+        for (user_id, activity_type), (duration, count) in totals.items()
+        if (user_id, activity_type) not in existing
+    ], batch_size=1000)
+
+
+def archived_days(user_days):
+    """Totals of archived activities for ``(user_id, day)`` pairs.
+
+    Returns ``{(user_id, day, activity_type): [duration, count]}``; used when
+    rollups of archived days are recomputed.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    months = {month_of(datetime.combine(day, time.min, tzinfo=timezone.utc)) for _, day in user_days}
+    files = list(ArchiveSegment.objects.filter(month__in=months).order_by('month', 'first_id'))
+    if not files:
+        return totals
+    wanted = set(user_days)
+    criteria = {'user_ids': {user_id for user_id, _ in user_days}}
+    for row in select(criteria, columns=('user_id', 'activity_type', 'duration', 'date'), files=files):
+        day = row['date'].date()
+        if (row['user_id'], day) in wanted:
+            total = totals[(row['user_id'], day, row['activity_type'])]
+            total[0] += int(row['duration'] or 0)
+            total[1] += 1
+    return totals
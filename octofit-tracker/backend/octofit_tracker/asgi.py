@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "octofit_tracker.settings")
 
-application = get_asgi_application()
+# Timed set up, and warm-up of the connections, URL resolvers, serializers
+# and in-process indexes before the first request (octofit_tracker.startup)
+from octofit_tracker.startup import asgi_application  # noqa: E402
+
+django_application = asgi_application()
+
+# Server-Sent Events of the standings, outside of Django's request cycle
+from octofit_tracker.live import LeaderboardStream  # noqa: E402
+
+application = LeaderboardStream(django_application)
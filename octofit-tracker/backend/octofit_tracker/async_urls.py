@@ -0,0 +1,2 @@
+"""URL configuration of the requests served under ASGI, see async_views"""
+from .urls import async_urlpatterns as urlpatterns  # noqa: F401
@@ -0,0 +1,249 @@
+"""Async list and retrieve handlers for the read-heavy router endpoints.
+
+Under an ASGI server the sync viewsets hold a worker thread for the whole
+request, including every database round trip. ``mount_async_reads`` swaps
+the list and detail routes of the given viewsets for coroutine views that
+run the same fast path as ``FastReadMixin`` on the async ORM interface, and
+keep the conditional request and response cache behaviour of the sync
+views. Anything they do not serve themselves (writes, expansions, the
+browsable API, non fast-path serializers) is handed to the original sync
+view, so the API is unchanged. Activity reads are handed over only when
+they may need archived rows: a list whose filters reach an archive file,
+or a retrieve of an id in the range of one.
+
+``AsyncRoutesMiddleware`` sends requests to these routes only when the
+server runs the middleware chain asynchronously; under WSGI each call would
+need an event loop of its own, so the sync views keep serving there.
+
+The response cache is read and filled from async requests, but concurrent
+misses are not collapsed as in ``ResponseCache.fill``: its locks would block
+the event loop.
+"""
+import asyncio
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.urls import URLPattern
+from django.utils.http import http_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
+from . import archive, versions
+from .filters import activity_criteria
+from .instrumentation import timed
+from .response_cache import get_response_cache
+
+
+ASYNC_URLCONF = 'octofit_tracker.async_urls'
+
+
+def async_reads_enabled():
+    return getattr(settings, 'OCTOFIT_ASYNC_READS', True)
+
+
+class AsyncRoutesMiddleware:
+    """Resolves requests served under ASGI against ``ASYNC_URLCONF``"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if async_reads_enabled():
+            request.urlconf = ASYNC_URLCONF
+        return await self.get_response(request)
+
+
+def mount_async_reads(patterns, basenames):
+    """Return ``patterns`` with the list and detail routes of ``basenames`` served async"""
+    names = {f'{basename}-{suffix}' for basename in basenames for suffix in ('list', 'detail')}
+    return [
+        URLPattern(pattern.pattern, async_read_view(pattern.callback), pattern.default_args, pattern.name)
+        if isinstance(pattern, URLPattern) and pattern.name in names else pattern
+        for pattern in patterns
+    ]
+
+
+def async_read_view(sync_view):
+    """Coroutine view serving GET for the router view ``sync_view``"""
+    delegate = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        viewset = None
+        if request.method in ('GET', 'HEAD'):
+            viewset = await _prepare_viewset(sync_view, request, args, kwargs)
+        if viewset is None:
+            return await delegate(request, *args, **kwargs)
+        try:
+            response = await _respond(viewset)
+        except Exception as exc:
+            response = viewset.handle_exception(exc)
+        response = viewset.finalize_response(viewset.request, response, *args, **kwargs)
+        if isinstance(response, Response) and not response.is_rendered:
+            response.render()
+        return response
+
+    view.csrf_exempt = True
+    view.cls = sync_view.cls
+    view.initkwargs = sync_view.initkwargs
+    view.actions = sync_view.actions
+    view.__name__ = view.__qualname__ = sync_view.__name__
+    return view
+
+
+async def _prepare_viewset(sync_view, request, args, kwargs):
+    """Set the viewset up as ``dispatch`` would, or None if it needs the sync path"""
+    viewset = sync_view.cls(**sync_view.initkwargs)
+    actions = dict(sync_view.actions)
+    if 'get' in actions:
+        actions.setdefault('head', actions['get'])
+    viewset.action_map = actions
+    for method, action in actions.items():
+        setattr(viewset, method, getattr(viewset, action))
+    viewset.args, viewset.kwargs = args, kwargs
+    viewset.request = drf_request = viewset.initialize_request(request, *args, **kwargs)
+    viewset.headers = viewset.default_response_headers
+    if any(not isinstance(permission, AllowAny) for permission in viewset.get_permissions()):
+        return None
+    # Throttles that do I/O may not run on the event loop
+    if any(not getattr(throttle, 'nonblocking', False) for throttle in viewset.get_throttles()):
+        return None
+    try:
+        if 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES:
+            # Credentials are checked against the database
+            await sync_to_async(viewset.initial)(drf_request, *args, **kwargs)
+        else:
+            viewset.initial(drf_request, *args, **kwargs)
+    except Exception:
+        # Let the sync view produce the error response
+        return None
+    if drf_request.accepted_renderer.format not in viewset.cached_formats:
+        return None
+    if getattr(viewset, 'merges_archive', False) and await _reads_archive(viewset):
+        return None
+    try:
+        if viewset.get_row_encoder() is None:
+            return None
+    except Exception:
+        # An invalid ?fields= for instance
+        return None
+    return viewset
+
+
+async def _reads_archive(viewset):
+    """Whether the request may need archived activities, which only the sync view merges in"""
+    if viewset.action == 'retrieve':
+        try:
+            activity_id = int(viewset.kwargs[viewset.lookup_url_kwarg or viewset.lookup_field])
+        except ValueError:
+            return False
+        return await archive.aholds_id(activity_id)
+    params = viewset.request.query_params
+    try:
+        if params.get('team'):
+            # Teams are resolved to their members with a query
+            criteria = await sync_to_async(activity_criteria)(params)
+        else:
+            criteria = activity_criteria(params)
+    except ValidationError:
+        # Let the sync view produce the error response
+        return True
+    return bool(await archive.asegments(criteria.get('since'), criteria.get('until'), criteria.get('user_ids')))
+
+
+async def _respond(viewset):
+    request = viewset.request
+    namespace = viewset.version_namespace
+    row = None
+    if viewset.versions_object():
+        try:
+            row = await viewset.object_rows().afirst()
+        except (TypeError, ValueError, DjangoValidationError):
+            row = None
+    if row is not None:
+        etag, modified = versions.object_etag(request, namespace, row), None
+    else:
+        version, modified = await versions.acurrent(namespace)
+        etag = versions.etag(request, namespace, version, modified)
+    if versions.not_modified(request, etag, modified):
+        response = HttpResponseNotModified()
+    else:
+        response = await _cached(viewset, etag)
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified.timestamp())
+    return response
+
+
+async def _cached(viewset, etag):
+    cache = get_response_cache()
+    if cache is None:
+        return await _fetch(viewset)
+    key = cache.key(etag)
+    entry = await _cache_call(cache, cache.get, key)
+    if entry is not None:
+        status_code, content_type, content = entry
+        response = HttpResponse(content, content_type=content_type, status=status_code)
+        response['X-Cache'] = 'HIT'
+        return response
+    response = viewset.finalize_response(viewset.request, await _fetch(viewset), *viewset.args, **viewset.kwargs)
+    response.render()
+    if response.status_code == 200:
+        await _cache_call(cache, cache.set, key, (response.status_code, response['Content-Type'], response.content))
+        response['X-Cache'] = 'MISS'
+    return response
+
+
+async def _cache_call(cache, method, *args):
+    # Shared backends may do network I/O, keep it off the event loop
+    if cache.backend.shared:
+        return await sync_to_async(method)(*args)
+    return method(*args)
+
+
+async def _fetch(viewset):
+    encoder = viewset.get_row_encoder()
+    queryset = viewset.get_queryset()
+    if viewset.filter_backends:
+        # Filters may resolve ids with a query of their own
+        queryset = await sync_to_async(viewset.filter_queryset)(queryset)
+    if viewset.action == 'retrieve':
+        return Response(await _fetch_row(viewset, queryset, encoder))
+    columns = list(encoder.columns)
+    paginator = viewset.paginator
+    if paginator is None:
+        rows = [row async for row in queryset.values(*columns)]
+        with timed('serializer'):
+            return Response([encoder(row) for row in rows])
+    columns += [name.lstrip('-') for name in paginator.get_ordering(viewset.request, viewset)]
+    page = paginator.prepare_queryset(queryset.values(*dict.fromkeys(columns)), viewset.request, viewset)
+    rows = paginator.paginate_rows([row async for row in page])
+    with timed('serializer'):
+        data = [encoder(row) for row in rows]
+    return paginator.get_paginated_response(data)
+
+
+async def _fetch_row(viewset, queryset, encoder):
+    lookup_url_kwarg = viewset.lookup_url_kwarg or viewset.lookup_field
+    lookup = {viewset.lookup_field: viewset.kwargs[lookup_url_kwarg]}
+    try:
+        row = await queryset.filter(**lookup).values(*encoder.columns).afirst()
+    except (TypeError, ValueError, DjangoValidationError):
+        row = None
+    if row is None:
+        raise Http404
+    with timed('serializer'):
+        return encoder(row)
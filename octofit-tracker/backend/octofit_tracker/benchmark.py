@@ -0,0 +1,240 @@
+"""Load benchmark for the API endpoints.
+
+Scenarios are driven in-process with Django test clients from a pool of
+concurrent threads. Each request records its latency and the number of
+database queries it issued; results are summarized per scenario and can be
+compared against a stored baseline to catch performance regressions.
+
+``run_async_scenario`` drives the same scenarios through the ASGI handler
+from concurrent tasks on a single event loop, for comparison with the
+threaded run in the same process.
+
+Memory is reported twice: the peak resident set size of the whole process
+over the run, and, with ``traced_peak_kb``, the peak of the Python
+allocations made while one scenario ran. Tracing allocations slows every
+request down, so traced runs are not comparable with untraced baselines.
+"""
+import asyncio
+import itertools
+import math
+import random
+import resource
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+
+from .models import Activity, Leaderboard, Team, User, Workout
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def peak_memory_kb():
+    """Peak resident set size of this process in KiB, over its whole life"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def traced_peak_kb(run, *args):
+    """Call ``run(*args)``, return its result and the peak KiB of Python memory allocated meanwhile"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = run(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if started:
+            tracemalloc.stop()
+    return result, round((peak - baseline) / 1024, 1)
+
+
+class Scenario:
+    """One kind of request: a method and a function building its arguments.
+
+    ``build(rng)`` returns ``(path, payload)``; the payload is sent as JSON
+    for write methods and ignored otherwise.
+    """
+
+    def __init__(self, name, method, build, expected=(200,)):
+        self.name = name
+        self.method = method
+        self.build = build
+        self.expected = expected
+
+
+def default_scenarios():
+    """List, retrieve and create for every router endpoint plus the rank actions"""
+    ids = {
+        'users': list(User.objects.values_list('id', flat=True)[:10000]),
+        'teams': list(Team.objects.values_list('id', flat=True)[:10000]),
+        'activity': list(Activity.objects.values_list('id', flat=True)[:10000]),
+        'leaderboard': list(Leaderboard.objects.values_list('id', flat=True)[:10000]),
+        'workouts': list(Workout.objects.values_list('id', flat=True)[:10000]),
+    }
+    ranked_teams = list(Leaderboard.objects.values_list('team_id', flat=True)[:10000])
+    serial = itertools.count()
+
+    def retrieve(route):
+        return lambda rng: (f'/api/{route}/{rng.choice(ids[route])}/', None)
+
+    scenarios = [
+        Scenario(f'{route}.list', 'get', lambda rng, route=route: (f'/api/{route}/', None))
+        for route in ids
+    ]
+    scenarios += [Scenario(f'{route}.retrieve', 'get', retrieve(route)) for route in ids if ids[route]]
+    scenarios += [
+        Scenario('users.create', 'post', lambda rng: ('/api/users/', {
+            'email': f'bench{next(serial)}-{rng.random()}@octofit.example', 'name': 'Bench User', 'password': 'x',
+        }), expected=(201,)),
+        Scenario('teams.create', 'post', lambda rng: ('/api/teams/', {
+            'name': 'Bench Team', 'members': rng.sample(ids['users'], min(3, len(ids['users']))),
+        }), expected=(201,)),
+        Scenario('workouts.create', 'post', lambda rng: ('/api/workouts/', {
+            'name': 'Bench Workout', 'description': 'Benchmark workout',
+        }), expected=(201,)),
+        Scenario('leaderboard.top', 'get', lambda rng: ('/api/leaderboard/top/?n=10', None)),
+    ]
+    if ids['users']:
+        scenarios.append(Scenario('activity.create', 'post', lambda rng: ('/api/activity/', {
+            'user': rng.choice(ids['users']), 'activity_type': 'running',
+            'duration': rng.randint(10, 90), 'date': '2025-06-01T08:00:00Z',
+        }), expected=(201,)))
+    if ranked_teams:
+        scenarios.append(Scenario('leaderboard.rank', 'get', lambda rng: (
+            f'/api/leaderboard/rank/?team={rng.choice(ranked_teams)}', None,
+        )))
+    return scenarios
+
+
+def run_scenario(scenario, requests, clients, seed=0):
+    """Send ``requests`` requests from ``clients`` threads and summarize them"""
+    local = threading.local()
+    counter = itertools.count()
+
+    def worker(_):
+        if not hasattr(local, 'client'):
+            local.client = Client(raise_request_exception=False)
+            local.rng = random.Random(f'{seed}:{scenario.name}:{threading.get_ident()}')
+        samples = []
+        while next(counter) < requests:
+            path, payload = scenario.build(local.rng)
+            send = getattr(local.client, scenario.method)
+            with CaptureQueriesContext(connections['default']) as queries:
+                started = time.perf_counter()
+                if payload is None:
+                    response = send(path)
+                else:
+                    response = send(path, payload, content_type='application/json')
+                elapsed = time.perf_counter() - started
+            samples.append((elapsed, len(queries), response.status_code in scenario.expected))
+        connections.close_all()
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        samples = [sample for batch in pool.map(worker, range(clients)) for sample in batch]
+    wall = time.perf_counter() - started
+    return summarize(samples, wall)
+
+
+def run_async_scenario(scenario, requests, clients, seed=0):
+    """Send ``requests`` requests from ``clients`` tasks on one event loop and summarize them"""
+    rng = random.Random(f'{seed}:{scenario.name}:async')
+    counter = itertools.count()
+
+    async def worker():
+        client = AsyncClient(raise_request_exception=False)
+        samples = []
+        while next(counter) < requests:
+            path, payload = scenario.build(rng)
+            send = getattr(client, scenario.method)
+            started = time.perf_counter()
+            if payload is None:
+                response = await send(path)
+            else:
+                response = await send(path, payload, content_type='application/json')
+            samples.append((time.perf_counter() - started, 0, response.status_code in scenario.expected))
+        return samples
+
+    async def run():
+        batches = await asyncio.gather(*(worker() for _ in range(clients)))
+        return [sample for batch in batches for sample in batch]
+
+    # Database work of concurrent tasks shares this thread's connection, so
+    # queries can only be counted for the whole run
+    with CaptureQueriesContext(connections['default']) as queries:
+        started = time.perf_counter()
+        samples = async_to_sync(run)()
+        wall = time.perf_counter() - started
+    summary = summarize(samples, wall)
+    summary['queries_per_request'] = {'mean': round(len(queries) / len(samples), 2) if samples else 0.0, 'max': None}
+    return summary
+
+
+def summarize(samples, wall):
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    queries = [count for _, count, _ in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, ok in samples if not ok),
+        'throughput_rps': round(len(samples) / wall, 1) if wall else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'max': round(latencies[-1], 3) if latencies else 0.0,
+        },
+        'queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else 0.0,
+            'max': max(queries, default=0),
+        },
+    }
+
+
+def failing(results, max_error_rate=0.5):
+    """List the scenarios where more than ``max_error_rate`` of the requests failed"""
+    return [
+        f"{name}: {summary['errors']} of {summary['requests']} requests failed"
+        for name, summary in results['scenarios'].items()
+        if summary['requests'] and summary['errors'] > summary['requests'] * max_error_rate
+    ]
+
+
+def compare(results, baseline, tolerance=0.2):
+    """List the scenarios that regressed against ``baseline``.
+
+    Latency, throughput and query counts may drift by ``tolerance`` (a
+    fraction) before they count as a regression. Query counts only vary where
+    a write takes a different path, such as creating a rollup row instead of
+    updating it.
+    """
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        if current['latency_ms']['p95'] > previous['latency_ms']['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['latency_ms']['p95']}ms > baseline {previous['latency_ms']['p95']}ms")
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['throughput_rps']} req/s < baseline {previous['throughput_rps']} req/s")
+        if current['queries_per_request']['mean'] > previous['queries_per_request']['mean'] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {current['queries_per_request']['mean']} queries/request"
+                f" > baseline {previous['queries_per_request']['mean']}"
+            )
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: {current['errors']} errors > baseline {previous['errors']}")
+    return regressions
@@ -0,0 +1,73 @@
+"""Read-only fast path for list and retrieve requests.
+
+``ModelSerializer`` builds a model instance per row and walks its fields one
+``to_representation`` call at a time. For serializers made only of plain
+columns the same output can be produced from ``QuerySet.values()`` rows with
+a row encoder compiled once per serializer class: a generated function that
+builds the representation dict in a single expression, calling a field's
+``to_representation`` only where it does more than return the value as is
+(dates and datetimes).
+
+The encoder replicates DRF's rules (None stays None, keys in field order), so
+responses are identical to those of the regular serializers. An encoder for a
+sparse fieldset (``?fields=``) fetches and renders only those fields.
+"""
+from django.conf import settings
+from rest_framework import serializers
+
+# Fields whose to_representation returns database values unchanged
+_PASSTHROUGH = (serializers.IntegerField, serializers.CharField, serializers.PrimaryKeyRelatedField)
+
+
+class RowEncoder:
+    """Compiled ``values()`` row to representation converter for a serializer.
+
+    ``columns`` are the model attributes to fetch; calling the encoder on a
+    row dict returns the same dict the serializer would produce, limited to
+    ``fields`` if given.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        serializer = serializer_class()
+        model = serializer.Meta.model
+        self.columns = []
+        namespace = {}
+        entries = []
+        for position, field in enumerate(serializer._readable_fields):
+            if fields is not None and field.field_name not in fields:
+                continue
+            if isinstance(field, serializers.ManyRelatedField) or isinstance(field, serializers.BaseSerializer):
+                raise TypeError(f'{serializer_class.__name__}.{field.field_name} is not a plain column')
+            if field.source == '*' or '.' in field.source:
+                raise TypeError(f'{serializer_class.__name__}.{field.field_name} is not a plain column')
+            column = model._meta.get_field(field.source).attname
+            self.columns.append(column)
+            value = f'row[{column!r}]'
+            if not isinstance(field, _PASSTHROUGH):
+                namespace[f'convert_{position}'] = field.to_representation
+                value = f'(None if {value} is None else convert_{position}({value}))'
+            entries.append(f'{field.field_name!r}: {value}')
+        source = 'def encode(row):\n    return {' + ', '.join(entries) + '}\n'
+        exec(compile(source, f'<RowEncoder {serializer_class.__name__}>', 'exec'), namespace)
+        self.encode = namespace['encode']
+
+    def __call__(self, row):
+        return self.encode(row)
+
+
+_encoders = {}
+
+
+def get_encoder(serializer_class, fields=None):
+    """The cached encoder for ``serializer_class``, or None if it has no fast path"""
+    key = (serializer_class, fields)
+    if key not in _encoders:
+        try:
+            _encoders[key] = RowEncoder(serializer_class, fields)
+        except TypeError:
+            _encoders[key] = None
+    return _encoders[key]
+
+
+def fast_reads_enabled():
+    return getattr(settings, 'OCTOFIT_FAST_READS', True)
@@ -0,0 +1,105 @@
+"""Query parameter filters shared by the API views and management commands."""
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Team
+
+
+def parse_moment(name, value, end_of_day=False):
+    """Parse an ISO date or datetime into an aware datetime.
+
+    A bare date means the start of that day, or its end when ``end_of_day``
+    is set, so ``until=2025-05-31`` includes the whole of May 31st.
+    """
+    try:
+        day = parse_date(value)
+        if day is not None:
+            moment = datetime.combine(day, time.max if end_of_day else time.min)
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValueError(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected an ISO 8601 date or datetime.'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, timezone.utc)
+    return moment
+
+
+def _int_values(name, value):
+    try:
+        return [int(part) for part in value.split(',') if part]
+    except ValueError:
+        raise ValidationError({name: 'Expected a comma separated list of ids.'})
+
+
+def team_member_ids(team_ids):
+    return list(Team.members.through.objects.filter(team_id__in=team_ids).values_list('user_id', flat=True).distinct())
+
+
+def activity_criteria(params):
+    """The activity filters of ``params`` as plain values.
+
+    Returns a dict with any of ``user_ids`` (a set, team filters resolved to
+    their members), ``activity_type``, ``since`` and ``until``.
+    """
+    criteria = {}
+    if params.get('user'):
+        criteria['user_ids'] = set(_int_values('user', str(params['user'])))
+    if params.get('team'):
+        members = set(team_member_ids(_int_values('team', str(params['team']))))
+        criteria['user_ids'] = criteria['user_ids'] & members if 'user_ids' in criteria else members
+    if params.get('activity_type'):
+        criteria['activity_type'] = params['activity_type']
+    if params.get('since'):
+        criteria['since'] = parse_moment('since', params['since'])
+    if params.get('until'):
+        criteria['until'] = parse_moment('until', params['until'], end_of_day=True)
+    return criteria
+
+
+def filter_activities(queryset, params):
+    """Apply the ``user``, ``team``, ``activity_type``, ``since`` and ``until`` filters.
+
+    ``params`` is any mapping such as ``request.query_params`` or the options
+    of a management command; missing or empty values are ignored. Team
+    filters are resolved to member ids first so the activity query stays a
+    plain ``user_id IN (...)`` lookup. Every combination is served by one of
+    the ``(user, date)``, ``(activity_type, date)`` or ``(date, id)`` indexes.
+    """
+    criteria = activity_criteria(params)
+    if 'user_ids' in criteria:
+        queryset = queryset.filter(user_id__in=sorted(criteria['user_ids']))
+    if 'activity_type' in criteria:
+        queryset = queryset.filter(activity_type=criteria['activity_type'])
+    if 'since' in criteria:
+        queryset = queryset.filter(date__gte=criteria['since'])
+    if 'until' in criteria:
+        queryset = queryset.filter(date__lte=criteria['until'])
+    return queryset
+
+
+def filter_rollups(queryset, params):
+    """Apply ``user``, ``team``, ``activity_type``, ``since`` and ``until`` to rollups"""
+    if params.get('user'):
+        queryset = queryset.filter(user_id__in=_int_values('user', str(params['user'])))
+    if params.get('team'):
+        queryset = queryset.filter(user_id__in=team_member_ids(_int_values('team', str(params['team']))))
+    if params.get('activity_type'):
+        queryset = queryset.filter(activity_type=params['activity_type'])
+    if params.get('since'):
+        queryset = queryset.filter(day__gte=parse_moment('since', params['since']).date())
+    if params.get('until'):
+        queryset = queryset.filter(day__lte=parse_moment('until', params['until'], end_of_day=True).date())
+    return queryset
+
+
+class ActivityFilterBackend(BaseFilterBackend):
+    """Applies ``filter_activities`` to the query parameters of a request"""
+
+    def filter_queryset(self, request, queryset, view):
+        return filter_activities(queryset, request.query_params)
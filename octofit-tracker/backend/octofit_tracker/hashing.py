@@ -0,0 +1,17 @@
+"""Password hashing run in worker processes by ``octofit_tracker.imports``.
+
+This module must stay importable before Django is set up: spawned workers
+import it to unpickle their tasks, and only then run ``init_worker``.
+"""
+import django
+
+
+def init_worker():
+    django.setup()
+
+
+def hash_passwords(passwords):
+    """``make_password`` for each password, None or blank ones made unusable"""
+    from django.contrib.auth.hashers import make_password
+
+    return [make_password(password or None) for password in passwords]
@@ -0,0 +1,213 @@
+"""Bulk user imports from CSV or NDJSON.
+
+Rows are read one at a time and handled in chunks of ``CHUNK_SIZE``: a chunk
+is validated, its emails are checked against the database with one query and
+against the earlier rows of the import, and the accepted rows are written
+with a single ``bulk_create``. Memory use is bounded by the chunk size, not
+by the size of the import.
+
+Password hashing is deliberately slow and dominates the cost of an import,
+so the passwords of a chunk are hashed in slices on a pool of ``WORKERS``
+processes while the previous chunk is written. Import time
+therefore shrinks roughly linearly with the number of cores until the
+database becomes the bottleneck. ``manage.py import_users`` gets a pool of
+its own; the API requests of a server process share one pool of
+``REQUEST_WORKERS`` processes, so that concurrent imports on every server
+worker cannot start a process per core each.
+
+Every row gets a result with its ``index`` and a ``status`` of ``created``,
+``duplicate`` (the email is taken, or used by an earlier row) or ``invalid``
+(with ``errors``); bad rows never stop the import. The API answers with the
+counts and the first ``MAX_REPORTED`` rows that were not created.
+"""
+import csv
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+
+from . import versions
+from .hashing import hash_passwords, init_worker
+from .models import User
+from .serializers import UserImportItemSerializer
+
+IMPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+REQUIRED_COLUMNS = ('email', 'name')
+
+DEFAULTS = {
+    # Hashing processes of import_users, None for one per core
+    'WORKERS': None,
+    # Hashing processes shared by the API imports of a server process
+    'REQUEST_WORKERS': 2,
+    'CHUNK_SIZE': 1000,
+    # Rejected rows listed in an API response
+    'MAX_REPORTED': 100,
+}
+# Passwords hashed per task, small enough to spread a chunk over every core
+HASH_SLICE = 50
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_IMPORTS', {})}
+
+
+def read_rows(lines, import_format):
+    """Yield the rows of CSV or NDJSON text ``lines`` as dicts.
+
+    A line that cannot be parsed is yielded as the ``ValidationError`` that
+    describes it, so that it is reported with its index like any other row.
+    """
+    if import_format == 'csv':
+        reader = csv.DictReader(lines)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ValidationError({'columns': f'Missing CSV columns: {", ".join(missing)}.'})
+        yield from reader
+        return
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            yield ValidationError({'non_field_errors': [f'Invalid JSON: {exc}']})
+
+
+def create_hash_pool(workers=None):
+    """A process pool for ``hash_passwords``, or None to hash in this process"""
+    workers = workers or get_config()['WORKERS'] or os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    # Spawned rather than forked, the server may be running threads
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hash_pool():
+    """The process pool shared by the requests of this process, ``REQUEST_WORKERS`` large"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_hash_pool(get_config()['REQUEST_WORKERS']) or False
+    return _pool or None
+
+
+def _start_hashing(pool, passwords):
+    """Hash ``passwords`` on ``pool`` in slices, returning a callable for the hashes"""
+    if pool is None:
+        hashed = hash_passwords(passwords)
+        return lambda: hashed
+    slices = [passwords[start:start + HASH_SLICE] for start in range(0, len(passwords), HASH_SLICE)]
+    futures = [pool.submit(hash_passwords, part) for part in slices]
+    return lambda: [value for future in futures for value in future.result()]
+
+
+class UserImport:
+    """Imports rows of user data, counting the outcomes in ``summary``.
+
+    ``pool`` is a ``create_hash_pool`` executor to hash passwords on; without
+    one they are hashed in this process.
+    """
+
+    def __init__(self, pool=None, chunk_size=None):
+        self.pool = pool
+        self.chunk_size = chunk_size or get_config()['CHUNK_SIZE']
+        self.validator = UserImportItemSerializer()
+        # Email -> index of the row that claimed it in this import
+        self.seen = {}
+        self.summary = {'created': 0, 'duplicate': 0, 'invalid': 0}
+
+    def run(self, rows):
+        """Create users from ``rows`` dicts, yielding one result per row in order"""
+        pending = None
+        for chunk in self._chunks(rows):
+            prepared = self._prepare(chunk)
+            if pending is not None:
+                yield from self._write(*pending)
+            pending = prepared
+        if pending is not None:
+            yield from self._write(*pending)
+
+    def _chunks(self, rows):
+        chunk = []
+        for item in enumerate(rows):
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _prepare(self, chunk):
+        """Validate a chunk and start hashing the passwords of its new users"""
+        results, valid = {}, []
+        for index, row in chunk:
+            try:
+                if isinstance(row, ValidationError):
+                    raise row
+                valid.append((index, self.validator.run_validation(row)))
+            except ValidationError as exc:
+                results[index] = {'index': index, 'status': 'invalid', 'errors': exc.detail}
+        taken = set(User.objects.filter(email__in=[data['email'] for _, data in valid]).values_list('email', flat=True))
+        accepted = []
+        for index, data in valid:
+            email = data['email']
+            if email in self.seen:
+                results[index] = {'index': index, 'status': 'duplicate', 'email': email, 'duplicate_of': self.seen[email]}
+            elif email in taken:
+                results[index] = {'index': index, 'status': 'duplicate', 'email': email}
+            else:
+                self.seen[email] = index
+                accepted.append((index, data))
+        return results, accepted, _start_hashing(self.pool, [data.get('password') for _, data in accepted])
+
+    def _write(self, results, accepted, hashed):
+        users = [
+            (index, User(email=data['email'], name=data['name'], password=password))
+            for (index, data), password in zip(accepted, hashed())
+        ]
+        try:
+            self._insert([user for _, user in users])
+        except IntegrityError:
+            # Another writer took some of the emails since the chunk was checked
+            users = self._insert_each(users, results)
+        for index, user in users:
+            results[index] = {'index': index, 'status': 'created', 'id': user.pk, 'email': user.email}
+        for index in sorted(results):
+            self.summary[results[index]['status']] += 1
+            yield results[index]
+
+    def _insert(self, users):
+        if not users:
+            return
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            # bulk_create sends no post_save
+            versions.changed('User')
+
+    def _insert_each(self, users, results):
+        """Insert ``(index, user)`` pairs one at a time, reporting the emails taken meanwhile as duplicates"""
+        created = []
+        with transaction.atomic():
+            for index, user in users:
+                try:
+                    with transaction.atomic():
+                        User.objects.bulk_create([user])
+                except IntegrityError:
+                    results[index] = {'index': index, 'status': 'duplicate', 'email': user.email}
+                else:
+                    created.append((index, user))
+            if created:
+                versions.changed('User')
+        return created
@@ -0,0 +1,119 @@
+"""Batch activity ingestion for device syncs.
+
+A batch is validated in one pass, its users are resolved with one query per
+chunk of ids, duplicates are detected by idempotency key and the remaining
+rows are written with ``bulk_create``. Derived data is then updated once for
+the whole batch instead of once per row.
+
+Idempotency keys are scoped to their user and unique per user in the
+database. When a concurrent retry stores some of the keys between the lookup
+and the insert, the insert fails as a whole; the keys are then looked up
+again, the stored ones reported as duplicates and the rest inserted.
+"""
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+
+from . import signals
+from .models import Activity, User
+from .serializers import ActivityBatchItemSerializer
+
+LOOKUP_CHUNK_SIZE = 500
+INSERT_BATCH_SIZE = 500
+# Inserts retried after losing keys to concurrent uploads
+INSERT_ATTEMPTS = 3
+
+
+def _chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _existing_user_ids(user_ids):
+    found = set()
+    for chunk in _chunks(user_ids, LOOKUP_CHUNK_SIZE):
+        found.update(User.objects.filter(id__in=chunk).values_list('id', flat=True))
+    return found
+
+
+def _existing_keys(user_keys):
+    """``{(user_id, key): activity id}`` of the stored ``(user_id, key)`` pairs"""
+    user_keys = set(user_keys)
+    found = {}
+    for chunk in _chunks(user_keys, LOOKUP_CHUNK_SIZE):
+        rows = Activity.objects.filter(
+            user_id__in={user_id for user_id, _ in chunk},
+            idempotency_key__in={key for _, key in chunk},
+        ).values_list('user_id', 'idempotency_key', 'id')
+        found.update(((user_id, key), pk) for user_id, key, pk in rows if (user_id, key) in user_keys)
+    return found
+
+
+def ingest_activities(items):
+    """Validate and store ``items``, returning one result dict per item.
+
+    Each result has the item ``index`` and a ``status`` of ``created``,
+    ``duplicate`` (its idempotency key was already stored) or ``invalid``
+    (with ``errors``). Invalid items do not prevent the others from being
+    stored.
+    """
+    validator = ActivityBatchItemSerializer()
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, validator.run_validation(item)))
+        except ValidationError as exc:
+            results[index] = {'index': index, 'status': 'invalid', 'errors': exc.detail}
+
+    known_users = _existing_user_ids({data['user'] for _, data in valid})
+    stored_keys = _existing_keys({(data['user'], data['idempotency_key']) for _, data in valid if data.get('idempotency_key')})
+    pending, batch_keys = [], {}
+    for index, data in valid:
+        key = data.get('idempotency_key')
+        user_key = (data['user'], key)
+        if data['user'] not in known_users:
+            results[index] = {
+                'index': index, 'status': 'invalid',
+                'errors': {'user': [f'Invalid pk "{data["user"]}" - object does not exist.']},
+            }
+        elif key and user_key in stored_keys:
+            results[index] = {'index': index, 'status': 'duplicate', 'id': stored_keys[user_key], 'idempotency_key': key}
+        elif key and user_key in batch_keys:
+            results[index] = {'index': index, 'status': 'duplicate', 'duplicate_of': batch_keys[user_key], 'idempotency_key': key}
+        else:
+            if key:
+                batch_keys[user_key] = index
+            pending.append((index, Activity(
+                user_id=data['user'],
+                activity_type=data['activity_type'],
+                duration=data['duration'],
+                date=data['date'],
+                idempotency_key=key,
+            )))
+
+    for attempt in range(INSERT_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                created = Activity.objects.bulk_create([activity for _, activity in pending], batch_size=INSERT_BATCH_SIZE)
+                signals.activities_created(created)
+            break
+        except IntegrityError:
+            # Keys stored by a concurrent upload since they were looked up
+            stored_keys = _existing_keys({
+                (activity.user_id, activity.idempotency_key) for _, activity in pending if activity.idempotency_key
+            })
+            if not stored_keys or attempt == INSERT_ATTEMPTS - 1:
+                raise
+            remaining = []
+            for index, activity in pending:
+                activity.pk = None
+                stored = stored_keys.get((activity.user_id, activity.idempotency_key))
+                if stored is None:
+                    remaining.append((index, activity))
+                else:
+                    results[index] = {'index': index, 'status': 'duplicate', 'id': stored, 'idempotency_key': activity.idempotency_key}
+            pending = remaining
+    for index, activity in pending:
+        results[index] = {'index': index, 'status': 'created', 'id': activity.pk, 'idempotency_key': activity.idempotency_key}
+    return results
@@ -0,0 +1,248 @@
+"""Per-request performance instrumentation.
+
+``PerformanceMiddleware`` measures a sample of requests: total and view
+time, time spent in serializers and named ``timed()`` blocks, and the count,
+total time and slowest of the database queries. The figures are returned in
+a ``Server-Timing`` header and aggregated per route into ``registry``, which
+``/api/metrics/`` exposes.
+
+Unsampled requests only pay for a random draw, and ``timed()`` blocks outside
+a sampled request only for a context variable lookup.
+
+The middleware runs natively under ASGI too. Async views issue their queries
+from asgiref worker threads whose connections it does not wrap, so database
+figures are only collected for sync views.
+"""
+import asyncio
+import heapq
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+DEFAULTS = {
+    'SAMPLE_RATE': 1.0,
+    'SLOW_QUERIES': 5,
+    'SERVER_TIMING': True,
+}
+# Upper bounds in milliseconds of the latency histogram buckets
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_current = ContextVar('octofit_request_metrics', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_PERFORMANCE', {})}
+
+
+class RequestMetrics:
+    """Measurements collected while one request is processed"""
+
+    def __init__(self, slow_queries):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.timings = {}
+        self.db_count = 0
+        self.db_time = 0.0
+        self.slow_queries = []
+        self._slow_limit = slow_queries
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def record_query(self, sql, seconds):
+        self.db_count += 1
+        self.db_time += seconds
+        if self._slow_limit:
+            entry = (seconds, self.db_count, sql)
+            if len(self.slow_queries) < self._slow_limit:
+                heapq.heappush(self.slow_queries, entry)
+            elif entry > self.slow_queries[0]:
+                heapq.heapreplace(self.slow_queries, entry)
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, time.perf_counter() - started)
+
+    def slowest(self):
+        return [
+            {'sql': sql, 'ms': round(seconds * 1000, 3)}
+            for seconds, _, sql in sorted(self.slow_queries, reverse=True)
+        ]
+
+
+def current_metrics():
+    return _current.get()
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's ``name`` timing"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_timing(name, time.perf_counter() - started)
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.view_ms = 0.0
+        self.db_ms = 0.0
+        self.db_queries = 0
+        self.timings_ms = {}
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.slow_queries = []
+
+    def add(self, total_ms, view_ms, metrics, slow_limit):
+        self.count += 1
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, total_ms)
+        self.view_ms += view_ms
+        self.db_ms += metrics.db_time * 1000
+        self.db_queries += metrics.db_count
+        for name, seconds in metrics.timings.items():
+            self.timings_ms[name] = self.timings_ms.get(name, 0.0) + seconds * 1000
+        bucket = 0
+        while bucket < len(HISTOGRAM_BUCKETS) and total_ms > HISTOGRAM_BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+        for query in metrics.slowest():
+            self.slow_queries.append(query)
+        self.slow_queries = sorted(self.slow_queries, key=lambda query: query['ms'], reverse=True)[:slow_limit]
+
+    def snapshot(self):
+        count = self.count or 1
+        return {
+            'requests': self.count,
+            'mean_ms': round(self.total_ms / count, 3),
+            'max_ms': round(self.max_ms, 3),
+            'mean_view_ms': round(self.view_ms / count, 3),
+            'mean_db_ms': round(self.db_ms / count, 3),
+            'mean_db_queries': round(self.db_queries / count, 2),
+            'mean_timings_ms': {name: round(total / count, 3) for name, total in self.timings_ms.items()},
+            'histogram_ms': {
+                **{f'le_{bound}': hits for bound, hits in zip(HISTOGRAM_BUCKETS, self.histogram)},
+                'le_inf': self.histogram[-1],
+            },
+            'slow_queries': self.slow_queries,
+        }
+
+
+class MetricsRegistry:
+    """Per-route aggregates of the sampled requests of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, total_ms, view_ms, metrics, slow_limit):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+            stats.add(total_ms, view_ms, metrics, slow_limit)
+
+    def snapshot(self):
+        with self._lock:
+            return {route: stats.snapshot() for route, stats in sorted(self._routes.items())}
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+
+registry = MetricsRegistry()
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return f'{request.method} unresolved'
+    return f'{request.method} {match.view_name or match.route}'
+
+
+def server_timing(total_ms, view_ms, metrics):
+    parts = [
+        f'total;dur={total_ms:.3f}',
+        f'view;dur={view_ms:.3f}',
+        f'db;dur={metrics.db_time * 1000:.3f};desc="{metrics.db_count} queries"',
+    ]
+    parts += [f'{name};dur={seconds * 1000:.3f}' for name, seconds in metrics.timings.items()]
+    return ', '.join(parts)
+
+
+class PerformanceMiddleware:
+    """Measures sampled requests, see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        config = get_config()
+        self.sample_rate = float(config['SAMPLE_RATE'])
+        self.slow_queries = int(config['SLOW_QUERIES'])
+        self.server_timing = bool(config['SERVER_TIMING'])
+
+    def sampled(self):
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        metrics = RequestMetrics(self.slow_queries)
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.db_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        metrics = RequestMetrics(self.slow_queries)
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        finished = time.perf_counter()
+        total_ms = (finished - metrics.started) * 1000
+        view_ms = (finished - metrics.view_started) * 1000 if metrics.view_started else 0.0
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(total_ms, view_ms, metrics)
+        registry.record(_route(request), total_ms, view_ms, metrics, self.slow_queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
+        return None
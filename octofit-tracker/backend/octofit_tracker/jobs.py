@@ -0,0 +1,294 @@
+"""Deferred, debounced recomputation of derived data.
+
+With ``OCTOFIT_DERIVED_DATA = 'deferred'`` activity and membership writes no
+longer update the leaderboard, team counters, rollups and duration sketches
+themselves. They enqueue keyed
+``Job`` rows instead, in the writing transaction, and the ``run_jobs``
+management command recomputes the affected rows in the background.
+
+Jobs are keyed by what they recompute (``team:42``, ``rollup:7:2024-05-01``,
+``sketch:run:2024-05``),
+so a burst of writes to one team becomes a single job: every enqueue of a
+pending key pushes its ``available_at`` back by ``DEBOUNCE`` seconds, but
+never past ``MAX_DELAY`` after the job was first enqueued, so a team that is
+written to constantly is still recomputed. Every enqueue also bumps the job
+version; a job enqueued again while it runs is kept and runs once more.
+
+Workers claim due jobs with a lease, run them merged per kind (one query for
+fifty teams rather than fifty) on a bounded thread pool, and delete them on
+success. Failed jobs are retried with exponential backoff and marked failed
+after ``MAX_ATTEMPTS``. A worker that dies leaves its lease to expire, after
+which the jobs are claimed again. Recomputation is idempotent, so running a
+job twice is harmless.
+
+The default ``'inline'`` mode keeps updating derived data in the request.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import leaderboard, rollups, sketches, teams
+from .models import ActivityRollup, ActivitySummary, Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Seconds a job waits for more writes to the same key
+    'DEBOUNCE': 2.0,
+    # Upper bound on how long debouncing may postpone a job
+    'MAX_DELAY': 30.0,
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 5,
+    # Retry n waits BACKOFF * 2 ** (n - 1) seconds
+    'BACKOFF': 5.0,
+    # Seconds between polls of an idle queue
+    'POLL': 1.0,
+    # Jobs claimed at once, and the most targets merged into one handler call
+    'BATCH': 200,
+    # Seconds a claimed job stays locked, after that other workers retry it
+    'LEASE': 300.0,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_JOBS', {})}
+
+
+def deferred():
+    """Whether derived data is recomputed by ``run_jobs`` instead of inline"""
+    return getattr(settings, 'OCTOFIT_DERIVED_DATA', 'inline') == 'deferred'
+
+
+def _recompute_teams(targets):
+    team_ids = [int(target) for target in targets]
+    leaderboard.recompute_teams(team_ids)
+    teams.rebuild_counters(team_ids)
+
+
+def _recompute_rollups(targets):
+    pairs = []
+    for target in targets:
+        user_id, day = target.split(':')
+        pairs.append((int(user_id), parse_date(day)))
+    rollups.recompute(pairs)
+
+
+def _recompute_sketches(targets):
+    sketches.recompute(tuple(target.rsplit(':', 1)) for target in targets)
+
+
+HANDLERS = {
+    'team': _recompute_teams,
+    'rollup': _recompute_rollups,
+    'sketch': _recompute_sketches,
+}
+
+
+def enqueue(kind, targets):
+    """Enqueue a ``kind`` job for each target, merging into pending jobs"""
+    enqueue_many({kind: targets})
+
+
+def enqueue_many(targets_by_kind):
+    """``enqueue`` the ``{kind: targets}`` jobs, all kinds in the same queries"""
+    for kind in targets_by_kind:
+        if kind not in HANDLERS:
+            raise ValueError(f'Unknown job kind {kind!r}')
+    jobs = {
+        f'{kind}:{target}': (kind, str(target))
+        for kind, targets in targets_by_kind.items() for target in targets
+    }
+    if not jobs:
+        return
+    config = get_config()
+    now = timezone.now()
+    available_at = now + timedelta(seconds=config['DEBOUNCE'])
+    pending = Job.objects.filter(key__in=list(jobs))
+    pending.filter(enqueued_at__gt=now - timedelta(seconds=config['MAX_DELAY'])).update(available_at=available_at)
+    # New writes may well fix what made a job fail, give it another go
+    pending.update(version=F('version') + 1, failed=False, attempts=0)
+    existing = set(pending.values_list('key', flat=True))
+    Job.objects.bulk_create([
+        Job(key=key, kind=kind, target=target, enqueued_at=now, available_at=available_at)
+        for key, (kind, target) in jobs.items() if key not in existing
+    ], ignore_conflicts=True)
+
+
+def activities_changed(states):
+    """Enqueue the recomputations for activity states (``user_id``, ``activity_type``, ``date``)"""
+    states = [state for state in states if state is not None]
+    if not states:
+        return
+    user_ids = {state.user_id for state in states}
+    team_ids = leaderboard.Membership.objects.filter(user_id__in=list(user_ids)).values_list('team_id', flat=True)
+    enqueue_many({
+        'team': set(team_ids),
+        'rollup': {f'{state.user_id}:{rollups.activity_day(state.date).isoformat()}' for state in states},
+        'sketch': {f'{state.activity_type}:{sketches.period_of(state.date)}' for state in states},
+    })
+
+
+def members_changed(team_ids, user_ids):
+    """Enqueue the recomputations for ``user_ids`` joining or leaving ``team_ids``.
+
+    The sketch months are read from the users' rollups and archive
+    summaries; months of writes the rollups do not show yet have their own
+    sketch jobs pending.
+    """
+    user_ids = list(user_ids)
+    days = ActivityRollup.objects.filter(user_id__in=user_ids).values_list('activity_type', 'day')
+    months = ActivitySummary.objects.filter(user_id__in=user_ids).values_list('activity_type', 'month')
+    enqueue_many({
+        'team': set(team_ids),
+        'sketch': {f'{activity_type}:{day:%Y-%m}' for rows in (days, months) for activity_type, day in rows.distinct()},
+    })
+
+
+def claim(limit, lease, worker=None):
+    """Lock up to ``limit`` due jobs for ``lease`` seconds and return them"""
+    now = timezone.now()
+    token = f'{worker or os.getpid()}:{uuid.uuid4().hex[:12]}'
+    claimable = Q(failed=False, available_at__lte=now) & (Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+    ids = list(Job.objects.filter(claimable).order_by('available_at').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    # The claimable condition is repeated so that racing workers claim each job once
+    Job.objects.filter(claimable, id__in=ids).update(
+        locked_by=token, locked_until=now + timedelta(seconds=lease),
+    )
+    return list(Job.objects.filter(locked_by=token))
+
+
+def complete(jobs):
+    """Delete finished jobs, unless they were enqueued again meanwhile"""
+    by_version = defaultdict(list)
+    for job in jobs:
+        by_version[job.version].append(job.id)
+    for version, ids in by_version.items():
+        Job.objects.filter(id__in=ids, version=version).delete()
+    # Whatever is left was re-enqueued while running
+    Job.objects.filter(id__in=[job.id for job in jobs], locked_by__in={job.locked_by for job in jobs}).update(
+        locked_by=None, locked_until=None,
+    )
+
+
+def fail(jobs, error, config):
+    """Schedule a retry of failed jobs, or give up on them after ``MAX_ATTEMPTS``"""
+    now = timezone.now()
+    for job in jobs:
+        attempts = job.attempts + 1
+        delay = config['BACKOFF'] * 2 ** (attempts - 1)
+        Job.objects.filter(id=job.id, locked_by=job.locked_by).update(
+            attempts=attempts, failed=attempts >= config['MAX_ATTEMPTS'], last_error=error[:2000],
+            available_at=now + timedelta(seconds=delay), locked_by=None, locked_until=None,
+        )
+
+
+def run_batch(kind, jobs, config):
+    """Run one handler call for ``jobs`` of the same kind, returning how many succeeded"""
+    try:
+        HANDLERS[kind]([job.target for job in jobs])
+    except Exception as exc:
+        logger.exception('%s jobs failed: %s', kind, ', '.join(job.target for job in jobs[:10]))
+        fail(jobs, f'{type(exc).__name__}: {exc}', config)
+        return 0
+    complete(jobs)
+    return len(jobs)
+
+
+class JobRunner:
+    """Claims due jobs and runs them on up to ``workers`` threads.
+
+    With a single worker batches run in the calling thread.
+    """
+
+    def __init__(self, workers=None, batch=None, poll=None, config=None):
+        self.config = config or get_config()
+        self.workers = max(workers or self.config['WORKERS'], 1)
+        self.batch = batch or self.config['BATCH']
+        self.poll = self.config['POLL'] if poll is None else poll
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self._pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+    def run_once(self):
+        """Run every job due now, returning the number of jobs claimed"""
+        claimed = 0
+        while not self.stopping.is_set():
+            jobs = claim(self.batch, self.config['LEASE'], self.name)
+            if not jobs:
+                break
+            claimed += len(jobs)
+            self.run_jobs(jobs)
+        return claimed
+
+    def run_forever(self):
+        while not self.stopping.is_set():
+            if not self.run_once():
+                self.stopping.wait(self.poll)
+
+    def run_jobs(self, jobs):
+        by_kind = defaultdict(list)
+        for job in jobs:
+            by_kind[job.kind].append(job)
+        chunk_size = max(self.batch // self.workers, 1)
+        batches = [
+            (kind, kind_jobs[start:start + chunk_size])
+            for kind, kind_jobs in by_kind.items()
+            for start in range(0, len(kind_jobs), chunk_size)
+        ]
+        if self._pool is None:
+            results = [run_batch(kind, batch, self.config) for kind, batch in batches]
+        else:
+            results = list(self._pool.map(lambda item: self._run_in_thread(*item), batches))
+        for (_, batch), succeeded in zip(batches, results):
+            self.processed += succeeded
+            self.failed += len(batch) - succeeded
+
+    def _run_in_thread(self, kind, jobs):
+        try:
+            return run_batch(kind, jobs, self.config)
+        finally:
+            # Pool threads open database connections of their own
+            connection.close()
+
+    def stop(self):
+        self.stopping.set()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+def stats():
+    """Queue depth and lag, for ``/api/metrics/jobs/`` and ``run_jobs --stats``"""
+    now = timezone.now()
+    pending = Job.objects.filter(failed=False)
+    due = pending.filter(available_at__lte=now)
+    oldest = due.aggregate(enqueued=Min('enqueued_at'), available=Min('available_at'))
+    depth = dict(pending.order_by().values_list('kind').annotate(count=Count('id')))
+    return {
+        'mode': 'deferred' if deferred() else 'inline',
+        'pending': sum(depth.values()),
+        'pending_by_kind': depth,
+        'due': due.count(),
+        'running': pending.filter(locked_until__gt=now).count(),
+        'failed': Job.objects.filter(failed=True).count(),
+        # How long the oldest due job has waited since it was first enqueued,
+        # and since it became due
+        'lag_seconds': round((now - oldest['enqueued']).total_seconds(), 3) if oldest['enqueued'] else 0.0,
+        'overdue_seconds': round((now - oldest['available']).total_seconds(), 3) if oldest['available'] else 0.0,
+    }
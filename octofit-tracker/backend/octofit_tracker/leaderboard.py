@@ -0,0 +1,286 @@
+"""Activity-derived team leaderboard.
+
+A team's points are the total minutes of activity logged by its members.
+Points are kept up to date incrementally: every activity write or membership
+change turns into a per-team delta that is applied with a single
+``UPDATE ... SET points = points + delta`` and mirrored into an in-process
+``RankIndex``, so "top N", "rank of team X" and "teams around X" never scan or
+sort the whole table.
+
+The index only sees the writes of its own process directly. Writes of other
+workers, of ``run_jobs`` and of the rebuild commands are picked up by
+reloading it when the ``leaderboard`` collection version moved, which
+``get_rank_index`` checks at most every ``RELOAD_INTERVAL`` seconds.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import versions
+from .models import Activity, ActivitySummary, Leaderboard, Team
+
+Membership = Team.members.through
+
+
+# Seconds the rank index may lag the writes of other processes
+RELOAD_INTERVAL = 1.0
+
+
+def activity_points(duration):
+    """Points awarded for an activity of ``duration`` minutes"""
+    return max(int(duration or 0), 0)
+
+
+class RankIndex:
+    """Teams kept ordered by points for O(log n) rank lookups.
+
+    Entries are ``(-points, team_id)`` tuples in a sorted list, so the best
+    team is first and ties are broken by team id. Ranks use standard
+    competition ranking: teams with equal points share a rank.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []
+        self._points = {}
+        self.loaded = False
+        # Leaderboard version loaded, and when it was last compared
+        self.version = None
+        self.checked = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, rows, version=None):
+        """Replace the index contents with ``(team_id, points)`` rows"""
+        with self._lock:
+            self._points = {team_id: points for team_id, points in rows}
+            self._keys = sorted((-points, team_id) for team_id, points in self._points.items())
+            self.loaded = True
+            self.version = version
+
+    def reset(self):
+        with self._lock:
+            self._keys = []
+            self._points = {}
+            self.loaded = False
+            self.version = None
+            self.checked = None
+
+    def update(self, team_id, points):
+        with self._lock:
+            self._discard(team_id)
+            self._points[team_id] = points
+            insort(self._keys, (-points, team_id))
+
+    def update_many(self, points_by_team):
+        with self._lock:
+            for team_id, points in points_by_team.items():
+                self.update(team_id, points)
+
+    def remove(self, team_id):
+        with self._lock:
+            self._discard(team_id)
+
+    def _discard(self, team_id):
+        points = self._points.pop(team_id, None)
+        if points is not None:
+            position = bisect_left(self._keys, (-points, team_id))
+            del self._keys[position]
+
+    def points(self, team_id):
+        return self._points.get(team_id)
+
+    def teams(self):
+        with self._lock:
+            return list(self._points)
+
+    def teams_between(self, low, high):
+        """Teams with ``low <= points < high``, no lower bound if ``low`` is None"""
+        with self._lock:
+            start = bisect_right(self._keys, (-high, math.inf))
+            stop = len(self._keys) if low is None else bisect_right(self._keys, (-low, math.inf))
+            return [team_id for _, team_id in self._keys[start:stop]]
+
+    def rank(self, team_id):
+        """1-based rank of ``team_id``, or None if the team is not ranked"""
+        with self._lock:
+            points = self._points.get(team_id)
+            if points is None:
+                return None
+            return bisect_left(self._keys, (-points,)) + 1
+
+    def _entries(self, start, stop):
+        entries = []
+        for neg_points, team_id in self._keys[start:stop]:
+            rank = bisect_left(self._keys, (neg_points,)) + 1
+            entries.append({'team': team_id, 'points': -neg_points, 'rank': rank})
+        return entries
+
+    def top(self, n):
+        with self._lock:
+            return self._entries(0, max(n, 0))
+
+    def around(self, team_id, radius):
+        """Entries for ``team_id`` and up to ``radius`` teams on either side"""
+        with self._lock:
+            points = self._points.get(team_id)
+            if points is None:
+                return []
+            position = bisect_left(self._keys, (-points, team_id))
+            return self._entries(max(position - radius, 0), position + radius + 1)
+
+
+rank_index = RankIndex()
+
+
+def _check_due(now):
+    return not rank_index.loaded or rank_index.checked is None or now - rank_index.checked >= RELOAD_INTERVAL
+
+
+def get_rank_index():
+    """Return the process-wide rank index, (re)loading it if the standings changed elsewhere"""
+    if not _check_due(time.monotonic()):
+        return rank_index
+    with rank_index._lock:
+        if _check_due(time.monotonic()):
+            # Read before the rows: a write in between leaves the index a
+            # version behind and reloaded on the next check
+            version, _ = versions.current('leaderboard')
+            if not rank_index.loaded or version != rank_index.version:
+                rank_index.load(Leaderboard.objects.values_list('team_id', 'points'), version)
+            rank_index.checked = time.monotonic()
+    return rank_index
+
+
+def _ensure_rows(team_ids):
+    existing = set(Leaderboard.objects.filter(team_id__in=team_ids).values_list('team_id', flat=True))
+    missing = [team_id for team_id in team_ids if team_id not in existing]
+    if missing:
+        # Another writer may create the same rows meanwhile, the unique team
+        # constraint keeps one and its deltas then apply to it
+        Leaderboard.objects.bulk_create(
+            [Leaderboard(team_id=team_id, points=0) for team_id in missing], ignore_conflicts=True,
+        )
+
+
+def apply_team_deltas(deltas):
+    """Add ``{team_id: delta}`` points to the given teams in one transaction.
+
+    Teams that receive the same delta share a single UPDATE, so a write that
+    touches many teams costs a handful of queries.
+    """
+    deltas = {team_id: delta for team_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    teams_by_delta = defaultdict(list)
+    for team_id, delta in deltas.items():
+        teams_by_delta[delta].append(team_id)
+    now = timezone.now()
+    with transaction.atomic(savepoint=False):
+        _ensure_rows(list(deltas))
+        for delta, team_ids in teams_by_delta.items():
+            Leaderboard.objects.filter(team_id__in=team_ids).update(
+                points=F('points') + delta, last_updated=now,
+            )
+        points = dict(Leaderboard.objects.filter(team_id__in=list(deltas)).values_list('team_id', 'points'))
+        if rank_index.loaded:
+            transaction.on_commit(lambda: rank_index.update_many(points))
+
+
+def apply_user_deltas(deltas):
+    """Spread ``{user_id: delta}`` points over each user's teams"""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    team_deltas = defaultdict(int)
+    memberships = Membership.objects.filter(user_id__in=list(deltas)).values_list('user_id', 'team_id')
+    for user_id, team_id in memberships:
+        team_deltas[team_id] += deltas[user_id]
+    apply_team_deltas(team_deltas)
+
+
+def activity_changed(previous, current):
+    """Apply the points difference between two activity states.
+
+    States are anything with ``user_id`` and ``duration`` attributes; either
+    side may be None for a created or deleted activity.
+    """
+    deltas = defaultdict(int)
+    if previous is not None:
+        deltas[previous.user_id] -= activity_points(previous.duration)
+    if current is not None:
+        deltas[current.user_id] += activity_points(current.duration)
+    apply_user_deltas(deltas)
+
+
+def user_totals(user_ids=None):
+    """Total activity points per user, optionally limited to ``user_ids``.
+
+    Archived activities count through their monthly summaries.
+    """
+    activities = Activity.objects.all()
+    summaries = ActivitySummary.objects.all()
+    if user_ids is not None:
+        activities = activities.filter(user_id__in=list(user_ids))
+        summaries = summaries.filter(user_id__in=list(user_ids))
+    totals = defaultdict(int)
+    for row in activities.values('user_id').annotate(total=Sum('duration')):
+        totals[row['user_id']] += row['total'] or 0
+    for row in summaries.values('user_id').annotate(total=Sum('total_duration')):
+        totals[row['user_id']] += row['total'] or 0
+    return {user_id: activity_points(total) for user_id, total in totals.items()}
+
+
+def members_changed(team_ids, user_ids, sign):
+    """Credit (sign=1) or debit (sign=-1) the users' points to the teams"""
+    total = sum(user_totals(user_ids).values())
+    apply_team_deltas({team_id: sign * total for team_id in team_ids})
+
+
+def recompute_teams(team_ids):
+    """Recompute the points of ``team_ids`` from their members' activity"""
+    team_ids = list(Team.objects.filter(id__in=list(team_ids)).values_list('id', flat=True))
+    if not team_ids:
+        return {}
+    memberships = list(Membership.objects.filter(team_id__in=team_ids).values_list('team_id', 'user_id'))
+    totals = user_totals({user_id for _, user_id in memberships})
+    points = {team_id: 0 for team_id in team_ids}
+    for team_id, user_id in memberships:
+        points[team_id] += totals.get(user_id, 0)
+    teams_by_points = defaultdict(list)
+    for team_id, team_points in points.items():
+        teams_by_points[team_points].append(team_id)
+    now = timezone.now()
+    with transaction.atomic():
+        _ensure_rows(team_ids)
+        for team_points, ids in teams_by_points.items():
+            Leaderboard.objects.filter(team_id__in=ids).update(points=team_points, last_updated=now)
+        versions.bump('leaderboard')
+        if rank_index.loaded:
+            transaction.on_commit(lambda: rank_index.update_many(points))
+    return points
+
+
+def rebuild_leaderboard():
+    """Recompute every team's points from scratch and reload the rank index"""
+    totals = user_totals()
+    points = {team_id: 0 for team_id in Team.objects.values_list('id', flat=True)}
+    for user_id, team_id in Membership.objects.values_list('user_id', 'team_id'):
+        points[team_id] += totals.get(user_id, 0)
+    with transaction.atomic():
+        Leaderboard.objects.all().delete()
+        Leaderboard.objects.bulk_create(
+            [Leaderboard(team_id=team_id, points=team_points) for team_id, team_points in points.items()],
+            batch_size=1000,
+        )
+        versions.bump('leaderboard')
+        version, _ = versions.current('leaderboard')
+    rank_index.load(points.items(), version)
+    return points
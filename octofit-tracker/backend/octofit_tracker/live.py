@@ -0,0 +1,284 @@
+"""Live leaderboard updates over Server-Sent Events.
+
+``LeaderboardStream`` wraps the ASGI application and answers
+``GET /api/leaderboard/stream/`` with an ``text/event-stream`` of standings
+diffs. One ``Broadcaster`` per process polls ``Leaderboard`` for rows whose
+``last_updated`` moved, once per ``WINDOW``: every change of a team within a
+window is coalesced into one entry with its latest points and rank, and
+every team whose rank moved because of these changes gets an entry too, so
+a subscriber's standings stay right without reloading them. Writes from
+any process are picked up, not only from this one. A failing poll is
+logged and retried on the next window.
+
+Each event is encoded once and shared by all subscribers. Every subscriber
+has a queue of at most ``QUEUE_SIZE`` pending events; a client that falls
+that far behind is disconnected rather than buffered, and is expected to
+reconnect and reload the standings. ``?team=1,2`` limits a stream to some
+teams.
+
+Event payload::
+
+    event: standings
+    id: 42
+    data: {"changes": [{"team": 3, "points": 120, "rank": 2}], "removed": [], "teams": 50}
+"""
+import asyncio
+import json
+import logging
+from bisect import bisect_right
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from .leaderboard import RankIndex
+from .models import Leaderboard
+
+DEFAULTS = {
+    # Seconds between polls, changes within a window are coalesced
+    'WINDOW': 1.0,
+    # Events a subscriber may lag behind before it is dropped
+    'QUEUE_SIZE': 32,
+    'HEARTBEAT': 15.0,
+    # Seconds between full reloads, which also notice deleted teams
+    'RESYNC': 60.0,
+    # Rows are re-read this far behind the newest seen timestamp, as a write
+    # commits some time after it stamps last_updated
+    'OVERLAP': 5.0,
+}
+STREAM_PATH = '/api/leaderboard/stream/'
+
+logger = logging.getLogger(__name__)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_LIVE', {})}
+
+
+class Subscriber:
+    def __init__(self, teams, queue_size):
+        self.teams = teams
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+        self.started = False
+
+
+class Broadcaster:
+    """Polls the standings and fans the diffs out to the subscribers"""
+
+    def __init__(self, window, queue_size, resync, overlap):
+        self.window = window
+        self.queue_size = queue_size
+        self.resync = resync
+        self.overlap = timedelta(seconds=overlap)
+        self.subscribers = set()
+        self.index = RankIndex()
+        self.sequence = 0
+        self.dropped = 0
+        self._since = None
+        self._task = None
+
+    def subscribe(self, teams=None):
+        subscriber = Subscriber(teams, self.queue_size)
+        self.subscribers.add(subscriber)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        resynced = None
+        try:
+            while self.subscribers:
+                try:
+                    if resynced is None or loop.time() - resynced >= self.resync:
+                        changes, removed = await self.reload()
+                        resynced = loop.time()
+                    else:
+                        changes, removed = await self.poll(), {}
+                    self.publish(changes, removed)
+                except DatabaseError:
+                    logger.warning('Could not poll the leaderboard, retrying in %ss', self.window, exc_info=True)
+                    # Drop the connection if the error left it unusable
+                    await sync_to_async(close_old_connections)()
+                await asyncio.sleep(self.window)
+        except Exception:
+            logger.exception('The leaderboard broadcaster stopped')
+            raise
+        finally:
+            self._task = None
+
+    async def reload(self):
+        """Load every team, returning the changed and removed teams with their previous points"""
+        rows = [row async for row in Leaderboard.objects.values_list('team_id', 'points', 'last_updated')]
+        points = {team_id: team_points for team_id, team_points, _ in rows}
+        removed = {team_id: self.index.points(team_id) for team_id in self.index.teams() if team_id not in points}
+        changes = {team_id: self.index.points(team_id) for team_id, team_points in points.items()
+                   if self.index.points(team_id) != team_points}
+        first_load = not self.index.loaded
+        self.index.load(points.items())
+        self._since = max((updated for _, _, updated in rows), default=None)
+        return ({} if first_load else changes), removed
+
+    async def poll(self):
+        """Apply the rows updated since the last poll, returning the changed teams and their previous points"""
+        rows = Leaderboard.objects.values_list('team_id', 'points', 'last_updated')
+        if self._since is not None:
+            rows = rows.filter(last_updated__gte=self._since - self.overlap)
+        changes = {}
+        async for team_id, points, updated in rows:
+            if self._since is None or updated > self._since:
+                self._since = updated
+            if self.index.points(team_id) != points:
+                changes.setdefault(team_id, self.index.points(team_id))
+                self.index.update(team_id, points)
+        return changes
+
+    def moved(self, changes, removed):
+        """Unchanged teams whose rank moved because of ``changes`` and ``removed``.
+
+        Both map teams to their previous points (None for new teams). A rank
+        is one more than the number of teams with more points, so only teams
+        whose points a change crossed can move: those between its previous
+        and current points, or below the points of a new or removed team.
+        """
+        before, after, candidates = [], [], set()
+        for team_id, previous in changes.items():
+            current = self.index.points(team_id)
+            after.append(current)
+            if previous is None:
+                candidates.update(self.index.teams_between(None, current))
+            else:
+                before.append(previous)
+                candidates.update(self.index.teams_between(min(previous, current), max(previous, current)))
+        for previous in removed.values():
+            before.append(previous)
+            candidates.update(self.index.teams_between(None, previous))
+        before.sort()
+        after.sort()
+        moved = []
+        for team_id in candidates.difference(changes):
+            points = self.index.points(team_id)
+            if len(before) - bisect_right(before, points) != len(after) - bisect_right(after, points):
+                moved.append(team_id)
+        return sorted(moved)
+
+    def publish(self, changes, removed):
+        """Send ``changes`` and ``removed``, ``{team: previous points}``, and the rank moves they caused"""
+        if not changes and not removed:
+            return
+        self.sequence += 1
+        entries = [{'team': team_id, 'points': self.index.points(team_id), 'rank': self.index.rank(team_id)}
+                   for team_id in [*changes, *self.moved(changes, removed)]]
+        removed = list(removed)
+        encoded = {}
+        for subscriber in list(self.subscribers):
+            teams = subscriber.teams
+            if teams not in encoded:
+                selected = entries if teams is None else [entry for entry in entries if entry['team'] in teams]
+                gone = removed if teams is None else [team_id for team_id in removed if team_id in teams]
+                encoded[teams] = self.encode(selected, gone) if selected or gone else None
+            if encoded[teams] is None:
+                continue
+            try:
+                subscriber.queue.put_nowait(encoded[teams])
+            except asyncio.QueueFull:
+                self.drop(subscriber)
+
+    def encode(self, changes, removed):
+        data = json.dumps({'changes': changes, 'removed': removed, 'teams': len(self.index)}, separators=(',', ':'))
+        return f'event: standings\nid: {self.sequence}\ndata: {data}\n\n'.encode()
+
+    def drop(self, subscriber):
+        """Disconnect a subscriber that does not keep up"""
+        self.unsubscribe(subscriber)
+        self.dropped += 1
+        if subscriber.task is not None:
+            subscriber.task.cancel()
+
+
+_broadcaster = None
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        config = get_config()
+        _broadcaster = Broadcaster(config['WINDOW'], config['QUEUE_SIZE'], config['RESYNC'], config['OVERLAP'])
+    return _broadcaster
+
+
+class LeaderboardStream:
+    """ASGI middleware serving ``STREAM_PATH``, everything else goes to ``app``"""
+
+    def __init__(self, app, path=STREAM_PATH):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.app(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await self.respond(send, 405, b'Method not allowed', [(b'allow', b'GET')])
+        try:
+            teams = self.parse_teams(scope)
+        except ValueError:
+            return await self.respond(send, 400, b'Expected a comma separated list of team ids')
+        broadcaster = get_broadcaster()
+        subscriber = broadcaster.subscribe(teams)
+        subscriber.task = asyncio.ensure_future(self.stream(subscriber, send))
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            await asyncio.wait({subscriber.task, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+            subscriber.task.cancel()
+            disconnected.cancel()
+        if (disconnected.done() and not disconnected.cancelled()) or not subscriber.started:
+            return
+        # Dropped for lagging behind: end the response, unless the client
+        # cannot even take that
+        try:
+            await asyncio.wait_for(send({'type': 'http.response.body', 'body': b'', 'more_body': False}), 1.0)
+        except (asyncio.TimeoutError, OSError):
+            pass
+
+    async def stream(self, subscriber, send):
+        heartbeat = get_config()['HEARTBEAT']
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        subscriber.started = True
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n: connected\n\n', 'more_body': True})
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                event = b': heartbeat\n\n'
+            await send({'type': 'http.response.body', 'body': event, 'more_body': True})
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    def parse_teams(self, scope):
+        values = parse_qs(scope.get('query_string', b'').decode()).get('team')
+        if not values:
+            return None
+        return frozenset(int(part) for value in values for part in value.split(',') if part)
+
+    async def respond(self, send, status, body, headers=()):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain'), *headers]})
+        await send({'type': 'http.response.body', 'body': body})
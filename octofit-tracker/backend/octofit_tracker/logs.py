@@ -0,0 +1,173 @@
+"""Non-blocking, sampled logging.
+
+Logging handlers write to their stream or file in the thread that logs, so
+every log call of a request or a management command waits for the write.
+``start()``, called from ``AppConfig.ready``, moves the handlers of the
+``LOGGERS`` and of the loggers configured in ``settings.LOGGING`` behind a
+``QueueHandler``: the logging thread only merges the message with its
+arguments and puts the record on a bounded queue, and a single
+``QueueListener`` thread formats and writes it with the original handlers.
+When the queue is full records are dropped and counted, the caller never
+waits.
+
+The ``SAMPLED`` loggers log one line per SQL statement. ``SampleFilter``
+keeps a ``SAMPLE_RATE`` fraction of their records, and at most
+``MAX_PER_SECOND`` a second, before they are queued; warnings and errors
+are always kept. Both come from ``settings.OCTOFIT_LOGGING``, so each
+environment chooses how much SQL it logs without code changes.
+
+The listener thread does not survive ``fork()``: workers forked from a
+preloaded application start their own on a fresh queue.
+"""
+import atexit
+import copy
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+DEFAULTS = {
+    'QUEUE': True,
+    'QUEUE_SIZE': 10000,
+    'LOGGERS': ['', 'django', 'django.server'],
+    'SAMPLED': ['djongo', 'django.db.backends'],
+    'SAMPLE_RATE': 1.0,
+    'MAX_PER_SECOND': None,
+}
+
+_lock = threading.Lock()
+_listener = None
+_queue_handlers = []
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_LOGGING', {})}
+
+
+class SampleFilter(logging.Filter):
+    """Keeps a ``rate`` fraction of the records below WARNING, at most ``max_per_second`` a second"""
+
+    def __init__(self, rate=1.0, max_per_second=None):
+        super().__init__()
+        self.rate = rate
+        self.max_per_second = max_per_second
+        self._lock = threading.Lock()
+        self._second = None
+        self._count = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.rate < 1 and random.random() >= self.rate:
+            return False
+        if self.max_per_second is None:
+            return True
+        second = int(time.monotonic())
+        with self._lock:
+            if second != self._second:
+                self._second, self._count = second, 0
+            if self._count >= self.max_per_second:
+                return False
+            self._count += 1
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queues the records of one logger for its ``handlers``, dropping them when the queue is full"""
+
+    def __init__(self, records, handlers):
+        super().__init__(records)
+        self.handlers = tuple(handlers)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the arguments, which may change once the call returns;
+        # the handlers' formatters run on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.octofit_handlers = self.handlers
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Dispatch(logging.Handler):
+    """Hands a queued record to the handlers of the logger it was queued for"""
+
+    def handle(self, record):
+        for handler in record.octofit_handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+def queue_loggers(names, config):
+    """Move the handlers of the ``names`` loggers behind one started ``QueueListener``"""
+    records = queue.Queue(config['QUEUE_SIZE'])
+    for name in dict.fromkeys(names):
+        logger = logging.getLogger(name or None)
+        handlers = [handler for handler in logger.handlers if not isinstance(handler, QueueHandler)]
+        if not handlers:
+            continue
+        queued = NonBlockingQueueHandler(records, handlers)
+        if name in config['SAMPLED']:
+            queued.addFilter(SampleFilter(config['SAMPLE_RATE'], config['MAX_PER_SECOND']))
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(queued)
+        _queue_handlers.append(queued)
+    listener = QueueListener(records, _Dispatch())
+    listener.start()
+    return listener
+
+
+def start():
+    """Queue the configured loggers, once per process, see the module docstring"""
+    global _listener
+    config = get_config()
+    if not config['QUEUE']:
+        return None
+    with _lock:
+        if _listener is None:
+            names = [*config['LOGGERS'], *getattr(settings, 'LOGGING', {}).get('loggers', {})]
+            _listener = queue_loggers(names, config)
+            atexit.register(stop)
+    return _listener
+
+
+def stop():
+    """Write the queued records and stop the listener"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def dropped():
+    """Records dropped by this process because the queue was full"""
+    return sum(handler.dropped for handler in _queue_handlers)
+
+
+def _after_fork():
+    global _listener
+    # The parent's records are its own to write, and its locks may be held
+    if _listener is not None:
+        records = queue.Queue(get_config()['QUEUE_SIZE'])
+        for handler in _queue_handlers:
+            handler.queue = records
+        _listener = QueueListener(records, _Dispatch())
+        _listener.start()
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from octofit_tracker.benchmark import compare, default_scenarios, failing, peak_memory_kb, run_async_scenario, run_scenario, traced_peak_kb
+from contextlib import nullcontext, suppress
+import io
+import json
+import os
+import platform
+import tempfile
+import django
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks every API endpoint under concurrent load against a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--teams', type=int, default=50)
+        parser.add_argument('--activities', type=int, default=20000)
+        parser.add_argument('--workouts', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clients', type=int, default=4, help='Concurrent client threads or tasks')
+        parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='sync',
+                            help='Drive the API from threads (WSGI), event loop tasks (ASGI) or both')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+        parser.add_argument('--only', help='Comma separated scenario names to run')
+        parser.add_argument('--db-file', help='SQLite test database file, a temporary file by default')
+        parser.add_argument('--in-memory', action='store_true', help='Use an in-memory SQLite test database')
+        parser.add_argument('--configured-database', action='store_true',
+                            help='Create the test database on the configured backend instead of SQLite')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Fail if results regress against this JSON file')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed latency/throughput drift')
+        parser.add_argument('--max-error-rate', type=float, default=0.5,
+                            help='Fail if a scenario has more than this fraction of failed requests')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='Report the peak Python allocations of each scenario; slows every request down')
+        parser.add_argument('--throttled', action='store_true',
+                            help='Keep the rate limits and load shedding, which the benchmark clients otherwise exceed')
+
+    def handle(self, *args, **options):
+        database = settings.DATABASES['default']
+        if not options['configured_database']:
+            # Run without external services: swap the configured backend for
+            # SQLite before anything connects
+            with suppress(AttributeError):
+                # The wrapper of the configured backend, if one was created
+                del connections['default']
+            sqlite = connections.configure_settings({'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ''}})
+            database.clear()
+            database.update(sqlite['default'])
+        temporary = None
+        if 'sqlite3' in database['ENGINE'] and not options['in_memory']:
+            # Shared-cache in-memory SQLite fails concurrent writes instead of
+            # waiting for the lock, so default to a throwaway file. Even then
+            # SQLite allows a single writer, and write scenarios with several
+            # clients can report "database is locked" errors.
+            if not options['db_file']:
+                temporary = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+                temporary.close()
+            database.setdefault('TEST', {})['NAME'] = options['db_file'] or temporary.name
+        # The benchmark never touches the configured database: it seeds and
+        # drives a test database, next to it with --configured-database
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # A few clients sending thousands of requests a minute are exactly what
+        # the rate limits and load shedding refuse
+        protections = nullcontext() if options['throttled'] else override_settings(
+            OCTOFIT_THROTTLES={'ENABLED': False}, OCTOFIT_LOAD_SHEDDING={'ENABLED': False},
+        )
+        try:
+            with protections:
+                results = self._run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            if temporary is not None and os.path.exists(temporary.name):
+                os.unlink(temporary.name)
+
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+        failures = failing(results, options['max_error_rate'])
+        if failures:
+            raise CommandError('Most requests failed, the results are not meaningful:\n' + '\n'.join(failures))
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                regressions = compare(results, json.load(baseline_file), options['tolerance'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('✅ No regressions against the baseline'))
+
+    def _run(self, options):
+        dataset = {name: options[name] for name in ('users', 'teams', 'activities', 'workouts', 'seed')}
+        call_command('populate_db', stdout=io.StringIO(), **dataset)
+        scenarios = default_scenarios()
+        if options['only']:
+            wanted = set(options['only'].split(','))
+            scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+
+        results = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': settings.DATABASES['default']['ENGINE'],
+            },
+            'dataset': dataset,
+            'clients': options['clients'],
+            'mode': options['mode'],
+            'trace_memory': options['trace_memory'],
+            'scenarios': {},
+        }
+        runners = []
+        if options['mode'] in ('sync', 'both'):
+            runners.append(('', run_scenario))
+        if options['mode'] in ('async', 'both'):
+            runners.append(('@async', run_async_scenario))
+        for scenario in scenarios:
+            for suffix, run in runners:
+                name = scenario.name + suffix
+                args = (scenario, options['requests'], options['clients'], options['seed'])
+                if options['trace_memory']:
+                    summary, summary['peak_memory_kb'] = traced_peak_kb(run, *args)
+                else:
+                    summary = run(*args)
+                results['scenarios'][name] = summary
+                self.stderr.write(
+                    f"{name}: {summary['throughput_rps']} req/s, p95 {summary['latency_ms']['p95']}ms, "
+                    f"{summary['queries_per_request']['mean']} queries/request, {summary['errors']} errors"
+                )
+        # Process-wide: includes the dataset, the imports and every earlier scenario
+        results['process_peak_rss_kb'] = peak_memory_kb()
+        return results
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from octofit_tracker.archive import compact, get_config, horizon
+
+
+class Command(BaseCommand):
+    help = 'Moves activities older than OCTOFIT_ARCHIVE["HORIZON_DAYS"] to the compressed monthly archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive the months before this ISO date instead of the horizon')
+        parser.add_argument('--segment-rows', type=int, help='Most activities per archive file')
+
+    def handle(self, *args, **options):
+        before = horizon()
+        if options['before']:
+            day = parse_date(options['before'])
+            if day is None:
+                raise CommandError('--before expects an ISO date')
+            before = day.replace(day=1)
+        moved = compact(before, options['segment_rows'])
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Archived {moved} activities dated before {before.isoformat()} to {get_config()["DIR"]}'
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from octofit_tracker import archive
+from octofit_tracker.exports import EXPORT_FORMATS, export_lines
+from octofit_tracker.filters import activity_criteria, filter_activities
+from octofit_tracker.models import Activity
+
+
+class Command(BaseCommand):
+    help = 'Streams activities as NDJSON or CSV without loading them into memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--user', help='Comma separated user ids')
+        parser.add_argument('--team', help='Comma separated team ids')
+        parser.add_argument('--since', help='ISO date or datetime, inclusive')
+        parser.add_argument('--until', help='ISO date or datetime, inclusive')
+        parser.add_argument('--output', help='File to write to instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            queryset = filter_activities(Activity.objects.all(), options)
+            archived = archive.select(activity_criteria(options))
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+        lines = export_lines(queryset, options['format'], options['chunk_size'], archived)
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                out.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from octofit_tracker.imports import IMPORT_FORMATS, UserImport, create_hash_pool, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Creates users from a CSV (email,name,password) or NDJSON file, hashing passwords on every core'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, - for stdin')
+        parser.add_argument('--format', choices=sorted(IMPORT_FORMATS), help='Defaults to the file extension')
+        parser.add_argument('--workers', type=int, help='Hashing processes, defaults to one per core')
+        parser.add_argument('--chunk-size', type=int, help='Rows validated and inserted at once')
+
+    def handle(self, *args, **options):
+        import_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f'Cannot tell the format of {options["path"]}, pass --format')
+        started = time.monotonic()
+        pool = create_hash_pool(options['workers'])
+        user_import = UserImport(pool, options['chunk_size'])
+        try:
+            with self._open(options['path']) as lines:
+                for result in user_import.run(read_rows(lines, import_format)):
+                    if result['status'] != 'created':
+                        self.stderr.write(json.dumps(result))
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        summary = user_import.summary
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Imported {summary["created"]} users in {time.monotonic() - started:.1f}s, '
+            f'{summary["duplicate"]} duplicate, {summary["invalid"]} invalid'
+        ))
+
+    def _open(self, path):
+        if path == '-':
+            return open(sys.stdin.fileno(), encoding='utf-8', newline='', closefd=False)
+        try:
+            return open(path, encoding='utf-8', newline='')
+        except OSError as exc:
+            raise CommandError(exc)
@@ -1,143 +1,227 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
 from django.contrib.auth.hashers import make_password
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from faker import Faker
+from django.db import connection, connections
+from octofit_tracker.models import User, Team, Activity, ActivityRollup, ActivitySummary, ArchiveSegment, DurationSketchBin, Job, Leaderboard, Workout
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.versions import bump_all
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.sketches import rebuild_sketches
+from octofit_tracker.teams import rebuild_counters
+from datetime import datetime, timedelta, timezone
+import hashlib
 import logging
+import multiprocessing
 import random
-from datetime import timedelta
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/populate_db.log'),
-        logging.StreamHandler()
+import time
+
+logger = logging.getLogger(__name__)
+
+Membership = Team.members.through
+
+FIRST_NAMES = ['Ada', 'Ben', 'Cara', 'Dev', 'Eli', 'Fay', 'Gus', 'Hana', 'Ivo', 'Jun',
+               'Kai', 'Lea', 'Milo', 'Nia', 'Omar', 'Pia', 'Quin', 'Rosa', 'Sam', 'Tess']
+LAST_NAMES = ['Alvarez', 'Brooks', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Hughes',
+              'Ito', 'Jensen', 'Kim', 'Lopez', 'Moreau', 'Novak', 'Okafor', 'Patel']
+TEAM_PREFIXES = ['Elite', 'Pro', 'Alpha', 'Omega', 'Extreme']
+TEAM_SUFFIXES = ['Squad', 'Team', 'Club', 'Unit', 'Force']
+ACTIVITY_TYPES = ['running', 'weightlifting', 'cycling', 'swimming', 'yoga']
+WORKOUT_CATEGORIES = ['cardio', 'strength', 'flexibility', 'endurance']
+WORKOUT_DIFFICULTIES = ['beginner', 'intermediate', 'advanced']
+WORKOUT_STEPS = ['Warm up for five minutes.', 'Keep a steady pace.', 'Rest for a minute between sets.',
+                 'Focus on form over speed.', 'Finish with a cool down stretch.', 'Track your heart rate.']
+
+# Realistic duration ranges in minutes per activity type
+DURATIONS = {'running': (15, 120), 'weightlifting': (30, 90)}
+DEFAULT_DURATION = (20, 60)
+
+
+# Rows are generated in fixed blocks with their own random generator, so
+# the dataset only depends on the seed, not on chunk size or worker count
+BLOCK_SIZE = 1000
+
+
+def _rows(task, entity):
+    """Yield ``(row_id, rng)`` for every row id of a block aligned chunk"""
+    for row_id in range(task['start'], task['stop']):
+        if (row_id - 1) % BLOCK_SIZE == 0:
+            rng = random.Random(f'{task["seed"]}:{entity}:{(row_id - 1) // BLOCK_SIZE}')
+        yield row_id, rng
+
+
+def _users(task):
+    return User, [
+        User(
+            id=user_id,
+            email=f'user{user_id}@octofit.example',
+            name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            password=task['password'],
+        )
+        for user_id, rng in _rows(task, 'users')
+    ]
+
+
+def _teams(task):
+    return Team, [
+        Team(id=team_id, name=f'{rng.choice(TEAM_PREFIXES)} {rng.choice(TEAM_SUFFIXES)} {team_id}')
+        for team_id, rng in _rows(task, 'teams')
+    ]
+
+
+def _memberships(task):
+    """Each user joins one or two teams; row ids are fixed per user slot"""
+    rows = []
+    for user_id, rng in _rows(task, 'memberships'):
+        team_ids = rng.sample(range(1, task['teams'] + 1), min(rng.randint(1, 2), task['teams']))
+        for slot, team_id in enumerate(team_ids):
+            rows.append(Membership(id=2 * user_id - 1 + slot, user_id=user_id, team_id=team_id))
+    return Membership, rows
+
+
+def _activities(task):
+    start_date, seconds = task['start_date'], task['days'] * 86400
+    rows = []
+    for activity_id, rng in _rows(task, 'activities'):
+        activity_type = rng.choice(ACTIVITY_TYPES)
+        rows.append(Activity(
+            id=activity_id,
+            user_id=rng.randint(1, task['users']),
+            activity_type=activity_type,
+            duration=rng.randint(*DURATIONS.get(activity_type, DEFAULT_DURATION)),
+            date=start_date + timedelta(seconds=rng.randrange(seconds)),
+        ))
+    return Activity, rows
+
+
+def _workouts(task):
+    return Workout, [
+        Workout(
+            id=workout_id,
+            name=f'{rng.choice(WORKOUT_CATEGORIES).capitalize()} {rng.choice(WORKOUT_DIFFICULTIES)} workout',
+            description=' '.join(rng.sample(WORKOUT_STEPS, 3)),
+        )
+        for workout_id, rng in _rows(task, 'workouts')
     ]
-)
+
+
+GENERATORS = {
+    'users': _users,
+    'teams': _teams,
+    'memberships': _memberships,
+    'activities': _activities,
+    'workouts': _workouts,
+}
+
+
+def _insert_chunk(task):
+    """Generate and bulk insert one chunk; runs in the worker processes"""
+    model, rows = GENERATORS[task['entity']](task)
+    model.objects.bulk_create(rows, batch_size=task['batch_size'])
+    return len(rows)
+
+
+def _close_connections():
+    # Forked workers must not share the parent's database sockets
+    connections.close_all()
+
 
 class Command(BaseCommand):
-    help = 'Populates database with comprehensive test data'
+    help = 'Populates the database with a deterministic, configurable test dataset'
 
-    def __init__(self):
-        super().__init__()
-        self.faker = Faker()
-        self.activity_types = ['running', 'weightlifting', 'cycling', 'swimming', 'yoga']
-        self.workout_categories = ['cardio', 'strength', 'flexibility', 'endurance']
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--teams', type=int, default=3)
+        parser.add_argument('--activities', type=int, default=20)
+        parser.add_argument('--workouts', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42, help='Same seed, same dataset')
+        parser.add_argument('--workers', type=int, default=1, help='Parallel insert processes')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows generated per task, rounded up to a multiple of 1000')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT statement')
+        parser.add_argument('--start-date', default='2025-01-01', help='First day activities fall on')
+        parser.add_argument('--days', type=int, default=365, help='Number of days activities span')
+        parser.add_argument('--password', default='testpass123', help='Password shared by all users')
 
     def handle(self, *args, **options):
+        if options['teams'] < 1 and options['users']:
+            raise CommandError('--teams must be at least 1 when creating users')
         try:
-            self._clear_existing_data()
-            users = self._create_users(5)
-            teams = self._create_teams(3)
-            self._assign_users_to_teams(users, teams)
-            self._create_activities(users, 20)
-            self._create_workouts(10)
-            self._update_leaderboards(teams)
-            
-            self.stdout.write(self.style.SUCCESS('✅ Successfully populated test data'))
-        except Exception as e:
-            logging.exception('Data population failed')
-            self.stdout.write(self.style.ERROR(f'❌ Error: {str(e)}'))
+            start_date = datetime.fromisoformat(options['start_date']).replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise CommandError('--start-date must be an ISO date')
+        self.options = options
+        self.shared = {
+            'seed': options['seed'],
+            'users': options['users'],
+            'teams': options['teams'],
+            'start_date': start_date,
+            'days': max(options['days'], 1),
+            'batch_size': options['batch_size'],
+            # Hashing is deliberately slow, so hash once with a seed derived
+            # salt and share the result between every generated user
+            'password': make_password(options['password'], salt=hashlib.sha256(str(options['seed']).encode()).hexdigest()[:22]),
+        }
+
+        started = time.monotonic()
+        self._clear_existing_data()
+        self._populate('users', options['users'])
+        self._populate('teams', options['teams'])
+        self._populate('memberships', options['users'])
+        self._populate('activities', options['activities'])
+        self._populate('workouts', options['workouts'])
+        self._reset_sequences()
+        self._update_derived_data()
+        self.stdout.write(self.style.SUCCESS(f'✅ Successfully populated test data in {time.monotonic() - started:.1f}s'))
 
     def _clear_existing_data(self):
-        """Safely clear all existing data"""
-        models = [Leaderboard, Activity, Workout, Team, User]
-        for model in models:
-            model.objects.all().delete()
-        logging.info('Cleared all existing data')
-
-    def _create_users(self, count):
-        """Generate test users with secure passwords"""
-        users = []
-        for i in range(count):
-            user = User.objects.create(
-                email=self.faker.unique.email(),
-                name=self.faker.name(),
-                password=make_password('testpass123'),  # Proper password hashing
-                last_login=self.faker.date_time_this_month(),
-                is_active=True
-            )
-            users.append(user)
-            logging.debug(f'Created user: {user.email}')
-        return users
-
-    def _create_teams(self, count):
-        """Generate test teams with realistic names"""
-        teams = []
-        prefixes = ['Elite', 'Pro', 'Alpha', 'Omega', 'Extreme']
-        suffixes = ['Squad', 'Team', 'Club', 'Unit', 'Force']
-        
-        for i in range(count):
-            name = f"{random.choice(prefixes)} {random.choice(suffixes)}"
-            # Remove created_at if not in your Team model
-            try:
-                team = Team.objects.create(
-                    name=name,
-                    created_at=timezone.now() - timedelta(days=random.randint(1, 30))
-                )
-            except TypeError:
-                team = Team.objects.create(name=name)
-            teams.append(team)
-            logging.debug(f'Created team: {team.name}')
-        return teams
-
-    def _assign_users_to_teams(self, users, teams):
-        """Randomly assign users to teams"""
-        for user in users:
-            num_teams = random.randint(1, 2)
-            selected_teams = random.sample(teams, num_teams)
-            for team in selected_teams:
-                team.members.add(user)
-            logging.debug(f'Assigned user {user.email} to {num_teams} teams')
-
-    def _create_activities(self, users, count):
-        """Generate realistic activity data"""
-        for _ in range(count):
-            user = random.choice(users)
-            activity_type = random.choice(self.activity_types)
-            
-            # Generate realistic durations based on activity type
-            if activity_type == 'running':
-                duration = random.randint(15, 120)
-            elif activity_type == 'weightlifting':
-                duration = random.randint(30, 90)
-            else:
-                duration = random.randint(20, 60)
-                
-            Activity.objects.create(
-                user=user,
-                activity_type=activity_type,
-                duration=duration,
-                calories=random.randint(100, 800),
-                date=self.faker.date_time_this_month(),
-                notes=self.faker.sentence()
-            )
-            logging.debug(f'Created activity for {user.email}')
-
-    def _create_workouts(self, count):
-        """Generate diverse workout plans"""
-        for _ in range(count):
-            category = random.choice(self.workout_categories)
-            difficulty = random.choice(['beginner', 'intermediate', 'advanced'])
-            
-            Workout.objects.create(
-                name=f"{category.capitalize()} {difficulty} workout",
-                description=self.faker.paragraph(),
-                category=category,
-                duration=random.randint(15, 90),
-                difficulty=difficulty
-            )
-            logging.debug(f'Created workout: {category} {difficulty}')
-
-    def _update_leaderboards(self, teams):
-        """Generate realistic leaderboard data"""
-        for team in teams:
-            points = random.randint(50, 500)
-            Leaderboard.objects.create(
-                team=team,
-                points=points,
-                last_updated=timezone.now()
-            )
-            logging.debug(f'Updated leaderboard for {team.name}')
\ No newline at end of file
+        """Delete all rows without loading them or firing per-row signals"""
+        # The archive files are left on disk, unlisted files are never read;
+        # pending jobs would recompute derived rows of the deleted data
+        for model in [Job, ArchiveSegment, ActivitySummary, ActivityRollup, DurationSketchBin, Leaderboard, Activity, Workout, Membership, Team, User]:
+            queryset = model.objects.all()
+            queryset._raw_delete(queryset.db)
+        logger.info('Cleared all existing data')
+
+    def _populate(self, entity, count):
+        """Insert ``count`` generated rows in chunks, in parallel when asked"""
+        if count <= 0:
+            return
+        # Chunks must start on a block boundary to replay the same generators
+        chunk_size = max(-(-self.options['chunk_size'] // BLOCK_SIZE), 1) * BLOCK_SIZE
+        tasks = [
+            {**self.shared, 'entity': entity, 'start': start, 'stop': min(start + chunk_size, count + 1)}
+            for start in range(1, count + 1, chunk_size)
+        ]
+        workers = min(self.options['workers'], len(tasks))
+        started = time.monotonic()
+        done = 0
+        if workers > 1:
+            _close_connections()
+            context = multiprocessing.get_context('fork')
+            with context.Pool(workers, initializer=_close_connections) as pool:
+                for inserted in pool.imap_unordered(_insert_chunk, tasks):
+                    done += inserted
+                    self._report(entity, done, started)
+        else:
+            for task in tasks:
+                done += _insert_chunk(task)
+                self._report(entity, done, started)
+
+    def _report(self, entity, done, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f'{entity}: {done} rows, {done / elapsed:,.0f} rows/s')
+
+    def _reset_sequences(self):
+        """Move id sequences past the explicitly assigned primary keys"""
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Team, Membership, Activity, Workout])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def _update_derived_data(self):
+        """Bulk inserts skip the model signals, rebuild derived tables instead"""
+        teams = rebuild_leaderboard()
+        rollups = rebuild_rollups()
+        bins = rebuild_sketches()
+        rebuild_counters()
+        bump_all()
+        logger.info('Rebuilt leaderboard and counters for %d teams, %d rollup rows and %d sketch bins', len(teams), rollups, bins)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.teams import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Recomputes every team leaderboard score and team counter from the activity history'
+
+    def handle(self, *args, **options):
+        points = rebuild_leaderboard()
+        rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f'✅ Rebuilt leaderboard for {len(points)} teams'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from octofit_tracker.filters import parse_moment
+from octofit_tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily activity rollups from the raw activities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days from this ISO date on')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = parse_moment('since', options['since'])
+            except ValidationError as exc:
+                raise CommandError(exc.detail)
+        written = rebuild_rollups(since=since, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'✅ Rebuilt {written} rollup rows'))
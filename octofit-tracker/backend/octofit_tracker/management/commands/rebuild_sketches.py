@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.sketches import rebuild_sketches
+
+
+class Command(BaseCommand):
+    help = 'Recounts the activity duration sketches from the raw and archived activities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        written = rebuild_sketches(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'✅ Rebuilt {written} sketch bins'))
@@ -0,0 +1,37 @@
+import json
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.recommendations import recommend_all
+
+
+class Command(BaseCommand):
+    help = 'Scores every user against the workout catalog at once and writes the recommendations as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='Workouts per user')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users scored per matrix product')
+        parser.add_argument('--output', help='File to write to instead of stdout')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        users = 0
+        with self._open(options['output']) as out:
+            for user_id, results in recommend_all(options['limit'], options['chunk_size']):
+                out.write(json.dumps({
+                    'user': user_id,
+                    'workouts': [{'id': workout_id, 'name': name, 'score': round(score, 4)} for workout_id, name, score in results],
+                }) + '\n')
+                users += 1
+        # Keep stdout to the recommendations when they are written there
+        report = self.stdout if options['output'] else self.stderr
+        report.write(self.style.SUCCESS(f'✅ Scored {users} users in {time.monotonic() - started:.1f}s'))
+
+    def _open(self, path):
+        if path is None:
+            return nullcontext(self.stdout)
+        try:
+            return open(path, 'w', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
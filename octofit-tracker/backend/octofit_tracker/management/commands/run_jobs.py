@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+from octofit_tracker.jobs import JobRunner, stats
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued derived data jobs (OCTOFIT_DERIVED_DATA = "deferred")'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs due now and exit')
+        parser.add_argument('--workers', type=int, help='Worker threads, defaults to OCTOFIT_JOBS["WORKERS"]')
+        parser.add_argument('--batch-size', type=int, help='Jobs claimed at once')
+        parser.add_argument('--stats', action='store_true', help='Print the queue depth and lag and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(stats(), indent=2))
+            return
+        runner = JobRunner(workers=options['workers'], batch=options['batch_size'])
+        try:
+            if options['once']:
+                runner.run_once()
+            else:
+                self.stdout.write(f'Running jobs with {runner.workers} worker(s), press CTRL-C to stop')
+                runner.run_forever()
+        except KeyboardInterrupt:
+            runner.stop()
+        finally:
+            runner.close()
+        self.stdout.write(self.style.SUCCESS(f'✅ Ran {runner.processed} jobs, {runner.failed} failed'))
@@ -0,0 +1,86 @@
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Line of python -X importtime: self and cumulative microseconds, the module
+# name indented by its nesting depth
+IMPORT_TIME = re.compile(r'import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)')
+
+# Run in the fresh interpreter: start the application as a server would and
+# print the start up report
+SCRIPT = '''
+import json, sys
+from importlib import import_module
+import_module('octofit_tracker.' + sys.argv[1])
+from octofit_tracker.startup import report
+print(json.dumps(report()))
+'''
+
+
+def package_of(module):
+    """Package an import is accounted to: the top level one, django.<sub> or django.contrib.<app>"""
+    parts = module.split('.')
+    if parts[:2] == ['django', 'contrib']:
+        return '.'.join(parts[:3])
+    if parts[0] in ('django', 'octofit_tracker'):
+        return '.'.join(parts[:2])
+    return parts[0]
+
+
+def import_times(lines):
+    """``{package: seconds}`` of import time spent in each package's own modules"""
+    totals = Counter()
+    for line in lines:
+        match = IMPORT_TIME.match(line)
+        if match:
+            totals[package_of(match.group(2))] += int(match.group(1)) / 1e6
+    return totals
+
+
+class Command(BaseCommand):
+    help = 'Starts the application in a fresh interpreter and reports its start up timings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--api-only', action='store_true', help='Start an OCTOFIT_API_ONLY worker')
+        parser.add_argument('--top', type=int, default=15, help='Packages listed by import time')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+        if options['api_only']:
+            env['OCTOFIT_API_ONLY'] = '1'
+        started = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', SCRIPT, options['interface']],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        wall_ms = (time.perf_counter() - started) * 1000
+        if process.returncode:
+            raise CommandError(f'The application failed to start:\n{process.stderr[-4000:]}')
+        report = json.loads(process.stdout.strip().splitlines()[-1])
+        report['wall_ms'] = round(wall_ms, 2)
+        report['imports'] = {
+            package: round(seconds * 1000, 2)
+            for package, seconds in import_times(process.stderr.splitlines()).most_common(options['top'])
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        mode = ', API only' if report['api_only'] else ''
+        self.stdout.write(f'Cold start ({report["interface"]}{mode}): {report["wall_ms"]:.0f} ms wall, '
+                          f'{report["total_ms"]:.0f} ms starting the application')
+        for phase in report['phases']:
+            failed = '' if phase['ok'] else '  (failed)'
+            self.stdout.write(f'  {phase["name"]:<40} {phase["ms"]:>9.1f} ms{failed}')
+        self.stdout.write('Import time by package (own modules only)')
+        for package, ms in report['imports'].items():
+            self.stdout.write(f'  {package:<40} {ms:>9.1f} ms')
+        self.stdout.write(self.style.SUCCESS('✅ Start up report complete'))
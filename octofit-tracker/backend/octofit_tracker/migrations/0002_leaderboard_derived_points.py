@@ -0,0 +1,23 @@
+# Generated by Django 4.1 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="leaderboard",
+            name="last_updated",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="leaderboard",
+            name="points",
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+    ]
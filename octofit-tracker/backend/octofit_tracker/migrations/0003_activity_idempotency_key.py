@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0002_leaderboard_derived_points"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="activity",
+            name="idempotency_key",
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
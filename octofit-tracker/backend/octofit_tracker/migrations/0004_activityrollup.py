@@ -0,0 +1,49 @@
+# Generated by Django 4.1 on 2026-10-18 17:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0003_activity_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ActivityRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("activity_type", models.CharField(max_length=50)),
+                ("total_duration", models.IntegerField(default=0)),
+                ("activity_count", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="octofit_tracker.user",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="activityrollup",
+            index=models.Index(
+                fields=["day", "activity_type"], name="octofit_tra_day_c0ef1c_idx"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="activityrollup",
+            unique_together={("user", "day", "activity_type")},
+        ),
+    ]
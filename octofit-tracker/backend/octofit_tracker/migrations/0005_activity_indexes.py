@@ -0,0 +1,31 @@
+# Generated by Django 4.1 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0004_activityrollup"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["date", "id"], name="octofit_tra_date_68b5db_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["user", "date"], name="octofit_tra_user_id_fedf84_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["activity_type", "date"], name="octofit_tra_activit_2c19c4_idx"
+            ),
+        ),
+    ]
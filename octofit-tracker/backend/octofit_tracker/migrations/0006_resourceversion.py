@@ -0,0 +1,30 @@
+# Generated by Django 4.1 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0005_activity_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResourceVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("version", models.BigIntegerField(default=0)),
+                ("modified", models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0006_resourceversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=100, unique=True)),
+                ("kind", models.CharField(max_length=20)),
+                ("target", models.CharField(max_length=80)),
+                ("enqueued_at", models.DateTimeField()),
+                ("available_at", models.DateTimeField(db_index=True)),
+                ("version", models.IntegerField(default=1)),
+                ("attempts", models.IntegerField(default=0)),
+                ("locked_by", models.CharField(blank=True, max_length=64, null=True)),
+                ("locked_until", models.DateTimeField(blank=True, null=True)),
+                ("failed", models.BooleanField(default=False)),
+                ("last_error", models.TextField(blank=True, default="")),
+            ],
+        ),
+    ]
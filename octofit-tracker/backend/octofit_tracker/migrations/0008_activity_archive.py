@@ -0,0 +1,62 @@
+# Generated by Django 4.1 on 2026-10-18 17:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0007_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchiveSegment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField(db_index=True)),
+                ("path", models.CharField(max_length=255, unique=True)),
+                ("row_count", models.IntegerField()),
+                ("first_id", models.BigIntegerField()),
+                ("last_id", models.BigIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ActivitySummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("activity_type", models.CharField(max_length=50)),
+                ("total_duration", models.IntegerField(default=0)),
+                ("activity_count", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="octofit_tracker.user",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "month", "activity_type")},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0008_activity_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="activityrollup",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
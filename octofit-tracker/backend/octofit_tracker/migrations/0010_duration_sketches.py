@@ -0,0 +1,35 @@
+# Generated by Django 4.1 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0009_activityrollup_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DurationSketchBin",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("activity_type", models.CharField(max_length=50)),
+                ("team", models.IntegerField(default=0)),
+                ("period", models.CharField(blank=True, default="", max_length=7)),
+                ("bin", models.IntegerField()),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "unique_together": {("activity_type", "team", "period", "bin")},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.1 on 2026-10-18 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0010_duration_sketches"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="team",
+            name="activity_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="team",
+            name="member_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="team",
+            name="total_duration",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="team",
+            index=models.Index(
+                fields=["member_count", "id"], name="octofit_tra_member__a4ec21_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0011_team_counters"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="activity",
+            constraint=models.UniqueConstraint(
+                fields=("user", "idempotency_key"), name="activity_user_idempotency_key"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0012_activity_user_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivesegment",
+            name="max_user_id",
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="archivesegment",
+            name="min_user_id",
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
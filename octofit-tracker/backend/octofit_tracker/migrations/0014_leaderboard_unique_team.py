@@ -0,0 +1,35 @@
+# Generated by Django 4.1 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+def drop_duplicate_rows(apps, schema_editor):
+    # Concurrent writers could create a second row for a team; both received
+    # the same deltas since, so keeping the oldest loses nothing
+    Leaderboard = apps.get_model("octofit_tracker", "Leaderboard")
+    kept = set()
+    duplicates = []
+    for row_id, team_id in Leaderboard.objects.order_by("id").values_list(
+        "id", "team_id"
+    ):
+        if team_id in kept:
+            duplicates.append(row_id)
+        kept.add(team_id)
+    Leaderboard.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("octofit_tracker", "0013_archivesegment_user_range"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="leaderboard",
+            constraint=models.UniqueConstraint(
+                fields=("team",), name="leaderboard_unique_team"
+            ),
+        ),
+    ]
@@ -12,8 +12,29 @@ class User(models.Model):
 class Team(models.Model):
     name = models.CharField(max_length=100)
     members = models.ManyToManyField(User, related_name='teams')
+    # Denormalized from the memberships and the members' activity, see
+    # octofit_tracker.teams
+    member_count = models.IntegerField(default=0)
+    total_duration = models.BigIntegerField(default=0)
+    activity_count = models.IntegerField(default=0)
     # Add additional fields as needed
 
+    class Meta:
+        # Back ordering the team list by size
+        indexes = [models.Index(fields=['member_count', 'id'])]
+
+    COUNTERS = ('member_count', 'total_duration', 'activity_count')
+
+    def save(self, *args, **kwargs):
+        # The counters are only moved by F() updates; writing back the values
+        # loaded with the instance would undo concurrent changes
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTERS
+            ]
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -22,14 +43,107 @@ class Activity(models.Model):
     activity_type = models.CharField(max_length=50)
     duration = models.IntegerField()
     date = models.DateTimeField()
+    # Client-supplied key that makes retried batch uploads idempotent
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     # Add additional fields as needed
 
+    class Meta:
+        # Back the feed order and the user / activity_type date range filters
+        indexes = [
+            models.Index(fields=['date', 'id']),
+            models.Index(fields=['user', 'date']),
+            models.Index(fields=['activity_type', 'date']),
+        ]
+        constraints = [
+            # Keys are scoped to their user, see octofit_tracker.ingest
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='activity_user_idempotency_key'),
+        ]
+
+class ActivityRollup(models.Model):
+    """Per-user, per-day, per-activity_type totals maintained from Activity"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    activity_type = models.CharField(max_length=50)
+    total_duration = models.IntegerField(default=0)
+    activity_count = models.IntegerField(default=0)
+    # Polled by the recommendation engine for users whose history changed
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'day', 'activity_type')
+        indexes = [models.Index(fields=['day', 'activity_type'])]
+
+class ActivitySummary(models.Model):
+    """Per-user, per-month totals of the activities moved to the archive"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField()
+    activity_type = models.CharField(max_length=50)
+    total_duration = models.IntegerField(default=0)
+    activity_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'month', 'activity_type')
+
+class DurationSketchBin(models.Model):
+    """Count of one bin of an activity duration sketch, see octofit_tracker.sketches"""
+    activity_type = models.CharField(max_length=50)
+    # 0 for every user, otherwise the id of the team whose members' activity is counted
+    team = models.IntegerField(default=0)
+    # "YYYY-MM", or "" for all time
+    period = models.CharField(max_length=7, blank=True, default='')
+    bin = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('activity_type', 'team', 'period', 'bin')
+
+class ArchiveSegment(models.Model):
+    """One append-only file of archived activities, see octofit_tracker.archive"""
+    month = models.DateField(db_index=True)
+    path = models.CharField(max_length=255, unique=True)
+    row_count = models.IntegerField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    # Range of the user ids in the file, None for files written before it was kept
+    min_user_id = models.BigIntegerField(null=True)
+    max_user_id = models.BigIntegerField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
 class Leaderboard(models.Model):
     team = models.ForeignKey(Team, on_delete=models.CASCADE)
-    points = models.IntegerField()
+    # Derived from the members' activity, see octofit_tracker.leaderboard
+    points = models.IntegerField(default=0, db_index=True)
+    last_updated = models.DateTimeField(auto_now=True, db_index=True)
     # Add additional fields as needed
 
+    class Meta:
+        constraints = [
+            # One row per team, however many writers create it at once
+            models.UniqueConstraint(fields=['team'], name='leaderboard_unique_team'),
+        ]
+
 class Workout(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
     # Add additional fields as needed
+
+class Job(models.Model):
+    """Pending recomputation of derived data, see octofit_tracker.jobs"""
+    key = models.CharField(max_length=100, unique=True)
+    kind = models.CharField(max_length=20)
+    target = models.CharField(max_length=80)
+    enqueued_at = models.DateTimeField()
+    available_at = models.DateTimeField(db_index=True)
+    # Bumped by every enqueue, so a job re-enqueued while it runs runs again
+    version = models.IntegerField(default=1)
+    attempts = models.IntegerField(default=0)
+    locked_by = models.CharField(max_length=64, null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True, default='')
+
+class ResourceVersion(models.Model):
+    """Change counter of an API collection, see octofit_tracker.versions"""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(null=True)
@@ -0,0 +1,203 @@
+"""Keyset (cursor) pagination for the API list endpoints.
+
+Pages are addressed by the ordering key of the last row seen instead of an
+offset, so every page is a bounded index range scan: no OFFSET and no COUNT
+query, and page 10,000 costs the same as page 1.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Paginates over a unique ordering key, ``id`` unless overridden.
+
+    ``ordering`` must end with a unique field so the key identifies exactly
+    one row. Fields may mix ascending and ``-`` descending directions.
+    ``ordering_options`` maps the accepted ``?ordering=`` values to
+    alternative orderings.
+    """
+    ordering = ('id',)
+    ordering_param = 'ordering'
+    ordering_options = {}
+    page_size = api_settings.PAGE_SIZE or 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, request, view):
+        value = request.query_params.get(self.ordering_param)
+        if not value:
+            return self.ordering
+        if value not in self.ordering_options:
+            raise ValidationError({self.ordering_param: f'Expected one of {", ".join(self.ordering_options)}.'})
+        return self.ordering_options[value]
+
+    # Cursor encoding
+
+    def encode_cursor(self, key, reverse=False):
+        payload = {'k': [_jsonable(value) for value in key]}
+        if reverse:
+            payload['r'] = 1
+        return urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            values = payload['k']
+            if len(values) != len(self._ordering):
+                raise ValueError(encoded)
+            key = tuple(
+                model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(self._ordering, values)
+            )
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        return key, bool(payload.get('r'))
+
+    # Query building
+
+    def _after(self, key, ordering):
+        """Q object selecting the rows strictly after ``key`` in ``ordering``"""
+        condition = Q()
+        for position, name in enumerate(ordering):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            branch = Q(**{f'{field}__{lookup}': key[position]})
+            for previous, value in zip(ordering[:position], key):
+                branch &= Q(**{previous.lstrip('-'): value})
+            condition |= branch
+        # The redundant bound on the leading field lets the database turn the
+        # OR of branches into an index range scan
+        leading = ordering[0]
+        bound = 'lte' if leading.startswith('-') else 'gte'
+        return Q(**{f'{leading.lstrip("-")}__{bound}': key[0]}) & condition
+
+    def prepare_queryset(self, queryset, request, view=None):
+        """Return the sliced queryset for the requested page.
+
+        Split from ``paginate_queryset`` so callers that evaluate the query
+        themselves (async views, raw value queries) can share the logic.
+        """
+        self.request = request
+        self._page_size = self.get_page_size(request)
+        self._ordering = tuple(self.get_ordering(request, view))
+        self._key, self._reverse = self.decode_cursor(request, queryset.model)
+        ordering = self._ordering
+        if self._reverse:
+            ordering = tuple(name[1:] if name.startswith('-') else f'-{name}' for name in ordering)
+        # The ordering and cursor the page is read with, for callers merging in
+        # rows from elsewhere
+        self.query_ordering, self.cursor_key = ordering, self._key
+        queryset = queryset.order_by(*ordering)
+        if self._key is not None:
+            queryset = queryset.filter(self._after(self._key, ordering))
+        return queryset[:self._page_size + 1]
+
+    def paginate_rows(self, rows):
+        """Trim the fetched rows to a page and compute the neighbour cursors"""
+        rows = list(rows)
+        has_more = len(rows) > self._page_size
+        rows = rows[:self._page_size]
+        if self._reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = self._key is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self._key is not None
+        self.first_key = self._row_key(rows[0]) if rows else None
+        self.last_key = self._row_key(rows[-1]) if rows else None
+        if not rows and self._key is not None:
+            # Keep the links usable on an empty page by pivoting on the cursor
+            self.first_key = self.last_key = self._key
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_rows(self.prepare_queryset(queryset, request, view))
+
+    def _row_key(self, row):
+        names = [name.lstrip('-') for name in self._ordering]
+        if isinstance(row, dict):
+            return tuple(row[name] for name in names)
+        return tuple(getattr(row, name) for name in names)
+
+    # Response
+
+    def _link(self, key, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(key, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or self.last_key is None:
+            return None
+        return self._link(self.last_key, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first_key is None:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._link(self.first_key, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ActivityPagination(KeysetPagination):
+    """Newest activity first, keyed on ``(date, id)``"""
+    ordering = ('-date', '-id')
+    ordering_options = {
+        'date': ('date', 'id'),
+        '-date': ('-date', '-id'),
+    }
+
+
+class TeamPagination(KeysetPagination):
+    """Teams by id, or by their denormalized size and activity totals"""
+    ordering_options = {
+        'member_count': ('member_count', 'id'),
+        '-member_count': ('-member_count', 'id'),
+        'total_duration': ('total_duration', 'id'),
+        '-total_duration': ('-total_duration', 'id'),
+    }
+
+
+class LeaderboardPagination(KeysetPagination):
+    """Best ranked team first, keyed on ``(points, id)``"""
+    ordering = ('-points', 'id')
+
+
+def _jsonable(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
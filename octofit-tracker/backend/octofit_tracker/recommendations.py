@@ -0,0 +1,304 @@
+"""Workout recommendations scored over NumPy matrices.
+
+Every user is a row of per activity type minutes, summed from the daily
+rollups with a weight that halves every ``HALF_LIFE_DAYS``, so recent
+activity dominates the mix. Every workout is a row of the same activity type
+columns, from the ``KEYWORDS`` its name and description mention, plus an
+intensity from its ``INTENSITY`` words. A user is matched on their own
+profile blended with ``TEAM_WEIGHT`` of their teammates' (through
+``Team.members``), and on how their average session length ranks among all
+users against the workout intensity. Users without any history get the
+profile of the whole population.
+
+A ``Recommender`` keeps the profile, team and workout matrices in memory;
+scoring a user is one small matrix product and scoring the whole population
+is a series of chunked products, see ``recommend_workouts``. The matrices
+are refreshed at most once per ``WINDOW``: rollups stamped since the last
+poll name the users whose rows are recomputed, and the ``memberships``
+and ``workouts`` versions tell when memberships and workouts are reloaded
+(not ``teams``, which every activity and user write bumps). Decay weights
+are relative to a fixed epoch, so an unchanged row never needs
+recomputing; the epoch moves, and users whose last rollup was deleted are
+noticed, on the full reload every ``RESYNC``.
+"""
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import versions
+from .models import ActivityRollup, Team, User, Workout
+from .search import NAME_BOOST, tokenize
+
+Membership = Team.members.through
+
+DEFAULTS = {
+    'HALF_LIFE_DAYS': 30.0,
+    # Share of the teammates' profile in a user's profile
+    'TEAM_WEIGHT': 0.35,
+    # Share of the intensity match in a score, the rest is the activity mix
+    'INTENSITY_WEIGHT': 0.2,
+    # Seconds between polls for changes, and between full reloads
+    'WINDOW': 5.0,
+    'RESYNC': 900.0,
+    # Rollups are re-read this far behind the last poll, as a write commits
+    # some time after it stamps updated_at
+    'OVERLAP': 5.0,
+    # Words that tie a workout to an activity type, on top of the type's name
+    'KEYWORDS': {
+        'running': ['run', 'jog', 'sprint', 'cardio', 'endurance'],
+        'cycling': ['bike', 'ride', 'cardio', 'endurance'],
+        'swimming': ['swim', 'pool', 'cardio', 'endurance'],
+        'weightlifting': ['strength', 'weights', 'lift', 'barbell', 'squat'],
+        'yoga': ['flexibility', 'stretch', 'mobility', 'balance'],
+    },
+    # Words that set a workout's intensity, 0.5 without any
+    'INTENSITY': {'beginner': 0.0, 'easy': 0.0, 'intermediate': 0.5, 'advanced': 1.0, 'hard': 1.0},
+}
+# Rollup rows decoded per NumPy batch, and user ids per refresh query
+LOAD_BATCH = 50000
+QUERY_CHUNK = 500
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_RECOMMENDATIONS', {})}
+
+
+def _normalized(matrix):
+    """``matrix`` with unit length rows, all-zero rows stay zero"""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+class Recommender:
+    """In-memory user and workout matrices, see the module docstring"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.config = get_config()
+        self.loaded = False
+
+    def refresh(self):
+        """Bring the matrices up to date, at most once per ``WINDOW``"""
+        config = get_config()
+        now = time.monotonic()
+        with self._lock:
+            if self.loaded and now - self._polled_at < config['WINDOW']:
+                return
+            self.config = config
+            if not self.loaded or now - self._loaded_at >= config['RESYNC']:
+                self.load()
+                return
+            self._polled_at = now
+            changed = self._poll_rollups()
+            if versions.current('memberships')[0] != self._versions['memberships']:
+                self._load_memberships()
+                changed = True
+            if versions.current('workouts')[0] != self._versions['workouts']:
+                self._load_workouts()
+                changed = True
+            if changed:
+                self._derive()
+
+    def load(self):
+        with self._lock:
+            self.config = get_config()
+            self._epoch = timezone.now().date().toordinal()
+            self._since = timezone.now()
+            self.types = {activity_type: column for column, activity_type in enumerate(self.config['KEYWORDS'])}
+            self.user_rows = {}
+            self.minutes = np.zeros((0, len(self.types)))
+            self.sessions = np.zeros(0)
+            self._versions = {}
+            self._load_rollups(ActivityRollup.objects.all())
+            self._load_memberships()
+            self._load_workouts()
+            self._derive()
+            self._loaded_at = self._polled_at = time.monotonic()
+            self.loaded = True
+
+    # Loading
+
+    def _ensure_users(self, user_ids):
+        new = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in self.user_rows]
+        if not new:
+            return
+        for user_id in new:
+            self.user_rows[user_id] = len(self.user_rows)
+        self.minutes = np.vstack([self.minutes, np.zeros((len(new), self.minutes.shape[1]))])
+        self.sessions = np.concatenate([self.sessions, np.zeros(len(new))])
+
+    def _ensure_types(self, activity_types):
+        new = [activity_type for activity_type in dict.fromkeys(activity_types) if activity_type not in self.types]
+        if not new:
+            return
+        for activity_type in new:
+            self.types[activity_type] = len(self.types)
+        self.minutes = np.hstack([self.minutes, np.zeros((self.minutes.shape[0], len(new)))])
+        # The workout columns follow the types
+        self._versions.pop('workouts', None)
+
+    def _load_rollups(self, queryset):
+        """Add the decayed minutes and sessions of the rollups in ``queryset``"""
+        rows = queryset.values_list('user_id', 'day', 'activity_type', 'total_duration', 'activity_count')
+        batch = []
+        for row in rows.iterator(chunk_size=5000):
+            batch.append(row)
+            if len(batch) >= LOAD_BATCH:
+                self._add_rollups(batch)
+                batch = []
+        if batch:
+            self._add_rollups(batch)
+
+    def _add_rollups(self, batch):
+        user_ids, days, activity_types, durations, counts = zip(*batch)
+        self._ensure_users(user_ids)
+        self._ensure_types(activity_types)
+        unique_users, user_index = np.unique(np.array(user_ids, dtype=np.int64), return_inverse=True)
+        rows = np.array([self.user_rows[user_id] for user_id in unique_users.tolist()], dtype=np.intp)[user_index]
+        unique_types, type_index = np.unique(np.array(activity_types, dtype=object), return_inverse=True)
+        columns = np.array([self.types[activity_type] for activity_type in unique_types], dtype=np.intp)[type_index]
+        ages = np.array([day.toordinal() for day in days], dtype=np.float64) - self._epoch
+        weights = np.exp2(ages / self.config['HALF_LIFE_DAYS'])
+        np.add.at(self.minutes, (rows, columns), np.array(durations, dtype=np.float64) * weights)
+        np.add.at(self.sessions, rows, np.array(counts, dtype=np.float64) * weights)
+
+    def _poll_rollups(self):
+        """Recompute the users with rollups written since the last poll"""
+        started = timezone.now()
+        since = self._since - timedelta(seconds=self.config['OVERLAP'])
+        user_ids = set(ActivityRollup.objects.filter(updated_at__gte=since).values_list('user_id', flat=True).distinct())
+        self._since = started
+        if not user_ids:
+            return False
+        self._ensure_users(user_ids)
+        user_ids = sorted(user_ids)
+        rows = [self.user_rows[user_id] for user_id in user_ids]
+        self.minutes[rows] = 0.0
+        self.sessions[rows] = 0.0
+        for start in range(0, len(user_ids), QUERY_CHUNK):
+            self._load_rollups(ActivityRollup.objects.filter(user_id__in=user_ids[start:start + QUERY_CHUNK]))
+        return True
+
+    def _load_memberships(self):
+        self._versions['memberships'] = versions.current('memberships')[0]
+        pairs = list(Membership.objects.values_list('user_id', 'team_id'))
+        self._ensure_users(user_id for user_id, _ in pairs)
+        if not pairs:
+            self.memberships = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+            return
+        user_ids, team_ids = zip(*pairs)
+        _, team_rows = np.unique(np.array(team_ids, dtype=np.int64), return_inverse=True)
+        user_rows = np.array([self.user_rows[user_id] for user_id in user_ids], dtype=np.intp)
+        self.memberships = (user_rows, team_rows.astype(np.intp))
+
+    def _load_workouts(self):
+        self._versions['workouts'] = versions.current('workouts')[0]
+        keywords = {}
+        for activity_type, column in self.types.items():
+            for word in [*tokenize(activity_type), *self.config['KEYWORDS'].get(activity_type, ())]:
+                keywords.setdefault(word, []).append(column)
+        intensities = self.config['INTENSITY']
+        ids, names, features, intensity = [], [], [], []
+        for workout_id, name, description in Workout.objects.order_by('id').values_list('id', 'name', 'description').iterator():
+            row = np.zeros(len(self.types))
+            levels = []
+            for tokens, weight in ((tokenize(name), NAME_BOOST), (tokenize(description), 1)):
+                for token in tokens:
+                    for column in keywords.get(token, ()):
+                        row[column] += weight
+                    if token in intensities:
+                        levels.append(intensities[token])
+            ids.append(workout_id)
+            names.append(name)
+            features.append(row)
+            intensity.append(max(levels) if levels else 0.5)
+        self.workout_ids = np.array(ids, dtype=np.int64)
+        self.workout_names = names
+        self.features = _normalized(np.array(features, dtype=np.float32).reshape(len(ids), len(self.types)))
+        self.workout_intensity = np.array(intensity, dtype=np.float32)
+
+    def _derive(self):
+        """Recompute the query matrix from the profiles, teams and workouts"""
+        if 'workouts' not in self._versions:
+            self._load_workouts()
+        profiles = _normalized(self.minutes)
+        # Teammates: every team's summed profiles, minus the user's own, over
+        # the number of teammates across all of the user's teams
+        user_rows, team_rows = self.memberships
+        team_sums = np.zeros((int(team_rows.max()) + 1 if len(team_rows) else 0, profiles.shape[1]))
+        np.add.at(team_sums, team_rows, profiles[user_rows])
+        team_sizes = np.bincount(team_rows, minlength=len(team_sums))
+        mates = np.zeros_like(profiles)
+        np.add.at(mates, user_rows, team_sums[team_rows] - profiles[user_rows])
+        mate_counts = np.bincount(user_rows, weights=team_sizes[team_rows] - 1, minlength=len(profiles))
+        mates = _normalized(mates / np.maximum(mate_counts, 1)[:, None])
+        self.global_query = _normalized(self.minutes.sum(axis=0)) if len(self.minutes) else np.zeros(len(self.types))
+        if not self.global_query.any():
+            self.global_query = _normalized(np.ones(len(self.types)))
+        queries = _normalized(profiles + self.config['TEAM_WEIGHT'] * mates)
+        queries[~queries.any(axis=1)] = self.global_query
+        self.queries = queries.astype(np.float32)
+        # Intensity: where the user's average session length ranks among all users
+        average = np.divide(self.minutes.sum(axis=1), self.sessions, out=np.zeros(len(self.sessions)), where=self.sessions > 0)
+        active = np.sort(average[self.sessions > 0])
+        self.intensity = np.full(len(average), 0.5, dtype=np.float32)
+        if len(active):
+            ranks = np.searchsorted(active, average, side='right') / len(active)
+            self.intensity[self.sessions > 0] = ranks[self.sessions > 0]
+
+    # Scoring
+
+    def recommend_many(self, user_ids, limit=10):
+        """``[(workout id, name, score)]`` lists of the ``limit`` best workouts for each user"""
+        with self._lock:
+            if not len(self.workout_ids) or not len(user_ids):
+                return [[] for _ in user_ids]
+            rows = np.array([self.user_rows.get(user_id, -1) for user_id in user_ids], dtype=np.intp)
+            known = rows >= 0
+            queries = np.tile(self.global_query.astype(np.float32), (len(rows), 1))
+            queries[known] = self.queries[rows[known]]
+            intensity = np.full(len(rows), 0.5, dtype=np.float32)
+            intensity[known] = self.intensity[rows[known]]
+            share = self.config['INTENSITY_WEIGHT']
+            scores = (1 - share) * (queries @ self.features.T)
+            scores += share * (1 - np.abs(intensity[:, None] - self.workout_intensity[None, :]))
+            k = min(limit, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            # Best first, the lower workout id first among equal scores
+            order = np.lexsort((self.workout_ids[top], -top_scores), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            return [
+                [(int(self.workout_ids[column]), self.workout_names[column], float(scores[index, column])) for column in row]
+                for index, row in enumerate(top)
+            ]
+
+    def recommend(self, user_id, limit=10):
+        return self.recommend_many([user_id], limit)[0]
+
+
+recommender = Recommender()
+
+
+def get_recommender():
+    """The process-wide recommender, refreshed if due"""
+    recommender.refresh()
+    return recommender
+
+
+def recommend_all(limit=10, chunk_size=1000):
+    """Yield ``(user id, recommendations)`` for every user, scoring ``chunk_size`` users at once"""
+    engine = get_recommender()
+    user_ids = User.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size)
+    chunk = []
+    for user_id in user_ids:
+        chunk.append(user_id)
+        if len(chunk) >= chunk_size:
+            yield from zip(chunk, engine.recommend_many(chunk, limit))
+            chunk = []
+    if chunk:
+        yield from zip(chunk, engine.recommend_many(chunk, limit))
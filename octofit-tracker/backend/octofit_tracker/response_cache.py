@@ -0,0 +1,224 @@
+"""Server-side cache of rendered GET responses.
+
+Responses of the cached viewsets are stored rendered, keyed by their strong
+ETag (``versions.etag``): the URL, query string, renderer and the version of
+the collection. Writes bump the versions of the collections they affect (an
+``Activity`` write bumps ``activity``, ``leaderboard`` and ``stats``), which
+moves every reader of those collections to new keys at once without
+scanning; entries of old versions age out of the cache.
+
+Two backends are available:
+
+* ``lru``: an in-process LRU bounded by entry count and total bytes.
+* ``django``: any configured Django cache, e.g. a file based or memcached
+  cache shared by all workers on the host.
+
+Concurrent misses on the same key are collapsed: one request renders the
+response while the others wait for it (see ``ResponseCache.fill``), so a
+hot key expiring does not stampede the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'lru',
+    'TIMEOUT': 60,
+    'MAX_ENTRIES': 1000,
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'CACHE_ALIAS': 'default',
+    # How long a request waits for another one filling the same key
+    'FILL_WAIT': 5.0,
+}
+
+class LRUBackend:
+    """In-process LRU bounded by entry count and total bytes"""
+
+    shared = False
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value, size = entry
+            if expires < time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        size = len(value[2])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.monotonic() + timeout, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def add(self, key, value, timeout):
+        # Fills are already serialized by the in-process lock
+        return True
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class DjangoCacheBackend:
+    """Stores entries in a configured Django cache, shared between workers"""
+
+    shared = True
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+    def add(self, key, value, timeout):
+        return self.cache.add(key, value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ResponseCache:
+    def __init__(self, backend, timeout, fill_wait):
+        self.backend = backend
+        self.timeout = timeout
+        self.fill_wait = fill_wait
+        self._fill_locks = {}
+        self._fill_locks_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'waits': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def key(self, etag):
+        return f'octofit:resp:{etag}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.timeout)
+        self._count('stores')
+
+    @contextmanager
+    def fill(self, key):
+        """Serialize the requests filling ``key``.
+
+        Yields the cached value if another request stored it while this one
+        waited, otherwise None; the caller then renders and stores it.
+        """
+        with self._fill_locks_lock:
+            lock = self._fill_locks.setdefault(key, threading.Lock())
+        acquired = lock.acquire(blocking=False)
+        if not acquired:
+            self._count('waits')
+            # Past fill_wait, fill without the lock rather than queue longer
+            acquired = lock.acquire(timeout=self.fill_wait)
+        filling = False
+        try:
+            value = self.backend.get(key)
+            if value is None and self.backend.shared:
+                value, filling = self._wait_for_other_workers(key)
+            yield value
+        finally:
+            if filling:
+                self.backend.delete(f'{key}:fill')
+            if acquired:
+                lock.release()
+                with self._fill_locks_lock:
+                    if self._fill_locks.get(key) is lock and not lock.locked():
+                        del self._fill_locks[key]
+
+    def _wait_for_other_workers(self, key):
+        """Wait for a fill running in another process, via an advisory key.
+
+        Returns the value once the other process stored it, or None and
+        whether this request took the advisory key, which it then releases.
+        """
+        deadline = time.monotonic() + self.fill_wait
+        while not self.backend.add(f'{key}:fill', 1, self.fill_wait):
+            if time.monotonic() > deadline:
+                return None, False
+            time.sleep(0.01)
+            value = self.backend.get(key)
+            if value is not None:
+                return value, False
+        return None, True
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['backend'] = type(self.backend).__name__
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_RESPONSE_CACHE', {})}
+
+
+def get_response_cache():
+    """The process-wide response cache, or None when it is disabled"""
+    global _cache
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if config['BACKEND'] == 'django':
+                    backend = DjangoCacheBackend(config['CACHE_ALIAS'])
+                else:
+                    backend = LRUBackend(config['MAX_ENTRIES'], config['MAX_BYTES'])
+                _cache = ResponseCache(backend, config['TIMEOUT'], config['FILL_WAIT'])
+    return _cache
+
+
+def reset_response_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -0,0 +1,251 @@
+"""Per-user daily activity rollups and the weekly/monthly stats built on them.
+
+Every activity write becomes a ``(user, day, activity_type)`` delta applied to
+``ActivityRollup`` with an ``UPDATE ... SET total = total + delta``, one
+UPDATE per distinct delta of a write rather than per row. Dashboard queries
+then let the database sum the rollup rows per day instead of raw activities.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import archive, versions
+from .models import Activity, ActivityRollup
+
+
+def activity_day(date):
+    """The UTC calendar day an activity ``date`` is rolled up into"""
+    if isinstance(date, str):
+        date = parse_datetime(date)
+    if timezone.is_aware(date):
+        date = date.astimezone(timezone.utc)
+    return date.date()
+
+
+def activity_changed(previous, current):
+    """Apply the difference between two activity states to the rollups.
+
+    States are anything with ``user_id``, ``activity_type``, ``duration`` and
+    ``date`` attributes; either side may be None.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for state, sign in ((previous, -1), (current, 1)):
+        if state is not None:
+            delta = deltas[(state.user_id, activity_day(state.date), state.activity_type)]
+            delta[0] += sign * int(state.duration or 0)
+            delta[1] += sign
+    apply_deltas(deltas)
+
+
+def activities_created(activities):
+    deltas = defaultdict(lambda: [0, 0])
+    for activity in activities:
+        delta = deltas[(activity.user_id, activity_day(activity.date), activity.activity_type)]
+        delta[0] += int(activity.duration or 0)
+        delta[1] += 1
+    apply_deltas(deltas)
+
+
+# Fields of a rollup's key, as in the delta dicts
+KEY_FIELDS = ('user_id', 'day', 'activity_type')
+
+
+def _existing_rollups(keys):
+    """``{key: id}`` of the stored rollups among ``(user_id, day, activity_type)`` keys, in one query"""
+    # Every combination of the keys' values, a superset of the keys
+    lookups = {f'{field}__in': {key[position] for key in keys} for position, field in enumerate(KEY_FIELDS)}
+    rows = ActivityRollup.objects.filter(**lookups).values_list(*KEY_FIELDS, 'id')
+    return {row[:3]: row[3] for row in rows if row[:3] in keys}
+
+
+def _changes(duration, count, now):
+    return {
+        'total_duration': F('total_duration') + duration,
+        'activity_count': F('activity_count') + count,
+        'updated_at': now,
+    }
+
+
+def _apply_one(key, duration, count, now):
+    rows = ActivityRollup.objects.filter(**dict(zip(KEY_FIELDS, key)))
+    if rows.update(**_changes(duration, count, now)):
+        if count < 0:
+            # Drop rollups whose last activity went away
+            rows.filter(activity_count__lte=0).delete()
+        return
+    if count <= 0:
+        # Nothing to subtract from, e.g. the user's rollups were
+        # deleted first by the cascade of a user delete
+        return
+    try:
+        with transaction.atomic():
+            ActivityRollup.objects.create(**dict(zip(KEY_FIELDS, key)), total_duration=duration, activity_count=count)
+    except IntegrityError:
+        # Another writer created the row first, add to it instead
+        rows.update(**_changes(duration, count, now))
+
+
+def apply_deltas(deltas):
+    """Apply ``{(user_id, day, activity_type): [duration, count]}`` deltas.
+
+    As for the sketch bins, the stored rollups are read in one query, the
+    ones receiving the same delta updated together and the missing ones
+    inserted in bulk; rows another writer deleted or created in between
+    fall back to one update or insert each.
+    """
+    deltas = {key: tuple(value) for key, value in deltas.items() if any(value)}
+    if not deltas:
+        return
+    now = timezone.now()
+    with transaction.atomic(savepoint=False):
+        existing = _existing_rollups(deltas)
+        keys_by_delta = defaultdict(list)
+        for key in existing:
+            keys_by_delta[deltas[key]].append(key)
+        for (duration, count), keys in keys_by_delta.items():
+            ids = [existing[key] for key in keys]
+            rows = ActivityRollup.objects.filter(id__in=ids)
+            updated = rows.update(**_changes(duration, count, now))
+            if count < 0:
+                rows.filter(activity_count__lte=0).delete()
+            elif updated < len(ids):
+                # Emptied and deleted since they were read
+                remaining = set(rows.values_list('id', flat=True))
+                for key in keys:
+                    if existing[key] not in remaining:
+                        _apply_one(key, duration, count, now)
+        missing = [key for key, (_, count) in deltas.items() if key not in existing and count > 0]
+        if not missing:
+            return
+        try:
+            with transaction.atomic():
+                ActivityRollup.objects.bulk_create([
+                    ActivityRollup(**dict(zip(KEY_FIELDS, key)), total_duration=deltas[key][0], activity_count=deltas[key][1])
+                    for key in missing
+                ])
+        except IntegrityError:
+            for key in missing:
+                _apply_one(key, *deltas[key], now)
+
+
+def recompute(user_days):
+    """Recompute the rollups of the given ``(user_id, day)`` pairs from raw and archived activities"""
+    user_days = set(user_days)
+    days_by_user = defaultdict(set)
+    for user_id, day in user_days:
+        days_by_user[user_id].add(day)
+    totals = archive.archived_days(user_days)
+    with transaction.atomic():
+        for user_id, days in days_by_user.items():
+            ActivityRollup.objects.filter(user_id=user_id, day__in=days).delete()
+            start = datetime.combine(min(days), time.min, tzinfo=timezone.utc)
+            end = datetime.combine(max(days) + timedelta(days=1), time.min, tzinfo=timezone.utc)
+            activities = Activity.objects.filter(user_id=user_id, date__gte=start, date__lt=end)
+            for activity_type, duration, date in activities.values_list('activity_type', 'duration', 'date'):
+                day = activity_day(date)
+                if day in days:
+                    total = totals[(user_id, day, activity_type)]
+                    total[0] += int(duration or 0)
+                    total[1] += 1
+        ActivityRollup.objects.bulk_create([
+            ActivityRollup(
+                user_id=user_id, day=day, activity_type=activity_type,
+                total_duration=duration, activity_count=count,
+            )
+            for (user_id, day, activity_type), (duration, count) in totals.items()
+        ])
+        versions.bump('stats')
+
+
+def rebuild_rollups(since=None, chunk_size=2000):
+    """Recompute the rollups from raw activities, optionally from ``since`` on.
+
+    Activities are streamed in date order and flushed one day at a time, so
+    memory stays bounded by the activity of a single day. Rollups of archived
+    months are kept as they are, see ``archive``.
+    """
+    if since is not None:
+        # Whole days only: the rollups of since's day are replaced, so all of
+        # its activities must be counted again
+        since = datetime.combine(activity_day(since), time.min, tzinfo=timezone.utc)
+    archived_until = archive.boundary()
+    if archived_until is not None:
+        start = datetime.combine(archived_until, time.min, tzinfo=timezone.utc)
+        since = start if since is None else max(since, start)
+    activities = Activity.objects.order_by('date')
+    rollups = ActivityRollup.objects.all()
+    if since is not None:
+        activities = activities.filter(date__gte=since)
+        rollups = rollups.filter(day__gte=since.date())
+    written = 0
+    with transaction.atomic():
+        rollups.delete()
+        current_day, totals = None, defaultdict(lambda: [0, 0])
+
+        def flush():
+            ActivityRollup.objects.bulk_create([
+                ActivityRollup(
+                    user_id=user_id, day=current_day, activity_type=activity_type,
+                    total_duration=duration, activity_count=count,
+                )
+                for (user_id, activity_type), (duration, count) in totals.items()
+            ], batch_size=1000)
+            return len(totals)
+
+        rows = activities.values_list('user_id', 'activity_type', 'duration', 'date').iterator(chunk_size=chunk_size)
+        for user_id, activity_type, duration, date in rows:
+            day = activity_day(date)
+            if day != current_day:
+                written += flush()
+                current_day, totals = day, defaultdict(lambda: [0, 0])
+            total = totals[(user_id, activity_type)]
+            total[0] += int(duration or 0)
+            total[1] += 1
+        written += flush()
+    versions.bump('stats')
+    return written
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+PERIODS = {
+    'weekly': week_start,
+    'monthly': month_start,
+}
+
+
+def period_totals(rollups, period):
+    """Sum rollups into ``{period start, activity_type}`` buckets.
+
+    The database sums the rollups per day and activity type, whatever the
+    number of users; only those daily totals are folded into periods here.
+    """
+    bucket_of = PERIODS[period]
+    totals = defaultdict(lambda: [0, 0])
+    rows = rollups.order_by().values('day', 'activity_type').annotate(
+        duration=Sum('total_duration'), count=Sum('activity_count'),
+    ).values_list('day', 'activity_type', 'duration', 'count')
+    for day, activity_type, duration, count in rows:
+        total = totals[(bucket_of(day), activity_type)]
+        total[0] += duration or 0
+        total[1] += count or 0
+    return [
+        {
+            'period_start': start.isoformat(),
+            'activity_type': activity_type,
+            'total_duration': duration,
+            'activity_count': count,
+        }
+        for (start, activity_type), (duration, count) in sorted(totals.items())
+        if count
+    ]
@@ -0,0 +1,317 @@
+"""In-memory full-text index over the workout catalog.
+
+``/api/workouts/search/?q=`` is answered from a ``SearchIndex`` held by each
+process instead of the client downloading every workout. Names and
+descriptions are tokenized (case and accents folded, split on anything that
+is not a letter or digit); every query token matches the indexed terms it
+is a prefix of, and a workout must match every query token. Results are
+ranked by the sum of ``idf * weight`` of the matched terms, where a term's
+weight in a workout is its frequency, name occurrences counting
+``NAME_BOOST`` times, normalized by the square root of the workout's length.
+Prefix matches count ``PREFIX_PENALTY`` of an exact match.
+
+Storage is compact: terms are interned and numbered, kept once in a sorted
+list for prefix lookups by bisection, and each term's postings are two
+parallel typed arrays of 64 bit workout ids (ascending) and float32
+weights. A query expands each token once into one sorted array of the
+documents matching any of its terms, with their best score, and intersects
+these arrays with NumPy from the rarest token on; no document is probed on
+its own, so the cost follows the size of the postings, not candidates
+times expansions.
+
+The index is built when the server starts (or on first use) and updated
+incrementally after every committed ``Workout`` save or delete in this
+process. Writes from other processes are noticed through the ``workouts``
+collection version and cause a rebuild on a background thread, during
+which the previous index keeps answering.
+"""
+import logging
+import math
+import re
+import sys
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from . import versions
+from .models import Workout
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BUILD_AT_STARTUP': True,
+    # Most indexed terms a query token expands to as a prefix
+    'MAX_EXPANSIONS': 64,
+    # Serve the loaded index while a rebuild runs on a thread
+    'REBUILD_IN_BACKGROUND': True,
+}
+NAME_BOOST = 3
+PREFIX_PENALTY = 0.5
+_TOKEN = re.compile(r'\w+')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_SEARCH', {})}
+
+
+def tokenize(text):
+    """Lowercased, accent-free word tokens of ``text``"""
+    folded = (text or '').casefold()
+    if not folded.isascii():
+        folded = ''.join(char for char in unicodedata.normalize('NFKD', folded) if not unicodedata.combining(char))
+    return _TOKEN.findall(folded)
+
+
+class SearchIndex:
+    """Inverted index of ``(id, name, description)`` documents"""
+
+    def __init__(self, max_expansions=DEFAULTS['MAX_EXPANSIONS']):
+        self._lock = threading.RLock()
+        self.max_expansions = max_expansions
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._term_ids = {}
+            self._sorted_terms = []
+            self._postings = []
+            self._weights = []
+            # Document id -> (name, term ids), to render results and remove documents
+            self._documents = {}
+            self.version = None
+            self.loaded = False
+
+    def __len__(self):
+        return len(self._documents)
+
+    def replace(self, other):
+        """Take over the contents of the freshly built index ``other``.
+
+        Ignored if this index was brought past ``other``'s version meanwhile.
+        """
+        with self._lock, other._lock:
+            if self.loaded and None not in (self.version, other.version) and self.version >= other.version:
+                return
+            self._term_ids, self._sorted_terms = other._term_ids, other._sorted_terms
+            self._postings, self._weights, self._documents = other._postings, other._weights, other._documents
+            self.max_expansions = other.max_expansions
+            self.version, self.loaded = other.version, other.loaded
+
+    def load(self, rows, version=None):
+        """Replace the contents with ``(id, name, description)`` rows in ascending id order"""
+        with self._lock:
+            self.reset()
+            for doc_id, name, description in rows:
+                self._index(doc_id, name, description, append=True)
+            self.version = version
+            self.loaded = True
+
+    def add(self, doc_id, name, description):
+        """Index a document, replacing any previous version of it"""
+        with self._lock:
+            self._remove(doc_id)
+            self._index(doc_id, name, description, append=False)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _term_id(self, term):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term = sys.intern(term)
+            term_id = self._term_ids[term] = len(self._postings)
+            # Workout ids are 64 bit (BigAutoField)
+            self._postings.append(array('Q'))
+            self._weights.append(array('f'))
+            insort(self._sorted_terms, term)
+        return term_id
+
+    def _index(self, doc_id, name, description, append):
+        counts = {}
+        name_tokens, description_tokens = tokenize(name), tokenize(description)
+        for token in name_tokens:
+            counts[token] = counts.get(token, 0) + NAME_BOOST
+        for token in description_tokens:
+            counts[token] = counts.get(token, 0) + 1
+        norm = math.sqrt(len(name_tokens) * NAME_BOOST + len(description_tokens)) or 1.0
+        term_ids = []
+        for term, count in counts.items():
+            term_id = self._term_id(term)
+            postings, weights = self._postings[term_id], self._weights[term_id]
+            # Rows arrive in id order while loading, so postings stay sorted
+            position = len(postings) if append else bisect_left(postings, doc_id)
+            postings.insert(position, doc_id)
+            weights.insert(position, count / norm)
+            term_ids.append(term_id)
+        self._documents[doc_id] = (name, array('I', term_ids))
+
+    def _remove(self, doc_id):
+        document = self._documents.pop(doc_id, None)
+        if document is None:
+            return
+        for term_id in document[1]:
+            postings = self._postings[term_id]
+            position = bisect_left(postings, doc_id)
+            if position < len(postings) and postings[position] == doc_id:
+                del postings[position]
+                del self._weights[term_id][position]
+
+    def _expand(self, token):
+        """``(term id, boost)`` of the indexed terms ``token`` is a prefix of"""
+        matches = []
+        position = bisect_left(self._sorted_terms, token)
+        while position < len(self._sorted_terms) and len(matches) < self.max_expansions:
+            term = self._sorted_terms[position]
+            if not term.startswith(token):
+                break
+            term_id = self._term_ids[term]
+            if self._postings[term_id]:
+                matches.append((term_id, 1.0 if term == token else PREFIX_PENALTY))
+            position += 1
+        return matches
+
+    def search(self, query, limit=20):
+        """Return ``(matching documents, [(doc id, name, score)])`` for ``query``"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return 0, []
+        with self._lock:
+            total = len(self._documents) or 1
+            expansions = []
+            for token in tokens:
+                terms = self._expand(token)
+                if not terms:
+                    return 0, []
+                expansions.append(self._token_postings(terms, total))
+            # Intersect from the rarest token, so the arrays only shrink
+            expansions.sort(key=lambda postings: len(postings[0]))
+            ids, scores = expansions[0]
+            for other_ids, other_scores in expansions[1:]:
+                ids, mine, theirs = np.intersect1d(ids, other_ids, assume_unique=True, return_indices=True)
+                if not len(ids):
+                    return 0, []
+                scores = scores[mine] + other_scores[theirs]
+            best = self._best(ids, scores, limit)
+            return len(ids), [(doc_id, self._documents[doc_id][0], score) for doc_id, score in best]
+
+    def _idf(self, term_id, total):
+        return math.log(1 + total / len(self._postings[term_id]))
+
+    def _token_postings(self, terms, total):
+        """Ascending ids of the documents matching any of ``terms``, and their best scores.
+
+        The arrays are copies: the postings may not be resized while a view
+        of them exists.
+        """
+        ids = np.concatenate([np.frombuffer(self._postings[term_id], dtype=np.uint64) for term_id, _ in terms])
+        weights = np.concatenate([np.frombuffer(self._weights[term_id], dtype=np.float32) for term_id, _ in terms])
+        factors = [self._idf(term_id, total) * boost for term_id, boost in terms]
+        scores = weights.astype(np.float64) * np.repeat(factors, [len(self._postings[term_id]) for term_id, _ in terms])
+        if len(terms) == 1:
+            return ids, scores
+        order = np.argsort(ids, kind='stable')
+        ids, scores = ids[order], scores[order]
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+        return ids[starts], np.maximum.reduceat(scores, starts)
+
+    @staticmethod
+    def _best(ids, scores, limit):
+        """``limit`` best ``(id, score)``, by score then ascending id"""
+        candidates = np.arange(len(ids))
+        if len(ids) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            # Keep every tie of the last place, the id decides between them
+            candidates = np.flatnonzero(scores >= scores[top].min())
+        order = candidates[np.lexsort((ids[candidates], -scores[candidates]))][:limit]
+        return [(int(ids[position]), float(scores[position])) for position in order]
+
+
+workout_index = SearchIndex()
+
+
+def build_index(index=workout_index):
+    """(Re)load ``index`` from the workout table"""
+    index.max_expansions = get_config()['MAX_EXPANSIONS']
+    version, _ = versions.current('workouts')
+    rows = Workout.objects.order_by('id').values_list('id', 'name', 'description').iterator(chunk_size=2000)
+    index.load(rows, version)
+    return index
+
+
+_rebuild_lock = threading.Lock()
+_rebuilding = None
+
+
+def _rebuild():
+    global _rebuilding
+    try:
+        workout_index.replace(build_index(SearchIndex()))
+    except DatabaseError:
+        logger.warning('Could not rebuild the workout search index', exc_info=True)
+    finally:
+        connections.close_all()
+        with _rebuild_lock:
+            _rebuilding = None
+
+
+def rebuild_in_background():
+    """Rebuild the index on a thread, unless a rebuild is already running"""
+    global _rebuilding
+    with _rebuild_lock:
+        if _rebuilding is None:
+            _rebuilding = threading.Thread(target=_rebuild, name='octofit-search-rebuild', daemon=True)
+            _rebuilding.start()
+        return _rebuilding
+
+
+def get_search_index():
+    """The process-wide workout index, rebuilt if another process changed the catalog.
+
+    A loaded index keeps serving while it is rebuilt in the background,
+    unless ``REBUILD_IN_BACKGROUND`` is off; only the first build blocks.
+    """
+    version, _ = versions.current('workouts')
+    if workout_index.loaded and workout_index.version == version:
+        return workout_index
+    if workout_index.loaded and get_config()['REBUILD_IN_BACKGROUND']:
+        rebuild_in_background()
+        return workout_index
+    with workout_index._lock:
+        if not workout_index.loaded or workout_index.version != version:
+            build_index()
+    return workout_index
+
+
+def build_at_startup():
+    """Build the index while the server starts, if ``BUILD_AT_STARTUP``"""
+    if not get_config()['BUILD_AT_STARTUP']:
+        return
+    try:
+        build_index()
+    except DatabaseError:
+        logger.warning('Could not build the workout search index at startup, building it on first use', exc_info=True)
+
+
+def workout_changed(workout_id, expected_version):
+    """Apply a committed save or delete of workout ``workout_id`` to the index.
+
+    ``expected_version`` is the collection version the write produced: if the
+    index was one version behind it, no other writer came in between and the
+    index is current again, otherwise it is left to be rebuilt.
+    """
+    if not workout_index.loaded:
+        return
+    row = Workout.objects.filter(pk=workout_id).values_list('name', 'description').first()
+    with workout_index._lock:
+        if row is None:
+            workout_index.remove(workout_id)
+        else:
+            workout_index.add(workout_id, *row)
+        if workout_index.version is not None and expected_version == workout_index.version + 1:
+            workout_index.version = expected_version
@@ -1,27 +1,140 @@
+from django.contrib.auth.hashers import make_password
 from rest_framework import serializers
+from .instrumentation import timed
 from .models import User, Team, Activity, Leaderboard, Workout
 
-class UserSerializer(serializers.ModelSerializer):
+class InstrumentedListSerializer(serializers.ListSerializer):
+    """Reports the time spent rendering the list to PerformanceMiddleware"""
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+class InstrumentedModelSerializer(serializers.ModelSerializer):
+    """Reports the time spent rendering an instance to PerformanceMiddleware"""
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+def requested_expansions(request):
+    """Names listed in ``?expand=`` on a read request"""
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return set()
+    return {name.strip() for name in request.query_params.get('expand', '').split(',') if name.strip()}
+
+_readable_fields = {}
+
+def readable_fields(serializer_class):
+    """``{name: field}`` of the fields ``serializer_class`` renders"""
+    if serializer_class not in _readable_fields:
+        _readable_fields[serializer_class] = {field.field_name: field for field in serializer_class()._readable_fields}
+    return _readable_fields[serializer_class]
+
+class SparseFieldsetSerializerMixin:
+    """Renders only the fields named by the ``fields`` context entry.
+
+    Views put the fieldset selected with ``?fields=`` there, see
+    ``views.SparseFieldsetMixin``; None renders every field.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.context.get('fields')
+        if selected is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in selected}
+
+class ExpandableSerializerMixin:
+    """Embeds the related objects named in ``?expand=`` instead of their ids.
+
+    ``expandable_fields`` maps a field name to the read-only serializer used
+    in its place. The view is expected to batch-load the related objects.
+    Writes always use the plain id fields.
+    """
+    expandable_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in requested_expansions(self.context.get('request')) & set(self.expandable_fields):
+            serializer_class, kwargs = self.expandable_fields[name]
+            fields[name] = serializer_class(read_only=True, **kwargs)
+        return fields
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    """The public fields of a user, used when a user is embedded"""
+    class Meta:
+        model = User
+        fields = ['id', 'email', 'name']
+
+class TeamSummarySerializer(serializers.ModelSerializer):
+    """A team without its member list, used when a team is embedded"""
+    class Meta:
+        model = Team
+        fields = ['id', 'name']
+
+class UserSerializer(SparseFieldsetSerializerMixin, InstrumentedModelSerializer):
+    def validate_password(self, value):
+        # Store a hash, but keep the stored one when a client sends it back unchanged
+        if self.instance is not None and value == self.instance.password:
+            return value
+        return make_password(value)
+
     class Meta:
         model = User
         fields = '__all__'
+        # Password hashes are accepted on writes but never served
+        extra_kwargs = {'password': {'write_only': True}}
+        list_serializer_class = InstrumentedListSerializer
+
+class TeamSerializer(SparseFieldsetSerializerMixin, ExpandableSerializerMixin, InstrumentedModelSerializer):
+    expandable_fields = {'members': (UserSummarySerializer, {'many': True})}
 
-class TeamSerializer(serializers.ModelSerializer):
     class Meta:
         model = Team
         fields = '__all__'
+        read_only_fields = Team.COUNTERS
+        list_serializer_class = InstrumentedListSerializer
+
+    def save(self, **kwargs):
+        # Setting the members moves the counters in the database only
+        instance = super().save(**kwargs)
+        instance.refresh_from_db(fields=Team.COUNTERS)
+        return instance
+
+class ActivitySerializer(SparseFieldsetSerializerMixin, ExpandableSerializerMixin, InstrumentedModelSerializer):
+    expandable_fields = {'user': (UserSummarySerializer, {})}
 
-class ActivitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Activity
         fields = '__all__'
+        list_serializer_class = InstrumentedListSerializer
+
+class ActivityBatchItemSerializer(serializers.Serializer):
+    """Validates one entry of a batch upload without touching the database"""
+    user = serializers.IntegerField(min_value=1)
+    activity_type = serializers.CharField(max_length=50)
+    duration = serializers.IntegerField()
+    date = serializers.DateTimeField()
+    idempotency_key = serializers.CharField(max_length=64, required=False, allow_null=True)
+
+class UserImportItemSerializer(serializers.Serializer):
+    """Validates one row of a bulk user import without touching the database"""
+    email = serializers.EmailField(max_length=254)
+    name = serializers.CharField(max_length=100)
+    # Rows without a password get an unusable one
+    password = serializers.CharField(max_length=128, required=False, allow_blank=True, allow_null=True, trim_whitespace=False)
+
+class LeaderboardSerializer(SparseFieldsetSerializerMixin, ExpandableSerializerMixin, InstrumentedModelSerializer):
+    expandable_fields = {'team': (TeamSummarySerializer, {})}
 
-class LeaderboardSerializer(serializers.ModelSerializer):
     class Meta:
         model = Leaderboard
         fields = '__all__'
+        list_serializer_class = InstrumentedListSerializer
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsetSerializerMixin, InstrumentedModelSerializer):
     class Meta:
         model = Workout
         fields = '__all__'
+        list_serializer_class = InstrumentedListSerializer
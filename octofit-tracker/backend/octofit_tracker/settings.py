@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "octofit_tracker.instrumentation.PerformanceMiddleware",
+    "octofit_tracker.shedding.LoadSheddingMiddleware",
+    "octofit_tracker.async_views.AsyncRoutesMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -85,6 +89,10 @@ DATABASES = {
         "CLIENT": {
             "host": "mongodb://localhost:27017/",
         },
+        # Seconds each worker thread keeps its connection, and MongoClient,
+        # between requests; 0 reconnects on every request. Keep 0 under ASGI,
+        # where every request runs on a new thread
+        "CONN_MAX_AGE": int(os.environ.get("OCTOFIT_CONN_MAX_AGE", "0")),
     }
 }
 
@@ -146,8 +154,175 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.SessionAuthentication",
         "rest_framework.authentication.BasicAuthentication",
     ],
+    "DEFAULT_PAGINATION_CLASS": "octofit_tracker.pagination.KeysetPagination",
+    "PAGE_SIZE": 100,
+    "DEFAULT_THROTTLE_CLASSES": [
+        "octofit_tracker.throttling.UserTokenBucketThrottle",
+        "octofit_tracker.throttling.IPTokenBucketThrottle",
+    ],
+}
+
+# Token bucket budgets per user and per client address (octofit_tracker.throttling).
+# Scopes are "read", "write" or "<basename>-<action>"; BACKEND is "local"
+# (per process), "mmap" (shared by the workers of a host) or "django"
+OCTOFIT_THROTTLES = {
+    "ENABLED": True,
+    "BACKEND": "local",
+    "RATES": {
+        "read": "1200/min",
+        "write": "300/min",
+        "activity-batch": "60/min",
+        "user-bulk": "10/min",
+    },
+}
+
+# Refuse writes, then every request, with a 503 and Retry-After while the
+# database latency, requests in flight or job backlog exceed these limits
+# (octofit_tracker.shedding)
+OCTOFIT_LOAD_SHEDDING = {
+    "ENABLED": True,
+    "DB_LATENCY_MS": 50.0,
+    "MAX_IN_FLIGHT": 64,
+    "MAX_JOB_BACKLOG": 10000,
+    "STATUS": 503,
+    "RETRY_AFTER": 5,
+}
+
+# Per-request performance instrumentation (octofit_tracker.instrumentation)
+# SAMPLE_RATE is the fraction of requests measured, 0 turns it off
+OCTOFIT_PERFORMANCE = {
+    "SAMPLE_RATE": 1.0,
+    "SLOW_QUERIES": 5,
+    "SERVER_TIMING": True,
 }
 
+# Log records are queued by the logging thread and written by one background
+# listener (octofit_tracker.logs). Records of the SAMPLED loggers, one per SQL
+# statement, are kept at SAMPLE_RATE and at most MAX_PER_SECOND a second;
+# warnings and errors always are
+OCTOFIT_LOGGING = {
+    "QUEUE": True,
+    "QUEUE_SIZE": 10000,
+    "SAMPLED": ["djongo", "django.db.backends"],
+    "SAMPLE_RATE": float(os.environ.get("OCTOFIT_SQL_LOG_SAMPLE_RATE", "0.01")),
+    "MAX_PER_SECOND": 20,
+}
+
+# Serve GET list/retrieve from value rows instead of model serializers
+# (octofit_tracker.fastpath), the output is the same either way
+OCTOFIT_FAST_READS = True
+
+# Under ASGI, serve GET list/retrieve of activity, leaderboard and workouts
+# from async views (octofit_tracker.async_views) so that database round trips
+# do not hold a worker thread. WSGI deployments always use the sync views
+OCTOFIT_ASYNC_READS = True
+
+# Server-Sent Events of leaderboard changes at /api/leaderboard/stream/ under
+# ASGI (octofit_tracker.live). Changes within WINDOW seconds are coalesced
+# and subscribers more than QUEUE_SIZE events behind are disconnected
+OCTOFIT_LIVE = {
+    "WINDOW": 1.0,
+    "QUEUE_SIZE": 32,
+    "HEARTBEAT": 15.0,
+}
+
+# Cache of rendered GET responses (octofit_tracker.response_cache), invalidated
+# by model writes. BACKEND is "lru" (per process) or "django" to use the
+# CACHES entry named by CACHE_ALIAS, shared between workers
+OCTOFIT_RESPONSE_CACHE = {
+    "ENABLED": True,
+    "BACKEND": "lru",
+    "TIMEOUT": 60,
+    "MAX_ENTRIES": 1000,
+    "MAX_BYTES": 32 * 1024 * 1024,
+}
+
+# Where leaderboard points and activity rollups are recomputed after writes:
+# "inline" in the writing request, or "deferred" to queue debounced jobs for
+# `manage.py run_jobs` (octofit_tracker.jobs)
+OCTOFIT_DERIVED_DATA = "inline"
+OCTOFIT_JOBS = {
+    "DEBOUNCE": 2.0,
+    "MAX_DELAY": 30.0,
+    "WORKERS": 2,
+    "MAX_ATTEMPTS": 5,
+}
+
+# Bulk user imports (manage.py import_users, POST /api/users/bulk/), see
+# octofit_tracker.imports. WORKERS is the number of password hashing
+# processes of import_users, None for one per core; the API requests of a
+# server process share one pool of REQUEST_WORKERS processes. API responses
+# list at most MAX_REPORTED rejected rows
+OCTOFIT_IMPORTS = {
+    "WORKERS": None,
+    "REQUEST_WORKERS": 2,
+    "CHUNK_SIZE": 1000,
+    "MAX_REPORTED": 100,
+}
+
+# Activities older than HORIZON_DAYS are moved by `manage.py compact_activities`
+# to compressed per-month files under DIR (octofit_tracker.archive) and
+# merged back into reads that cover them. Each worker keeps up to
+# COLUMN_CACHE_BYTES of decoded columns in memory
+OCTOFIT_ARCHIVE = {
+    "DIR": BASE_DIR / "archive",
+    "HORIZON_DAYS": 365,
+    "COLUMN_CACHE_BYTES": 64 * 1024 * 1024,
+}
+
+# In-memory workout search index behind /api/workouts/search/
+# (octofit_tracker.search), built when the server starts unless
+# BUILD_AT_STARTUP is off, in which case the first search builds it. Changes
+# made by other processes are picked up by a rebuild, run in the background
+# unless REBUILD_IN_BACKGROUND is off
+OCTOFIT_SEARCH = {
+    "BUILD_AT_STARTUP": True,
+    "MAX_EXPANSIONS": 64,
+    "REBUILD_IN_BACKGROUND": True,
+}
+
+# Workout recommendations (/api/users/<id>/recommendations/, manage.py
+# recommend_workouts), see octofit_tracker.recommendations. Profiles are
+# refreshed from changed rollups at most every WINDOW seconds
+OCTOFIT_RECOMMENDATIONS = {
+    "HALF_LIFE_DAYS": 30.0,
+    "TEAM_WEIGHT": 0.35,
+    "INTENSITY_WEIGHT": 0.2,
+    "WINDOW": 5.0,
+}
+
+# Activity duration percentile sketches (/api/stats/percentiles/,
+# manage.py rebuild_sketches), see octofit_tracker.sketches. ALPHA is the
+# relative error of the reported percentiles
+OCTOFIT_SKETCHES = {
+    "ALPHA": 0.01,
+}
+
+# Worker start up (octofit_tracker.startup): the steps run by wsgi.py and
+# asgi.py before the first request, and whether to log the timings
+OCTOFIT_STARTUP = {
+    "WARM_UP": ["database", "urls", "views", "serializers", "rank_index", "search", "recommendations"],
+    "LOG": True,
+}
+
+# API-only workers (OCTOFIT_API_ONLY=1 in the environment) skip the apps and
+# middleware that only the admin and the browsable API use, and render JSON
+OCTOFIT_API_ONLY = os.environ.get("OCTOFIT_API_ONLY", "").lower() in ("1", "true", "yes")
+if OCTOFIT_API_ONLY:
+    BROWSER_APPS = ["django.contrib.admin", "django.contrib.sessions", "django.contrib.messages", "django.contrib.staticfiles"]
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in BROWSER_APPS]
+    MIDDLEWARE = [
+        middleware for middleware in MIDDLEWARE
+        if middleware not in (
+            "django.contrib.sessions.middleware.SessionMiddleware",
+            "django.contrib.auth.middleware.AuthenticationMiddleware",
+            "django.contrib.messages.middleware.MessageMiddleware",
+        )
+    ]
+    TEMPLATES[0]["OPTIONS"]["context_processors"].remove("django.contrib.messages.context_processors.messages")
+    REST_FRAMEWORK["DEFAULT_AUTHENTICATION_CLASSES"] = ["rest_framework.authentication.BasicAuthentication"]
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] = ["rest_framework.renderers.JSONRenderer"]
+
 # MongoDB specific settings
 MONGODB_HOST = 'localhost'
 MONGODB_PORT = 27017
@@ -0,0 +1,196 @@
+"""Load shedding when the database or the queues fall behind.
+
+``LoadSheddingMiddleware`` watches three pressure signals in each process:
+
+* the mean database query time of the requests ``PerformanceMiddleware``
+  samples, as a moving average that decays with a ``HALF_LIFE`` so that it
+  recovers once requests stop being measured;
+* the number of requests in flight in the process;
+* with deferred derived data, the number of due ``Job`` rows, polled every
+  ``JOB_POLL`` seconds.
+
+Each is divided by its threshold (``DB_LATENCY_MS``, ``MAX_IN_FLIGHT``,
+``MAX_JOB_BACKLOG``, None to ignore it). From a pressure of 1 writes are
+refused, from ``SEVERE`` everything is, with ``STATUS`` (503, or 429) and a
+``Retry-After`` of ``RETRY_AFTER`` seconds, until the pressure drops again.
+The requests that are let through then finish within bounded latency
+instead of all of them queueing behind an overloaded database. Paths under
+``EXEMPT_PATHS`` (the metrics) are never refused.
+"""
+import asyncio
+import threading
+import time
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+
+from . import jobs
+from .instrumentation import current_metrics
+from .models import Job
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Mean milliseconds per query
+    'DB_LATENCY_MS': 50.0,
+    'MAX_IN_FLIGHT': 64,
+    'MAX_JOB_BACKLOG': 10000,
+    # Pressure from which reads are refused too
+    'SEVERE': 2.0,
+    'STATUS': 503,
+    'RETRY_AFTER': 5,
+    # Seconds for the latency average to halve without new measurements
+    'HALF_LIFE': 5.0,
+    'JOB_POLL': 5.0,
+    'EXEMPT_PATHS': ['/api/metrics/'],
+}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Weight of a new measurement in the latency average
+SMOOTHING = 0.2
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_LOAD_SHEDDING', {})}
+
+
+class LoadMonitor:
+    """Pressure signals of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.job_backlog = 0
+        self._latency = 0.0
+        self._measured = time.monotonic()
+        self._polled = None
+        self.shed = {'writes': 0, 'all': 0}
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def latency(self, half_life, now=None):
+        """Decayed average milliseconds per query"""
+        elapsed = (now or time.monotonic()) - self._measured
+        return self._latency * 0.5 ** (elapsed / half_life)
+
+    def observe(self, db_seconds, queries, half_life):
+        if not queries:
+            return
+        now = time.monotonic()
+        with self._lock:
+            current = self.latency(half_life, now)
+            self._latency = current + SMOOTHING * (db_seconds * 1000 / queries - current)
+            self._measured = now
+
+    def backlog_due(self, interval):
+        """Whether the job backlog should be polled again"""
+        now = time.monotonic()
+        with self._lock:
+            if jobs.deferred() and (self._polled is None or now - self._polled >= interval):
+                self._polled = now
+                return True
+        return False
+
+    def pressure(self, config):
+        signals = (
+            (self.latency(config['HALF_LIFE']), config['DB_LATENCY_MS']),
+            (self.in_flight, config['MAX_IN_FLIGHT']),
+            (self.job_backlog if jobs.deferred() else 0, config['MAX_JOB_BACKLOG']),
+        )
+        return max((value / limit for value, limit in signals if limit), default=0.0)
+
+    def refuses(self, request, config):
+        """Whether to shed ``request``, counting it if so"""
+        if any(request.path.startswith(path) for path in config['EXEMPT_PATHS']):
+            return False
+        pressure = self.pressure(config)
+        kind = 'all' if pressure >= config['SEVERE'] else 'writes' if pressure >= 1 else None
+        if kind is None or (kind == 'writes' and request.method in SAFE_METHODS):
+            return False
+        with self._lock:
+            self.shed[kind] += 1
+        return True
+
+    def snapshot(self, config=None):
+        config = config or get_config()
+        with self._lock:
+            shed = dict(self.shed)
+        return {
+            'enabled': config['ENABLED'],
+            'pressure': round(self.pressure(config), 3),
+            'db_latency_ms': round(self.latency(config['HALF_LIFE']), 3),
+            'in_flight': self.in_flight,
+            'job_backlog': self.job_backlog if jobs.deferred() else None,
+            'shed': shed,
+        }
+
+
+monitor = LoadMonitor()
+
+
+def _due_jobs():
+    return Job.objects.filter(failed=False, available_at__lte=timezone.now())
+
+
+def overloaded_response(config):
+    response = JsonResponse({'detail': 'The server is overloaded, retry later.'}, status=config['STATUS'])
+    response['Retry-After'] = str(config['RETRY_AFTER'])
+    return response
+
+
+class LoadSheddingMiddleware:
+    """Refuses requests under pressure, see the module docstring.
+
+    Placed after ``PerformanceMiddleware``, whose measurements it reads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        config = get_config()
+        if not config['ENABLED']:
+            return self.get_response(request)
+        if monitor.backlog_due(config['JOB_POLL']):
+            monitor.job_backlog = _due_jobs().count()
+        if monitor.refuses(request, config):
+            return overloaded_response(config)
+        monitor.enter()
+        try:
+            return self.get_response(request)
+        finally:
+            monitor.leave()
+            self.observe(config)
+
+    async def __acall__(self, request):
+        config = get_config()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+        if monitor.backlog_due(config['JOB_POLL']):
+            monitor.job_backlog = await sync_to_async(_due_jobs().count)()
+        if monitor.refuses(request, config):
+            return overloaded_response(config)
+        monitor.enter()
+        try:
+            return await self.get_response(request)
+        finally:
+            monitor.leave()
+            self.observe(config)
+
+    def observe(self, config):
+        metrics = current_metrics()
+        if metrics is not None:
+            monitor.observe(metrics.db_time, metrics.db_count, config['HALF_LIFE'])
@@ -0,0 +1,166 @@
+"""Model signal handlers that keep derived data in sync with writes."""
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import jobs, leaderboard, rollups, search, sketches, teams, versions
+from .models import Activity, DurationSketchBin, Leaderboard, Team, User, Workout
+
+ActivityState = namedtuple('ActivityState', ['user_id', 'activity_type', 'duration', 'date'])
+
+
+def _activity_state(activity):
+    return ActivityState(activity.user_id, activity.activity_type, activity.duration, activity.date)
+
+
+@receiver(pre_save, sender=Activity)
+def remember_previous_activity(sender, instance, raw=False, **kwargs):
+    """Stash the stored state of an activity before it is overwritten"""
+    instance._previous_state = None
+    if not raw and instance.pk is not None:
+        row = Activity.objects.filter(pk=instance.pk).values_list(*ActivityState._fields).first()
+        instance._previous_state = ActivityState(*row) if row else None
+
+
+def activity_changed(previous, current):
+    if jobs.deferred():
+        jobs.activities_changed([previous, current])
+        return
+    sketches.activity_changed(previous, current)
+    teams.activity_changed(previous, current)
+    leaderboard.activity_changed(previous, current)
+    rollups.activity_changed(previous, current)
+
+
+@receiver(post_save, sender=Activity)
+def activity_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    activity_changed(getattr(instance, '_previous_state', None), _activity_state(instance))
+
+
+@receiver(post_delete, sender=Activity)
+def activity_deleted(sender, instance, **kwargs):
+    activity_changed(_activity_state(instance), None)
+
+
+def activities_created(activities):
+    """Update derived data for activities written with ``bulk_create``.
+
+    Bulk inserts bypass the model signals, so batch writers call this once
+    for the whole batch instead.
+    """
+    versions.changed('Activity')
+    if jobs.deferred():
+        jobs.activities_changed(activities)
+        return
+    sketches.activities_created(activities)
+    teams.activities_created(activities)
+    deltas = {}
+    for activity in activities:
+        deltas[activity.user_id] = deltas.get(activity.user_id, 0) + leaderboard.activity_points(activity.duration)
+    leaderboard.apply_user_deltas(deltas)
+    rollups.activities_created(activities)
+
+
+def members_changed(team_ids, user_ids, sign):
+    """Update derived data for users joining (sign=1) or leaving (sign=-1) teams.
+
+    Every user of ``user_ids`` joined or left every team of ``team_ids``;
+    ``teams.add_members`` and ``teams.remove_members`` call this once per
+    batch, the ``m2m_changed`` handler below once per ``add``/``remove``.
+    """
+    versions.changed('Team_members')
+    teams.members_changed(team_ids, user_ids, sign)
+    if jobs.deferred():
+        jobs.members_changed(team_ids, user_ids)
+    else:
+        sketches.members_changed(team_ids, user_ids, sign)
+        leaderboard.members_changed(team_ids, user_ids, sign)
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def team_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    related = instance.teams if reverse else instance.members
+    if action == 'pre_clear':
+        # pk_set is not provided for clear(), remember who is about to leave
+        instance._cleared_pks = set(related.values_list('pk', flat=True))
+        return
+    if action == 'pre_remove':
+        # remove() reports every given pk, members or not: keep the members
+        instance._removed_pks = set(related.filter(pk__in=pk_set).values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set, sign = getattr(instance, '_cleared_pks', set()), -1
+    elif action == 'post_remove':
+        pk_set, sign = getattr(instance, '_removed_pks', set()), -1
+    elif action == 'post_add':
+        # add() already drops the pks that were members, pk_set is what was inserted
+        sign = 1
+    else:
+        return
+    if not pk_set:
+        return
+    if reverse:
+        members_changed(pk_set, [instance.pk], sign)
+    else:
+        members_changed([instance.pk], pk_set, sign)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    """A deleted user leaves its teams, whose membership rows go without m2m signals"""
+    team_ids = list(instance.teams.values_list('pk', flat=True))
+    if team_ids:
+        members_changed(team_ids, [instance.pk], -1)
+
+
+@receiver(post_save, sender=Leaderboard)
+def leaderboard_saved(sender, instance, raw=False, **kwargs):
+    if leaderboard.rank_index.loaded and not raw:
+        transaction.on_commit(lambda: leaderboard.rank_index.update(instance.team_id, instance.points))
+
+
+@receiver(post_delete, sender=Team)
+@receiver(post_delete, sender=Leaderboard)
+def ranked_team_deleted(sender, instance, **kwargs):
+    team_id = instance.pk if sender is Team else instance.team_id
+    if leaderboard.rank_index.loaded:
+        transaction.on_commit(lambda: leaderboard.rank_index.remove(team_id))
+
+
+@receiver(post_delete, sender=Team)
+def team_deleted(sender, instance, **kwargs):
+    DurationSketchBin.objects.filter(team=instance.pk).delete()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Team)
+@receiver(post_save, sender=Activity)
+@receiver(post_save, sender=Leaderboard)
+@receiver(post_save, sender=Workout)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Team)
+@receiver(post_delete, sender=Activity)
+@receiver(post_delete, sender=Leaderboard)
+@receiver(post_delete, sender=Workout)
+def model_written(sender, raw=False, **kwargs):
+    """Bump the API collection versions in the writing transaction"""
+    if not raw:
+        versions.changed(sender.__name__)
+
+
+@receiver(post_save, sender=Workout)
+@receiver(post_delete, sender=Workout)
+def workout_written(sender, instance, raw=False, **kwargs):
+    """Update the search index once the write commits.
+
+    Registered after ``model_written``, so the version read here is the one
+    this write produced.
+    """
+    if search.workout_index.loaded and not raw:
+        workout_id = instance.pk
+        version, _ = versions.current('workouts')
+        transaction.on_commit(lambda: search.workout_changed(workout_id, version))
@@ -0,0 +1,323 @@
+"""Mergeable quantile sketches of activity durations.
+
+Answering "what percentile is a 45 minute run" from raw data means sorting
+every duration. Instead every activity is counted in logarithmic bins
+(a DDSketch): bin ``i`` holds the durations in ``(gamma ** (i - 2),
+gamma ** (i - 1)]`` with ``gamma = (1 + alpha) / (1 - alpha)``, bin 0 the
+zero durations. Reporting a bin's midpoint is off by at most ``ALPHA`` of the
+true value, durations up to a few days need a few hundred bins whatever the
+number of activities, and two sketches merge by adding their bin counts.
+
+Sketches are kept per activity type for every user (team 0) and for the
+members of each team, for every month and for all time, as
+``DurationSketchBin`` rows. Activity writes apply ``+1`` / ``-1`` bin
+deltas with ``UPDATE ... SET count = count + delta`` like the rollups, so
+edits and deletes are exact and concurrent writers never lose counts. A
+query reads one sketch, or merges the months of a range, and walks its bins,
+so it costs the same for a hundred activities as for a hundred million.
+
+Team sketches count the activities of the team's current members, like the
+leaderboard: a user joining or leaving a team moves all their activities,
+archived ones included, in or out of its sketches (``members_changed``), so
+an activity's later edit or delete takes its count from the teams that hold
+it. In the deferred mode of ``jobs`` writes enqueue the recount of their
+type's month instead, see ``recompute``.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from . import archive, versions
+from .models import Activity, DurationSketchBin, Team
+from .rollups import activity_day
+
+Membership = Team.members.through
+
+DEFAULTS = {
+    # Relative error of the reported percentiles
+    'ALPHA': 0.01,
+}
+ALL_TIME = ''
+EVERYONE = 0
+# Fields of a bin's key, as in the delta dicts
+KEY_FIELDS = ('activity_type', 'team', 'period', 'bin')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_SKETCHES', {})}
+
+
+def _gamma():
+    alpha = get_config()['ALPHA']
+    return (1 + alpha) / (1 - alpha)
+
+
+def bin_of(duration, gamma=None):
+    """Bin of a duration, 0 for zero or negative durations"""
+    if duration is None or duration <= 0:
+        return 0
+    return math.ceil(math.log(duration, gamma or _gamma())) + 1
+
+
+def bin_value(index, gamma=None):
+    """Value reported for the durations of bin ``index``"""
+    if index <= 0:
+        return 0.0
+    gamma = gamma or _gamma()
+    return round(2 * gamma ** (index - 1) / (gamma + 1), 2)
+
+
+def period_of(date):
+    """Monthly period of an activity ``date``"""
+    return activity_day(date).strftime('%Y-%m')
+
+
+class Sketch:
+    """Bin counts of one sketch, or of several merged ones"""
+
+    def __init__(self, bins=None, gamma=None):
+        self.gamma = gamma or _gamma()
+        self.bins = sorted((index, count) for index, count in (bins or {}).items() if count > 0)
+        self.count = sum(count for _, count in self.bins)
+
+    def quantile(self, q):
+        """Value at quantile ``q`` (0 to 1), None for an empty sketch"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index, count in self.bins:
+            seen += count
+            if seen > rank:
+                return bin_value(index, self.gamma)
+        return bin_value(self.bins[-1][0], self.gamma)
+
+    def rank(self, value):
+        """Percentage of the counted durations below ``value``, ties counting half"""
+        if not self.count:
+            return None
+        target = bin_of(value, self.gamma)
+        below = same = 0
+        for index, count in self.bins:
+            if index < target:
+                below += count
+            elif index == target:
+                same = count
+            else:
+                break
+        return 100 * (below + same / 2) / self.count
+
+
+def load(activity_type, team=EVERYONE, since=None, until=None):
+    """The sketch of ``activity_type`` durations, merged over the months from ``since`` to ``until``"""
+    rows = DurationSketchBin.objects.filter(activity_type=activity_type, team=team)
+    if since is None and until is None:
+        rows = rows.filter(period=ALL_TIME)
+    else:
+        rows = rows.exclude(period=ALL_TIME)
+        if since is not None:
+            rows = rows.filter(period__gte=period_of(since))
+        if until is not None:
+            rows = rows.filter(period__lte=period_of(until))
+    return Sketch(dict(rows.order_by().values_list('bin').annotate(total=Sum('count'))))
+
+
+# Writes
+
+def _teams_of(user_ids):
+    teams = defaultdict(list)
+    for user_id, team_id in Membership.objects.filter(user_id__in=list(user_ids)).values_list('user_id', 'team_id'):
+        teams[user_id].append(team_id)
+    return teams
+
+
+def _count(deltas, user_id, activity_type, duration, date, sign, teams, gamma):
+    index = bin_of(duration, gamma)
+    for team in (EVERYONE, *teams.get(user_id, ())):
+        for period in (ALL_TIME, period_of(date)):
+            deltas[(activity_type, team, period, index)] += sign
+
+
+def activity_changed(previous, current):
+    """Move an activity between bins, states as for ``rollups.activity_changed``"""
+    states = [(state, sign) for state, sign in ((previous, -1), (current, 1)) if state is not None]
+    if not states:
+        return
+    teams = _teams_of({state.user_id for state, _ in states})
+    gamma = _gamma()
+    deltas = defaultdict(int)
+    for state, sign in states:
+        _count(deltas, state.user_id, state.activity_type, state.duration, state.date, sign, teams, gamma)
+    apply_deltas(deltas)
+
+
+def activities_created(activities):
+    teams = _teams_of({activity.user_id for activity in activities})
+    gamma = _gamma()
+    deltas = defaultdict(int)
+    for activity in activities:
+        _count(deltas, activity.user_id, activity.activity_type, activity.duration, activity.date, 1, teams, gamma)
+    apply_deltas(deltas)
+
+
+def members_changed(team_ids, user_ids, sign):
+    """Add (sign=1) or remove (sign=-1) the activities of ``user_ids`` to the sketches of ``team_ids``"""
+    team_ids, user_ids = list(team_ids), set(user_ids)
+    if not team_ids or not user_ids:
+        return
+    gamma = _gamma()
+    fields = ('activity_type', 'duration', 'date')
+    rows = Activity.objects.filter(user_id__in=list(user_ids)).values_list(*fields).iterator(chunk_size=2000)
+    archived = (tuple(row[name] for name in fields) for row in archive.select({'user_ids': user_ids}, columns=fields))
+    # Counted once, then credited to every team
+    counts = defaultdict(int)
+    for source in (rows, archived):
+        for activity_type, duration, date in source:
+            index = bin_of(duration, gamma)
+            for period in (ALL_TIME, period_of(date)):
+                counts[(activity_type, period, index)] += 1
+    apply_deltas({
+        (activity_type, team, period, index): sign * count
+        for (activity_type, period, index), count in counts.items() for team in team_ids
+    })
+
+
+def _existing_bins(keys):
+    """``{key: id}`` of the stored bins among ``(activity_type, team, period, bin)`` keys, in one query"""
+    # Every combination of the keys' values, a superset of the keys
+    lookups = {f'{field}__in': {key[position] for key in keys} for position, field in enumerate(KEY_FIELDS)}
+    rows = DurationSketchBin.objects.filter(**lookups).values_list(*KEY_FIELDS, 'id')
+    return {row[:4]: row[4] for row in rows if row[:4] in keys}
+
+
+def _apply_one(key, delta):
+    activity_type, team, period, index = key
+    rows = DurationSketchBin.objects.filter(activity_type=activity_type, team=team, period=period, bin=index)
+    if rows.update(count=F('count') + delta):
+        if delta < 0:
+            rows.filter(count__lte=0).delete()
+        return
+    if delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            DurationSketchBin.objects.create(activity_type=activity_type, team=team, period=period, bin=index, count=delta)
+    except IntegrityError:
+        rows.update(count=F('count') + delta)
+
+
+def apply_deltas(deltas):
+    """Apply ``{(activity_type, team, period, bin): delta}`` count deltas.
+
+    The stored bins are read in one query and the ones receiving the same
+    delta, usually all bins of a write, updated together; missing bins are
+    inserted in bulk. Bins another writer deleted or created in between
+    fall back to one update or insert each.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic(savepoint=False):
+        existing = _existing_bins(deltas)
+        keys_by_delta = defaultdict(list)
+        for key, bin_id in existing.items():
+            keys_by_delta[deltas[key]].append(key)
+        for delta, keys in keys_by_delta.items():
+            ids = [existing[key] for key in keys]
+            rows = DurationSketchBin.objects.filter(id__in=ids)
+            updated = rows.update(count=F('count') + delta)
+            if delta < 0:
+                rows.filter(count__lte=0).delete()
+            elif updated < len(ids):
+                # Emptied and deleted since they were read
+                remaining = set(rows.values_list('id', flat=True))
+                for key in keys:
+                    if existing[key] not in remaining:
+                        _apply_one(key, delta)
+        missing = [key for key, delta in deltas.items() if key not in existing and delta > 0]
+        if not missing:
+            return
+        try:
+            with transaction.atomic():
+                DurationSketchBin.objects.bulk_create([
+                    DurationSketchBin(**dict(zip(KEY_FIELDS, key)), count=deltas[key]) for key in missing
+                ])
+        except IntegrityError:
+            for key in missing:
+                _apply_one(key, deltas[key])
+
+
+def _month_bounds(period):
+    """Aware UTC ``[start, end)`` of a ``YYYY-MM`` period"""
+    year, month = map(int, period.split('-'))
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def recompute(months):
+    """Recount the sketches of ``(activity_type, period)`` months and the all-time ones of their types.
+
+    Used by the deferred jobs instead of per-write deltas. Like
+    ``rebuild_sketches`` it counts the months' activities, archived ones
+    included, against the current teams.
+    """
+    gamma = _gamma()
+    months = set(months)
+    for activity_type, period in months:
+        start, end = _month_bounds(period)
+        fields = ('user_id', 'duration', 'date')
+        rows = list(Activity.objects.filter(activity_type=activity_type, date__gte=start, date__lt=end).values_list(*fields))
+        criteria = {'activity_type': activity_type, 'since': start, 'until': end - timedelta(microseconds=1)}
+        rows += [tuple(row[name] for name in fields) for row in archive.select(criteria, columns=fields)]
+        teams = _teams_of({user_id for user_id, _, _ in rows})
+        counts = defaultdict(int)
+        for user_id, duration, date in rows:
+            _count(counts, user_id, activity_type, duration, date, 1, teams, gamma)
+        with transaction.atomic():
+            DurationSketchBin.objects.filter(activity_type=activity_type, period=period).delete()
+            DurationSketchBin.objects.bulk_create([
+                DurationSketchBin(**dict(zip(KEY_FIELDS, key)), count=count)
+                for key, count in counts.items() if key[2] == period
+            ], batch_size=1000)
+    # All time is the sum of the months
+    for activity_type in {activity_type for activity_type, _ in months}:
+        bins = DurationSketchBin.objects.filter(activity_type=activity_type).exclude(period=ALL_TIME)
+        totals = bins.order_by().values_list('team', 'bin').annotate(total=Sum('count'))
+        with transaction.atomic():
+            DurationSketchBin.objects.filter(activity_type=activity_type, period=ALL_TIME).delete()
+            DurationSketchBin.objects.bulk_create([
+                DurationSketchBin(activity_type=activity_type, team=team, period=ALL_TIME, bin=index, count=total)
+                for team, index, total in totals if total > 0
+            ], batch_size=1000)
+    if months:
+        versions.bump('stats')
+
+
+def rebuild_sketches(chunk_size=2000):
+    """Recount every sketch from the raw and archived activities, returning the bins written.
+
+    Activities are streamed; memory is bounded by the number of bins.
+    """
+    teams = defaultdict(list)
+    for user_id, team_id in Membership.objects.values_list('user_id', 'team_id').iterator(chunk_size=chunk_size):
+        teams[user_id].append(team_id)
+    gamma = _gamma()
+    counts = defaultdict(int)
+    fields = ('user_id', 'activity_type', 'duration', 'date')
+    rows = Activity.objects.values_list(*fields).iterator(chunk_size=chunk_size)
+    archived = ((row['user_id'], row['activity_type'], row['duration'], row['date']) for row in archive.select({}, columns=fields))
+    for source in (rows, archived):
+        for user_id, activity_type, duration, date in source:
+            _count(counts, user_id, activity_type, duration, date, 1, teams, gamma)
+    with transaction.atomic():
+        DurationSketchBin.objects.all().delete()
+        DurationSketchBin.objects.bulk_create([
+            DurationSketchBin(activity_type=activity_type, team=team, period=period, bin=index, count=count)
+            for (activity_type, team, period, index), count in counts.items()
+        ], batch_size=1000)
+        versions.bump('stats')
+    return len(counts)
@@ -0,0 +1,233 @@
+"""Timed worker start up and pre-warmed process state.
+
+A fresh worker otherwise pays on its first requests for everything Django
+and DRF set up lazily: the database backend and its first connection, the
+URL resolvers (which import the views), the renderer, parser and throttle
+classes, the serializer fields and model metadata caches, the fast path
+encoders and the in-process indexes (ranks, workout search,
+recommendations). ``wsgi.py`` and ``asgi.py`` build their handler with
+``wsgi_application`` / ``asgi_application``, which time every phase of the
+start up (settings, the import of each app, the app registry, the handler)
+and then run the ``WARM_UP`` steps before the module finishes importing,
+that is before the server hands the worker a request. A step that fails on
+the database is logged and left to the first request.
+
+The timings are logged once per worker and served at
+``/api/metrics/startup/``. ``manage.py startup_report`` measures a cold
+start in a fresh interpreter, with the import time per package.
+
+Workers started with ``OCTOFIT_API_ONLY=1`` leave out the admin, sessions,
+messages, static files and the browsable API, see settings.py.
+
+The warm-up connects to the database from the process that imports the
+application. With a server that forks workers from a preloaded application
+(gunicorn ``--preload``), set ``WARM_UP`` to ``[]`` and call ``warm_up()``
+in each worker (``post_fork``) instead, so that workers do not share the
+parent's sockets.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from importlib import import_module
+
+import django
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WARM_UP': ['database', 'urls', 'views', 'serializers', 'rank_index', 'search', 'recommendations'],
+    'LOG': True,
+}
+
+# Phases of this process's start up, in order
+_phases = []
+_report = {'interface': None, 'pid': None, 'total_ms': None}
+_started = time.perf_counter()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_STARTUP', {})}
+
+
+def _record(name, seconds, ok=True):
+    _phases.append({'name': name, 'ms': round(seconds * 1000, 2), 'ok': ok})
+
+
+@contextmanager
+def timed_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - started)
+
+
+def _import_app(entry):
+    """Import an ``INSTALLED_APPS`` entry, an app module or an ``AppConfig`` path"""
+    try:
+        import_module(entry)
+    except ModuleNotFoundError:
+        import_module(entry.rpartition('.')[0])
+
+
+def setup():
+    """``django.setup()``, timing the settings, the import of each app and the app registry"""
+    with timed_phase('settings'):
+        entries = list(settings.INSTALLED_APPS)
+    # Shared by every app, so that the first one is not charged for it
+    with timed_phase('import django'):
+        import_module('django.db.models')
+        import_module('django.urls')
+    for entry in entries:
+        with timed_phase(f'import {entry}'):
+            _import_app(entry)
+    # Models, admin modules and AppConfig.ready()
+    with timed_phase('apps'):
+        django.setup(set_prefix=False)
+
+
+def wsgi_application():
+    """The WSGI handler, timed and warmed up, see the module docstring"""
+    setup()
+    from django.core.handlers.wsgi import WSGIHandler
+
+    with timed_phase('handler'):
+        application = WSGIHandler()
+    warm_up('wsgi')
+    return application
+
+
+def asgi_application():
+    """The ASGI handler, timed and warmed up, see the module docstring"""
+    setup()
+    from django.core.handlers.asgi import ASGIHandler
+
+    with timed_phase('handler'):
+        application = ASGIHandler()
+    warm_up('asgi')
+    return application
+
+
+# Warm-up steps, each called with the interface ('wsgi', 'asgi' or None)
+
+def _warm_database(interface):
+    """Connect, and run one query through the backend's SQL translation"""
+    from .versions import current
+
+    for connection in connections.all():
+        connection.ensure_connection()
+    current('users')
+
+
+def _registry():
+    from .urls import router
+
+    return [viewset for _, viewset, _ in router.registry]
+
+
+def _warm_urls(interface):
+    """Populate the resolvers, which imports every view"""
+    from django.urls import get_resolver
+
+    from .async_views import ASYNC_URLCONF, async_reads_enabled
+
+    urlconfs = [settings.ROOT_URLCONF]
+    if interface == 'asgi' and async_reads_enabled():
+        urlconfs.append(ASYNC_URLCONF)
+    for urlconf in urlconfs:
+        resolver = get_resolver(urlconf)
+        # Reading the reverse lookups fills the resolver's tables
+        resolver.reverse_dict
+        resolver.resolve('/api/')
+
+
+def _warm_views(interface):
+    """Import and build the renderers, parsers, authenticators and throttles of the API views"""
+    from .response_cache import get_response_cache
+    from .throttling import get_backend
+
+    for viewset in _registry():
+        view = viewset()
+        view.get_renderers()
+        view.get_parsers()
+        view.get_authenticators()
+        view.get_throttles()
+        view.get_content_negotiator()
+    get_response_cache()
+    get_backend()
+
+
+def _warm_serializers(interface):
+    """Build the fields and fast path encoder of every API serializer"""
+    from .fastpath import fast_reads_enabled, get_encoder
+    from .serializers import readable_fields
+
+    for viewset in _registry():
+        serializer_class = getattr(viewset, 'serializer_class', None)
+        if serializer_class is None:
+            continue
+        readable_fields(serializer_class)
+        if fast_reads_enabled():
+            get_encoder(serializer_class)
+
+
+def _warm_rank_index(interface):
+    from .leaderboard import get_rank_index
+
+    get_rank_index()
+
+
+def _warm_search(interface):
+    from .search import build_at_startup
+
+    build_at_startup()
+
+
+def _warm_recommendations(interface):
+    from .recommendations import get_recommender
+
+    get_recommender()
+
+
+STEPS = {
+    'database': _warm_database,
+    'urls': _warm_urls,
+    'views': _warm_views,
+    'serializers': _warm_serializers,
+    'rank_index': _warm_rank_index,
+    'search': _warm_search,
+    'recommendations': _warm_recommendations,
+}
+
+
+def warm_up(interface=None):
+    """Run the ``WARM_UP`` steps, then log and return the start up report"""
+    config = get_config()
+    unknown = set(config['WARM_UP']) - set(STEPS)
+    if unknown:
+        raise ImproperlyConfigured(f'Unknown OCTOFIT_STARTUP warm-up steps: {", ".join(sorted(unknown))}')
+    for name in config['WARM_UP']:
+        started = time.perf_counter()
+        try:
+            STEPS[name](interface)
+            ok = True
+        except DatabaseError:
+            logger.warning('Start up step %s failed, leaving it to the first request', name, exc_info=True)
+            ok = False
+        _record(f'warm {name}', time.perf_counter() - started, ok)
+    _report.update(interface=interface, pid=os.getpid(), total_ms=round((time.perf_counter() - _started) * 1000, 2))
+    if config['LOG']:
+        logger.info(
+            'Worker %d ready in %.0f ms (%s)', _report['pid'], _report['total_ms'],
+            ', '.join(f'{phase["name"]} {phase["ms"]:.0f} ms' for phase in _phases),
+        )
+    return report()
+
+
+def report():
+    """Timings of this process's start up"""
+    return {**_report, 'api_only': getattr(settings, 'OCTOFIT_API_ONLY', False), 'phases': list(_phases)}
@@ -0,0 +1,187 @@
+"""Denormalized team counters and bulk membership changes.
+
+Every ``Team`` row carries its ``member_count`` and the ``total_duration``
+and ``activity_count`` of its members' activity, so listing teams or
+ordering them by size never joins the membership table. The counters are
+adjusted with ``UPDATE ... SET counter = counter + delta`` in the writing
+transaction: activity writes add their delta to every team of the user,
+membership changes add or remove the members' whole totals. Archived
+activities keep counting through their monthly summaries. In the deferred
+mode of ``jobs`` activity writes leave the counters to the ``team`` jobs,
+which recompute them with ``rebuild_counters`` as the rebuild does for
+every team.
+
+``add_members`` and ``remove_members`` change the memberships of one team
+for thousands of users in a handful of queries: they lock the team row,
+diff the requested users against the current members in chunks, insert or
+delete the difference in bulk and apply the derived data changes once for
+the whole batch.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from . import versions
+from .models import Activity, ActivitySummary, Team, User
+
+Membership = Team.members.through
+
+# Ids per IN (...) query
+QUERY_CHUNK = 1000
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), QUERY_CHUNK):
+        yield ids[start:start + QUERY_CHUNK]
+
+
+def member_totals(user_ids):
+    """``(total duration, activity count)`` of the users' activity, archived included"""
+    totals = defaultdict(lambda: [0, 0])
+    for chunk in _chunks(user_ids):
+        activities = Activity.objects.filter(user_id__in=chunk).values('user_id')
+        for row in activities.annotate(duration=Sum('duration'), count=Count('id')):
+            totals[row['user_id']][0] += row['duration'] or 0
+            totals[row['user_id']][1] += row['count']
+        summaries = ActivitySummary.objects.filter(user_id__in=chunk).values('user_id')
+        for row in summaries.annotate(duration=Sum('total_duration'), count=Sum('activity_count')):
+            totals[row['user_id']][0] += row['duration'] or 0
+            totals[row['user_id']][1] += row['count'] or 0
+    return totals
+
+
+def _apply(team_ids, members=0, duration=0, count=0):
+    """Add the same deltas to the counters of ``team_ids``"""
+    if not team_ids or not (members or duration or count):
+        return
+    Team.objects.filter(id__in=list(team_ids)).update(
+        member_count=F('member_count') + members,
+        total_duration=F('total_duration') + duration,
+        activity_count=F('activity_count') + count,
+    )
+
+
+def apply_user_deltas(deltas):
+    """Add ``{user_id: (duration, count)}`` activity deltas to each user's teams"""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    team_deltas = defaultdict(lambda: [0, 0])
+    for user_id, team_id in Membership.objects.filter(user_id__in=list(deltas)).values_list('user_id', 'team_id'):
+        team_deltas[team_id][0] += deltas[user_id][0]
+        team_deltas[team_id][1] += deltas[user_id][1]
+    # Teams with the same delta, usually all teams of one user, share an UPDATE
+    teams_by_delta = defaultdict(list)
+    for team_id, delta in team_deltas.items():
+        teams_by_delta[tuple(delta)].append(team_id)
+    with transaction.atomic(savepoint=False):
+        for (duration, count), team_ids in teams_by_delta.items():
+            _apply(team_ids, duration=duration, count=count)
+
+
+def activity_changed(previous, current):
+    """Apply the difference between two activity states, as for ``leaderboard.activity_changed``"""
+    deltas = defaultdict(lambda: [0, 0])
+    for state, sign in ((previous, -1), (current, 1)):
+        if state is not None:
+            deltas[state.user_id][0] += sign * int(state.duration or 0)
+            deltas[state.user_id][1] += sign
+    apply_user_deltas(deltas)
+
+
+def activities_created(activities):
+    deltas = defaultdict(lambda: [0, 0])
+    for activity in activities:
+        deltas[activity.user_id][0] += int(activity.duration or 0)
+        deltas[activity.user_id][1] += 1
+    apply_user_deltas(deltas)
+
+
+def members_changed(team_ids, user_ids, sign):
+    """Add (sign=1) or remove (sign=-1) ``user_ids`` to the counters of every team in ``team_ids``"""
+    totals = member_totals(user_ids).values()
+    _apply(
+        team_ids,
+        members=sign * len(user_ids),
+        duration=sign * sum(duration for duration, _ in totals),
+        count=sign * sum(count for _, count in totals),
+    )
+
+
+def rebuild_counters(team_ids=None):
+    """Recompute the counters of every team, or of ``team_ids``, returning how many were updated"""
+    if team_ids is None:
+        teams = list(Team.objects.only('id'))
+        memberships = Membership.objects.values_list('user_id', 'team_id').iterator(chunk_size=QUERY_CHUNK)
+        totals = member_totals(User.objects.values_list('id', flat=True))
+    else:
+        teams = [team for chunk in _chunks(team_ids) for team in Team.objects.filter(id__in=chunk).only('id')]
+        memberships = [
+            membership for chunk in _chunks(team.id for team in teams)
+            for membership in Membership.objects.filter(team_id__in=chunk).values_list('user_id', 'team_id')
+        ]
+        totals = member_totals({user_id for user_id, _ in memberships})
+    counters = defaultdict(lambda: [0, 0, 0])
+    for user_id, team_id in memberships:
+        duration, count = totals.get(user_id, (0, 0))
+        counter = counters[team_id]
+        counter[0] += 1
+        counter[1] += duration
+        counter[2] += count
+    for team in teams:
+        team.member_count, team.total_duration, team.activity_count = counters.get(team.id, (0, 0, 0))
+    with transaction.atomic():
+        Team.objects.bulk_update(teams, ['member_count', 'total_duration', 'activity_count'], batch_size=QUERY_CHUNK)
+        versions.bump('teams')
+    return len(teams)
+
+
+# Bulk memberships
+
+def _existing_users(user_ids):
+    found = set()
+    for chunk in _chunks(user_ids):
+        found.update(User.objects.filter(id__in=chunk).values_list('id', flat=True))
+    return found
+
+
+def _members(team_id, user_ids):
+    found = set()
+    for chunk in _chunks(user_ids):
+        found.update(Membership.objects.filter(team_id=team_id, user_id__in=chunk).values_list('user_id', flat=True))
+    return found
+
+
+def add_members(team_id, user_ids):
+    """Add ``user_ids`` to a team, returning ``(added ids, unknown ids)``"""
+    # Imported here, signals imports this module
+    from .signals import members_changed
+
+    requested = set(user_ids)
+    with transaction.atomic():
+        # Serializes bulk changes of the team, so the diff below stays true
+        Team.objects.select_for_update().filter(id=team_id).values_list('id').first()
+        known = _existing_users(requested)
+        added = sorted(known - _members(team_id, known))
+        Membership.objects.bulk_create([Membership(team_id=team_id, user_id=user_id) for user_id in added], batch_size=QUERY_CHUNK)
+        if added:
+            members_changed([team_id], added, 1)
+    return added, sorted(requested - known)
+
+
+def remove_members(team_id, user_ids):
+    """Remove ``user_ids`` from a team, returning ``(removed ids, ids that were not members)``"""
+    from .signals import members_changed
+
+    requested = set(user_ids)
+    with transaction.atomic():
+        Team.objects.select_for_update().filter(id=team_id).values_list('id').first()
+        removed = sorted(_members(team_id, requested))
+        # Leave the team before its points are debited, as with remove()
+        for chunk in _chunks(removed):
+            Membership.objects.filter(team_id=team_id, user_id__in=chunk).delete()
+        if removed:
+            members_changed([team_id], removed, -1)
+    return removed, sorted(requested - set(removed))
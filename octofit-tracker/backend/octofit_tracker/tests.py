@@ -1,5 +1,40 @@
-from django.test import TestCase
-from .models import User, Team, Activity, Leaderboard, Workout
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from . import archive, async_views, ingest, jobs, leaderboard, logs, rollups, shedding, startup, throttling, versions
+from .async_views import ASYNC_URLCONF
+from .benchmark import compare, percentile, traced_peak_kb
+from .filters import parse_moment
+from .imports import UserImport
+from .ingest import ingest_activities
+from .instrumentation import registry
+from .jobs import JobRunner
+from .leaderboard import RankIndex, get_rank_index, rank_index, rebuild_leaderboard, user_totals
+from .live import Broadcaster, LeaderboardStream, Subscriber
+from .management.commands.startup_report import import_times
+from .models import User, Team, Activity, ActivityRollup, ActivitySummary, DurationSketchBin, Job, Leaderboard, ResourceVersion, Workout
+from .response_cache import DjangoCacheBackend, LRUBackend, ResponseCache, reset_response_cache
+from .recommendations import recommender
+from .search import SearchIndex, build_index, get_search_index, workout_index
+from .sketches import Sketch, bin_of, rebuild_sketches
+from .teams import rebuild_counters
 
 class UserModelTest(TestCase):
     def test_create_user(self):
@@ -29,3 +64,1208 @@ class WorkoutModelTest(TestCase):
     def test_create_workout(self):
         workout = Workout.objects.create(name='Pushups', description='Do 20 pushups')
         self.assertEqual(workout.name, 'Pushups')
+
+class RankIndexTest(TestCase):
+    def test_ranks_ties_and_neighbours(self):
+        index = RankIndex()
+        index.load([(1, 50), (2, 80), (3, 50), (4, 10)])
+        self.assertEqual(index.rank(2), 1)
+        self.assertEqual(index.rank(1), 2)
+        self.assertEqual(index.rank(3), 2)
+        self.assertEqual(index.rank(4), 4)
+        self.assertEqual([entry['team'] for entry in index.top(2)], [2, 1])
+        self.assertEqual([entry['team'] for entry in index.around(3, 1)], [1, 3, 4])
+        index.update(4, 100)
+        self.assertEqual(index.rank(4), 1)
+        index.remove(2)
+        self.assertIsNone(index.rank(2))
+        self.assertEqual(len(index), 3)
+
+class LeaderboardPointsTest(TestCase):
+    def setUp(self):
+        rank_index.reset()
+        self.user = User.objects.create(email='lb@example.com', name='LB User', password='password')
+        self.team = Team.objects.create(name='Team LB')
+        self.team.members.add(self.user)
+
+    def points(self):
+        return Leaderboard.objects.get(team=self.team).points
+
+    def test_activity_writes_update_points(self):
+        activity = Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-16T00:00:00Z')
+        self.assertEqual(self.points(), 30)
+        activity.duration = 45
+        activity.save()
+        self.assertEqual(self.points(), 45)
+        activity.delete()
+        self.assertEqual(self.points(), 0)
+
+    def test_membership_changes_move_points(self):
+        Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-16T00:00:00Z')
+        other = Team.objects.create(name='Team Other')
+        other.members.add(self.user)
+        self.assertEqual(Leaderboard.objects.get(team=other).points, 30)
+        self.team.members.clear()
+        self.assertEqual(self.points(), 0)
+
+    def test_points_are_read_only_and_one_row_per_team(self):
+        Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-16T00:00:00Z')
+        row = Leaderboard.objects.get(team=self.team)
+        self.assertEqual(self.client.post('/api/leaderboard/', {'team': self.team.pk, 'points': 999}).status_code, 405)
+        response = self.client.patch(f'/api/leaderboard/{row.pk}/', {'points': 999}, content_type='application/json')
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(self.client.delete(f'/api/leaderboard/{row.pk}/').status_code, 405)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Leaderboard.objects.create(team=self.team)
+        # A row created by another writer between the check and the insert
+        with patch('octofit_tracker.leaderboard.Leaderboard.objects.filter', return_value=Leaderboard.objects.none()):
+            leaderboard._ensure_rows([self.team.pk])
+        self.assertEqual(Leaderboard.objects.filter(team=self.team).count(), 1)
+        self.assertEqual(self.points(), 30)
+
+    def test_rank_endpoints(self):
+        Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-16T00:00:00Z')
+        Team.objects.create(name='Team Empty')
+        rebuild_leaderboard()
+        response = self.client.get('/api/leaderboard/rank/', {'team': self.team.pk})
+        self.assertEqual(response.json()['rank'], 1)
+        response = self.client.get('/api/leaderboard/top/', {'n': 1})
+        self.assertEqual(response.json(), [{'team': self.team.pk, 'points': 30, 'rank': 1}])
+        self.assertEqual(self.client.get('/api/leaderboard/rank/', {'team': 999}).status_code, 404)
+
+    def test_rank_index_follows_writes_of_other_processes(self):
+        Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-16T00:00:00Z')
+        other = Team.objects.create(name='Team Elsewhere')
+        self.assertEqual(get_rank_index().rank(self.team.pk), 1)
+        # As written by another worker: no signals reach this process
+        Leaderboard.objects.bulk_create([Leaderboard(team=other, points=100)])
+        versions.bump('leaderboard')
+        with patch('octofit_tracker.leaderboard.RELOAD_INTERVAL', 0):
+            self.assertEqual(get_rank_index().rank(other.pk), 1)
+
+class TeamMembershipTest(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(email=f'member{i}@example.com', name=f'Member {i}', password='password') for i in range(4)]
+        for user in self.users[:2]:
+            Activity.objects.create(user=user, activity_type='run', duration=30, date='2025-05-16T00:00:00Z')
+        self.team = Team.objects.create(name='Team Bulk')
+
+    def counters(self, team=None):
+        team = Team.objects.get(pk=(team or self.team).pk)
+        return team.member_count, team.total_duration, team.activity_count
+
+    def test_bulk_add_and_remove_keep_counters(self):
+        ids = [user.pk for user in self.users]
+        response = self.client.post(f'/api/teams/{self.team.pk}/members/add/', {'users': ids + [999]}, content_type='application/json')
+        self.assertEqual(response.json(), {'added': 4, 'missing': [999], 'member_count': 4})
+        self.assertEqual(self.counters(), (4, 60, 2))
+        self.assertEqual(Leaderboard.objects.get(team=self.team).points, 60)
+        response = self.client.post(f'/api/teams/{self.team.pk}/members/add/', {'users': ids[:1]}, content_type='application/json')
+        self.assertEqual(response.json()['added'], 0)
+        Activity.objects.create(user=self.users[3], activity_type='swim', duration=15, date='2025-05-17T00:00:00Z')
+        self.assertEqual(self.counters(), (4, 75, 3))
+        response = self.client.post(f'/api/teams/{self.team.pk}/members/remove/', {'users': ids[:1] + [999]}, content_type='application/json')
+        self.assertEqual(response.json(), {'removed': 1, 'not_members': [999], 'member_count': 3})
+        self.assertEqual(self.counters(), (3, 45, 2))
+        self.team.members.remove(self.users[0], self.users[1])
+        self.assertEqual(self.counters(), (2, 15, 1))
+        Team.objects.filter(pk=self.team.pk).update(member_count=0, total_duration=0, activity_count=0)
+        rebuild_counters()
+        self.assertEqual(self.counters(), (2, 15, 1))
+        self.assertEqual(self.client.post(f'/api/teams/{self.team.pk}/members/add/', {'users': 'all'}, content_type='application/json').status_code, 400)
+
+    def test_orders_by_member_count(self):
+        self.team.members.add(*self.users[:3])
+        small = Team.objects.create(name='Team Small')
+        small.members.add(self.users[3])
+        body = self.client.get('/api/teams/', {'ordering': '-member_count'}).json()
+        self.assertEqual([team['id'] for team in body['results']], [self.team.pk, small.pk])
+        self.assertEqual(body['results'][0]['member_count'], 3)
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(email='page@example.com', name='Page User', password='password')
+        self.activities = [
+            Activity.objects.create(user=user, activity_type='run', duration=10 + i, date=f'2025-05-{10 + i // 2:02d}T00:00:00Z')
+            for i in range(5)
+        ]
+
+    def test_walks_forward_and_back_in_date_id_order(self):
+        expected = sorted(self.activities, key=lambda a: (a.date, a.id), reverse=True)
+        seen, url = [], '/api/activity/?page_size=2'
+        pages = []
+        while url:
+            body = self.client.get(url).json()
+            pages.append(body)
+            seen.extend(item['id'] for item in body['results'])
+            url = body['next']
+        self.assertEqual(seen, [a.id for a in expected])
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+        back = self.client.get(pages[2]['previous']).json()
+        self.assertEqual(back['results'], pages[1]['results'])
+
+    def test_rejects_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/activity/', {'cursor': 'garbage'}).status_code, 404)
+
+    def test_other_routes_page_by_id(self):
+        body = self.client.get('/api/users/', {'page_size': 1}).json()
+        self.assertEqual(len(body['results']), 1)
+        self.assertIsNone(body['next'])
+
+class ActivityBatchTest(TestCase):
+    def test_batch_is_idempotent_and_reports_per_item(self):
+        user = User.objects.create(email='batch@example.com', name='Batch User', password='password')
+        team = Team.objects.create(name='Team Batch')
+        team.members.add(user)
+        items = [
+            {'user': user.pk, 'activity_type': 'run', 'duration': 30, 'date': '2025-05-16T00:00:00Z', 'idempotency_key': 'a'},
+            {'user': user.pk, 'activity_type': 'swim', 'duration': 20, 'date': '2025-05-16T01:00:00Z', 'idempotency_key': 'b'},
+            {'user': user.pk, 'activity_type': 'swim', 'duration': 20, 'date': '2025-05-16T01:00:00Z', 'idempotency_key': 'b'},
+            {'user': 9999, 'activity_type': 'run', 'duration': 5, 'date': '2025-05-16T00:00:00Z'},
+            {'user': user.pk, 'activity_type': 'run'},
+        ]
+        body = self.client.post('/api/activity/batch/', items, content_type='application/json').json()
+        self.assertEqual((body['created'], body['duplicate'], body['invalid']), (2, 1, 2))
+        self.assertEqual([r['status'] for r in body['results']], ['created', 'created', 'duplicate', 'invalid', 'invalid'])
+        self.assertEqual(Leaderboard.objects.get(team=team).points, 50)
+
+        retry = self.client.post('/api/activity/batch/', {'activities': items[:2]}, content_type='application/json').json()
+        self.assertEqual(retry['duplicate'], 2)
+        self.assertEqual(Activity.objects.count(), 2)
+
+    def test_keys_are_per_user_and_races_report_duplicates(self):
+        first = User.objects.create(email='first@example.com', name='First', password='password')
+        second = User.objects.create(email='second@example.com', name='Second', password='password')
+        item = {'activity_type': 'run', 'duration': 30, 'date': '2025-05-16T00:00:00Z', 'idempotency_key': 'sync-1'}
+        stored = ingest_activities([{**item, 'user': first.pk}])[0]
+        # Another user's key is not a duplicate
+        self.assertEqual(ingest_activities([{**item, 'user': second.pk}])[0]['status'], 'created')
+        # A concurrent retry stored the key after the lookup
+        lookups = iter([lambda keys: {}, ingest._existing_keys])
+        with patch('octofit_tracker.ingest._existing_keys', side_effect=lambda keys: next(lookups)(keys)):
+            result = ingest_activities([{**item, 'user': first.pk}, {**item, 'user': first.pk, 'idempotency_key': 'sync-2'}])
+        self.assertEqual([r['status'] for r in result], ['duplicate', 'created'])
+        self.assertEqual(result[0]['id'], stored['id'])
+        self.assertEqual(Activity.objects.filter(user=first).count(), 2)
+
+class ActivityExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='export@example.com', name='Export User', password='password')
+        other = User.objects.create(email='export2@example.com', name='Export User2', password='password')
+        self.team = Team.objects.create(name='Team Export')
+        self.team.members.add(self.user)
+        Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-16T08:00:00Z')
+        Activity.objects.create(user=self.user, activity_type='yoga', duration=45, date='2025-06-01T08:00:00Z')
+        Activity.objects.create(user=other, activity_type='swim', duration=20, date='2025-05-20T08:00:00Z')
+
+    def test_ndjson_export_filters_by_team_and_date(self):
+        response = self.client.get('/api/activity/export/', {'team': self.team.pk, 'until': '2025-05-31'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{
+            'id': Activity.objects.get(activity_type='run').pk, 'user': self.user.pk,
+            'activity_type': 'run', 'duration': 30, 'date': '2025-05-16T08:00:00Z',
+        }])
+
+    def test_csv_export_command(self):
+        out = StringIO()
+        call_command('export_activities', format='csv', user=str(self.user.pk), stdout=out)
+        rows = out.getvalue().splitlines()
+        self.assertEqual(rows[0], 'id,user,activity_type,duration,date')
+        self.assertEqual([row.split(',')[2] for row in rows[1:]], ['run', 'yoga'])
+
+class ActivityRollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='rollup@example.com', name='Rollup User', password='password')
+
+    def rollups(self):
+        return list(ActivityRollup.objects.order_by('day', 'activity_type').values_list('day', 'activity_type', 'total_duration', 'activity_count'))
+
+    def test_rollups_follow_writes_and_match_rebuild(self):
+        first = Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-12T08:00:00Z')
+        Activity.objects.create(user=self.user, activity_type='run', duration=15, date='2025-05-12T18:00:00Z')
+        moved = Activity.objects.create(user=self.user, activity_type='yoga', duration=40, date='2025-05-20T08:00:00Z')
+        moved.activity_type = 'swim'
+        moved.save()
+        first.delete()
+        incremental = self.rollups()
+        self.assertEqual(incremental, [
+            (date(2025, 5, 12), 'run', 15, 1),
+            (date(2025, 5, 20), 'swim', 40, 1),
+        ])
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+        call_command('rebuild_rollups', since='2025-05-12T20:00:00Z', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_weekly_and_monthly_stats(self):
+        Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-12T08:00:00Z')
+        Activity.objects.create(user=self.user, activity_type='run', duration=20, date='2025-05-18T08:00:00Z')
+        Activity.objects.create(user=self.user, activity_type='run', duration=10, date='2025-05-19T08:00:00Z')
+        weekly = self.client.get('/api/stats/weekly/', {'user': self.user.pk}).json()
+        self.assertEqual([(row['period_start'], row['total_duration']) for row in weekly], [('2025-05-12', 50), ('2025-05-19', 10)])
+        monthly = self.client.get('/api/stats/monthly/', {'user': self.user.pk, 'activity_type': 'run'}).json()
+        self.assertEqual(monthly, [{'period_start': '2025-05-01', 'activity_type': 'run', 'total_duration': 60, 'activity_count': 3}])
+
+    def test_deltas_are_batched_and_totals_summed_by_the_database(self):
+        other = User.objects.create(email='rollup2@example.com', name='Rollup Other', password='password')
+        deltas = {
+            (self.user.pk, date(2025, 5, 12), 'run'): [30, 1],
+            (other.pk, date(2025, 5, 12), 'run'): [30, 1],
+            (self.user.pk, date(2025, 5, 13), 'run'): [20, 1],
+        }
+        rollups.apply_deltas(deltas)
+        # One read, then one update per distinct delta
+        with CaptureQueriesContext(connection) as queries:
+            rollups.apply_deltas(deltas)
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(self.client.get('/api/stats/weekly/').json(), [
+            {'period_start': '2025-05-12', 'activity_type': 'run', 'total_duration': 160, 'activity_count': 6},
+        ])
+
+    def test_deleting_a_user_with_activities(self):
+        team = Team.objects.create(name='Team Leaving')
+        team.members.add(self.user)
+        Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-12T08:00:00Z')
+        Activity.objects.create(user=self.user, activity_type='run', duration=20, date='2025-05-13T08:00:00Z')
+        self.assertEqual(self.client.delete(f'/api/users/{self.user.pk}/').status_code, 204)
+        # SQLite checks deferred foreign keys at commit, check them now
+        connection.check_constraints()
+        self.assertEqual(self.rollups(), [])
+        self.assertEqual(Leaderboard.objects.get(team=team).points, 0)
+        self.assertEqual(Team.objects.filter(pk=team.pk).values_list('member_count', 'total_duration', 'activity_count').get(), (0, 0, 0))
+
+class PopulateDbTest(TestCase):
+    def snapshot(self):
+        return (
+            list(User.objects.order_by('id').values_list('id', 'email', 'name', 'password')),
+            list(Team.members.through.objects.order_by('id').values_list('id', 'user_id', 'team_id')),
+            list(Activity.objects.order_by('id').values_list('id', 'user_id', 'activity_type', 'duration', 'date')),
+            list(Leaderboard.objects.order_by('team_id').values_list('team_id', 'points')),
+        )
+
+    def test_same_seed_same_dataset_regardless_of_chunking(self):
+        options = {'users': 30, 'teams': 4, 'activities': 2500, 'workouts': 3, 'seed': 7, 'stdout': StringIO()}
+        call_command('populate_db', chunk_size=1000, **options)
+        first = self.snapshot()
+        jobs.enqueue('team', [1])
+        call_command('populate_db', chunk_size=2000, **options)
+        self.assertEqual(self.snapshot(), first)
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(len(first[2]), 2500)
+        # Leaderboard points are derived from the generated activity
+        minutes = {}
+        for _, user_id, _, duration, _ in first[2]:
+            minutes[user_id] = minutes.get(user_id, 0) + duration
+        expected = sum(minutes.get(user_id, 0) for _, user_id, _ in first[1])
+        self.assertEqual(sum(points for _, points in first[3]), expected)
+
+class BenchmarkReportTest(TestCase):
+    def result(self, p95, rps, queries, errors=0):
+        return {'scenarios': {'users.list': {
+            'latency_ms': {'p95': p95}, 'throughput_rps': rps,
+            'queries_per_request': {'mean': queries}, 'errors': errors,
+        }}}
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        baseline = self.result(10.0, 100.0, 1.0)
+        self.assertEqual(compare(self.result(11.0, 95.0, 1.0), baseline, 0.2), [])
+        regressions = compare(self.result(13.0, 70.0, 3.0, errors=1), baseline, 0.2)
+        self.assertEqual(len(regressions), 4)
+
+    def test_memory_is_traced_per_run(self):
+        large, large_peak = traced_peak_kb(bytearray, 4 * 1024 * 1024)
+        _, small_peak = traced_peak_kb(bytearray, 1024)
+        self.assertEqual(len(large), 4 * 1024 * 1024)
+        # The peak starts over for every run
+        self.assertGreaterEqual(large_peak, 4096)
+        self.assertLess(small_peak, 64)
+
+class PerformanceMiddlewareTest(TestCase):
+    def setUp(self):
+        registry.reset()
+        User.objects.create(email='perf@example.com', name='Perf User', password='password')
+
+    def test_server_timing_header_and_route_metrics(self):
+        response = self.client.get('/api/users/')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('serializer;dur=', timing)
+        stats = self.client.get('/api/metrics/').json()['GET user-list']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreaterEqual(stats['mean_db_queries'], 1)
+        self.assertEqual(sum(stats['histogram_ms'].values()), 1)
+        self.assertTrue(stats['slow_queries'][0]['sql'].startswith('SELECT'))
+
+    @override_settings(OCTOFIT_PERFORMANCE={'SAMPLE_RATE': 0})
+    def test_sampling_off_skips_measurement(self):
+        response = self.client.get('/api/users/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(registry.snapshot(), {})
+
+class LoggingPipelineTest(TestCase):
+    def test_sampled_records_are_written_by_the_listener(self):
+        written = []
+
+        class Collect(logging.Handler):
+            def emit(self, record):
+                written.append((self.format(record), threading.current_thread()))
+
+        sql = logging.getLogger('octofit_tracker.tests.sql')
+        sql.setLevel(logging.DEBUG)
+        sql.addHandler(Collect())
+        config = {**logs.DEFAULTS, 'SAMPLED': [sql.name], 'MAX_PER_SECOND': 3}
+        with patch.object(logs, '_queue_handlers', []), patch('octofit_tracker.logs.time.monotonic', return_value=100.0):
+            listener = logs.queue_loggers([sql.name], config)
+            try:
+                for i in range(10):
+                    sql.debug('SELECT %d', i)
+                sql.error('Query failed')
+            finally:
+                listener.stop()
+                sql.handlers = []
+        self.assertEqual([message for message, _ in written], ['SELECT 0', 'SELECT 1', 'SELECT 2', 'Query failed'])
+        self.assertNotIn(threading.current_thread(), [thread for _, thread in written])
+
+class ExpandTest(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(email=f'expand{i}@example.com', name=f'Expand {i}', password='secret')
+            for i in range(4)
+        ]
+        for i in range(3):
+            team = Team.objects.create(name=f'Team {i}')
+            team.members.add(*self.users[i:i + 2])
+
+    # Every read also looks up its collection version, see versions.py, and
+    # activity lists whether archive files cover their range, see archive.py
+
+    def test_team_list_costs_constant_queries(self):
+        with self.assertNumQueries(3):
+            plain = self.client.get('/api/teams/').json()['results']
+        self.assertEqual(plain[0]['members'], [self.users[0].pk, self.users[1].pk])
+        with self.assertNumQueries(3):
+            expanded = self.client.get('/api/teams/', {'expand': 'members'}).json()['results']
+        self.assertEqual(expanded[0]['members'][0], {'id': self.users[0].pk, 'email': 'expand0@example.com', 'name': 'Expand 0'})
+
+    def test_activity_and_leaderboard_expansions_join(self):
+        Activity.objects.create(user=self.users[0], activity_type='run', duration=10, date='2025-05-16T00:00:00Z')
+        Activity.objects.create(user=self.users[1], activity_type='run', duration=10, date='2025-05-17T00:00:00Z')
+        with self.assertNumQueries(3):
+            activities = self.client.get('/api/activity/', {'expand': 'user'}).json()['results']
+        self.assertEqual(activities[0]['user']['email'], 'expand1@example.com')
+        with self.assertNumQueries(2):
+            standings = self.client.get('/api/leaderboard/', {'expand': 'team'}).json()['results']
+        self.assertEqual(set(standings[0]['team']), {'id', 'name'})
+
+class FastReadPathTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(email='fast@example.com', name='Fäst Üser', password='secret')
+        team = Team.objects.create(name='Team Fast')
+        team.members.add(user)
+        Activity.objects.create(user=user, activity_type='run', duration=30, date='2025-05-16T08:30:00.250000Z')
+        Activity.objects.create(user=user, activity_type='swim', duration=20, date='2025-05-17T08:00:00+02:00')
+        Workout.objects.create(name='Pushups', description='Do "20" pushups\nslowly')
+
+    def fetch_all(self, fast):
+        with override_settings(OCTOFIT_FAST_READS=fast, OCTOFIT_RESPONSE_CACHE={'ENABLED': False}):
+            paths = ['/api/users/', '/api/activity/', '/api/leaderboard/', '/api/workouts/', '/api/teams/']
+            paths += [f'/api/activity/{Activity.objects.first().pk}/', f'/api/users/{User.objects.get().pk}/', '/api/users/999/']
+            paths += ['/api/activity/?fields=activity_type,id', '/api/teams/?fields=name', f'/api/workouts/{Workout.objects.get().pk}/?fields=description']
+            return [(self.client.get(path).status_code, self.client.get(path).content) for path in paths]
+
+    def test_output_is_byte_identical_to_serializers(self):
+        self.assertEqual(self.fetch_all(fast=True), self.fetch_all(fast=False))
+
+    def test_list_skips_model_instances(self):
+        with patch.object(Activity, '__init__', side_effect=AssertionError('instance built')):
+            self.assertEqual(len(self.client.get('/api/activity/').json()['results']), 2)
+
+class SparseFieldsetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='sparse@example.com', name='Sparse', password='secret')
+        self.workout = Workout.objects.create(name='Plank', description='Hold it ' * 100)
+
+    def test_default_fieldsets_and_passwords(self):
+        self.assertEqual(self.client.get('/api/workouts/').json()['results'], [{'id': self.workout.pk, 'name': 'Plank'}])
+        self.assertIn('description', self.client.get(f'/api/workouts/{self.workout.pk}/').json())
+        self.assertIn('description', self.client.get('/api/workouts/', {'fields': '*'}).json()['results'][0])
+        self.assertNotIn('password', self.client.get(f'/api/users/{self.user.pk}/').json())
+        self.assertEqual(self.client.get('/api/users/', {'fields': 'password'}).status_code, 400)
+
+    def test_user_responses_leave_out_the_password(self):
+        # The one intended change to the /api/users/ output: password hashes are write-only
+        expected = {'id': self.user.pk, 'email': 'sparse@example.com', 'name': 'Sparse'}
+        for fast in (True, False):
+            with override_settings(OCTOFIT_FAST_READS=fast, OCTOFIT_RESPONSE_CACHE={'ENABLED': False}):
+                self.assertEqual(self.client.get('/api/users/', {'fields': '*'}).json()['results'], [expected])
+                self.assertEqual(self.client.get(f'/api/users/{self.user.pk}/').json(), expected)
+
+    def test_only_selected_columns_are_fetched(self):
+        Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-16T00:00:00Z')
+        for fast in (True, False):
+            with override_settings(OCTOFIT_FAST_READS=fast, OCTOFIT_RESPONSE_CACHE={'ENABLED': False}), CaptureQueriesContext(connection) as queries:
+                body = self.client.get('/api/activity/', {'fields': 'duration'}).json()
+            self.assertEqual(body['results'], [{'duration': 30}])
+            select = next(query['sql'] for query in queries if 'octofit_tracker_activity' in query['sql'])
+            self.assertNotIn('activity_type', select)
+
+class ActivityArchiveTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(OCTOFIT_ARCHIVE={'DIR': directory.name}, OCTOFIT_RESPONSE_CACHE={'ENABLED': False})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create(email='archive@example.com', name='Archive', password='password')
+        self.team = Team.objects.create(name='Team Archive')
+        self.team.members.add(self.user)
+        for day, activity_type, duration in [('2023-01-05', 'run', 30), ('2023-01-20', 'swim', 20), ('2023-02-03', 'run', 10), ('2025-05-16', 'run', 5)]:
+            Activity.objects.create(user=self.user, activity_type=activity_type, duration=duration, date=f'{day}T08:00:00Z')
+
+    def walk(self, **params):
+        page = self.client.get('/api/activity/', {'page_size': 2, **params}).json()
+        items = page['results']
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            items += page['results']
+        return items
+
+    def test_compaction_keeps_reads_and_totals(self):
+        before = [self.walk(), self.walk(ordering='date'), self.walk(since='2023-01-10', until='2023-02-28')]
+        monthly = self.client.get('/api/stats/monthly/').json()
+        exported = self.client.get('/api/activity/export/').getvalue()
+        call_command('compact_activities', before='2024-01-01', segment_rows=1, stdout=StringIO())
+        self.assertEqual(list(Activity.objects.values_list('date__year', flat=True)), [2025])
+        self.assertEqual(
+            sorted(ActivitySummary.objects.values_list('month', 'activity_type', 'total_duration', 'activity_count')),
+            [(date(2023, 1, 1), 'run', 30, 1), (date(2023, 1, 1), 'swim', 20, 1), (date(2023, 2, 1), 'run', 10, 1)],
+        )
+        self.assertEqual([self.walk(), self.walk(ordering='date'), self.walk(since='2023-01-10', until='2023-02-28')], before)
+        self.assertEqual(self.client.get(f'/api/activity/{before[0][-1]["id"]}/').json(), before[0][-1])
+        self.assertEqual(self.client.get('/api/activity/export/').getvalue(), exported)
+        self.assertEqual(user_totals(), {self.user.pk: 65})
+        self.assertEqual(rebuild_leaderboard(), {self.team.pk: 65})
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.client.get('/api/stats/monthly/').json(), monthly)
+
+    def test_reads_skip_files_they_cannot_match(self):
+        other = User.objects.create(email='cold@example.com', name='Cold', password='password')
+        Activity.objects.create(user=other, activity_type='run', duration=15, date='2023-03-01T08:00:00Z')
+        call_command('compact_activities', before='2024-01-01', stdout=StringIO())
+        archive._columns.clear()
+        with patch('octofit_tracker.archive._read_column', side_effect=archive._read_column) as read:
+            rows = list(archive.select({'user_ids': {other.pk}}))
+            self.assertEqual([row['duration'] for row in rows], [15])
+            # Only the file of the other user's month is opened
+            self.assertEqual({os.path.basename(os.path.dirname(call.args[0])) for call in read.call_args_list}, {'2023-03'})
+            read.reset_mock()
+            # Nothing lies after the last archived activity, the earlier months stay closed
+            self.assertEqual(list(archive.select({}, after=(rows[0]['date'], rows[0]['id']))), [])
+            self.assertEqual(read.call_count, 0)
+        with override_settings(OCTOFIT_ARCHIVE={'DIR': self.directory, 'COLUMN_CACHE_BYTES': 2000}):
+            archive._columns.clear()
+            self.assertEqual(len(list(archive.select({}))), 4)
+            self.assertLessEqual(archive._columns.bytes, 2000)
+        archive._columns.clear()
+
+    def test_select_walks_files_in_date_order(self):
+        # Logged late: a higher id than the rest of January, an earlier date
+        Activity.objects.create(user=self.user, activity_type='run', duration=25, date='2023-01-10T08:00:00Z')
+        call_command('compact_activities', before='2024-01-01', segment_rows=2, stdout=StringIO())
+        rows = list(archive.select({}))
+        self.assertEqual([row['duration'] for row in rows], [30, 25, 20, 10])
+        keys = [(row['date'], row['id']) for row in rows]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual([row['duration'] for row in archive.select({}, descending=True, after=keys[2])], [25, 30])
+        since = parse_moment('since', '2023-01-10')
+        self.assertEqual([row['duration'] for row in archive.select({'since': since, 'activity_type': 'run'})], [25, 10])
+        archive._columns.clear()
+
+    async def test_only_reads_reaching_the_archive_leave_the_async_views(self):
+        await sync_to_async(call_command)('compact_activities', before='2024-01-01', stdout=StringIO())
+        archived = await sync_to_async(lambda: next(archive.select({}))['id'])()
+        live = await Activity.objects.values_list('id', flat=True).aget()
+        with patch('octofit_tracker.async_views._fetch', side_effect=async_views._fetch) as fetch:
+            self.assertEqual(len((await self.async_client.get('/api/activity/', {'since': '2025-01-01'})).json()['results']), 1)
+            self.assertEqual((await self.async_client.get(f'/api/activity/{live}/')).status_code, 200)
+            self.assertEqual(fetch.call_count, 2)
+            self.assertEqual(len((await self.async_client.get('/api/activity/')).json()['results']), 4)
+            self.assertEqual((await self.async_client.get(f'/api/activity/{archived}/')).json()['duration'], 30)
+            self.assertEqual(fetch.call_count, 2)
+        archive._columns.clear()
+
+class ActivityFilterTest(TestCase):
+    def setUp(self):
+        self.runner = User.objects.create(email='runner@example.com', name='Runner', password='password')
+        self.swimmer = User.objects.create(email='swimmer@example.com', name='Swimmer', password='password')
+        self.team = Team.objects.create(name='Team Filter')
+        self.team.members.add(self.swimmer)
+        for day in (1, 5, 9):
+            Activity.objects.create(user=self.runner, activity_type='run', duration=30, date=f'2025-05-{day:02d}T07:00:00Z')
+        Activity.objects.create(user=self.swimmer, activity_type='swim', duration=40, date='2025-05-03T07:00:00Z')
+
+    def dates(self, **params):
+        return [item['date'][:10] for item in self.client.get('/api/activity/', params).json()['results']]
+
+    def test_filters_and_ordering(self):
+        self.assertEqual(self.dates(user=self.runner.pk, since='2025-05-02'), ['2025-05-09', '2025-05-05'])
+        self.assertEqual(self.dates(team=self.team.pk), ['2025-05-03'])
+        self.assertEqual(self.dates(activity_type='run', until='2025-05-05', ordering='date'), ['2025-05-01', '2025-05-05'])
+        self.assertEqual(self.client.get('/api/activity/', {'ordering': 'duration'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/activity/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_ascending_pages_follow_the_ordering(self):
+        body = self.client.get('/api/activity/', {'ordering': 'date', 'page_size': 2}).json()
+        rest = self.client.get(body['next']).json()
+        self.assertEqual([item['date'][:10] for item in body['results'] + rest['results']],
+                         ['2025-05-01', '2025-05-03', '2025-05-05', '2025-05-09'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plan format is SQLite specific')
+    def test_user_date_range_uses_index(self):
+        queryset = Activity.objects.filter(user_id=self.runner.pk, date__gte='2025-05-02T00:00:00Z')
+        with connection.cursor() as cursor:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('USING INDEX octofit_tra_user_id_fedf84_idx', plan)
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        reset_response_cache()
+        self.user = User.objects.create(email='cached@example.com', name='Cached', password='password')
+        self.team = Team.objects.create(name='Team Cache')
+        self.team.members.add(self.user)
+        Leaderboard.objects.create(team=self.team, points=0)
+
+    def tearDown(self):
+        reset_response_cache()
+
+    def test_activity_write_invalidates_leaderboard(self):
+        first = self.client.get('/api/leaderboard/')
+        second = self.client.get('/api/leaderboard/')
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(self.client.get('/api/leaderboard/', {'page_size': 5})['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/workouts/')['X-Cache'], 'MISS')
+        Activity.objects.create(user=self.user, activity_type='run', duration=25, date='2025-05-01T07:00:00Z')
+        fresh = self.client.get('/api/leaderboard/')
+        self.assertEqual(fresh['X-Cache'], 'MISS')
+        self.assertEqual(fresh.json()['results'][0]['points'], 25)
+        self.assertEqual(self.client.get('/api/workouts/')['X-Cache'], 'HIT')
+        stats = self.client.get('/api/metrics/cache/').json()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 4))
+
+    def test_lru_evicts_by_entries_and_bytes(self):
+        backend = LRUBackend(max_entries=2, max_bytes=10)
+        backend.set('a', (200, 'text/plain', b'aaaa'), 60)
+        backend.set('b', (200, 'text/plain', b'bbbb'), 60)
+        backend.get('a')
+        backend.set('c', (200, 'text/plain', b'cccc'), 60)
+        self.assertEqual([key for key in 'abc' if backend.get(key)], ['a', 'c'])
+        backend.set('d', (200, 'text/plain', b'dddddddd'), 60)
+        self.assertEqual([key for key in 'abcd' if backend.get(key)], ['d'])
+
+    def test_concurrent_misses_fill_once(self):
+        cache = ResponseCache(LRUBackend(10, 1000), timeout=60, fill_wait=5)
+        fills = []
+        barrier = threading.Barrier(4)
+
+        def request():
+            barrier.wait()
+            with cache.fill('hot') as entry:
+                if entry is None:
+                    fills.append(1)
+                    cache.set('hot', (200, 'text/plain', b'value'))
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(fills), 1)
+
+    def test_fill_timeout_leaves_other_fills_alone(self):
+        backend = DjangoCacheBackend('default')
+        backend.clear()
+        cache = ResponseCache(backend, timeout=60, fill_wait=0.05)
+        # Another worker is filling the key
+        backend.add('slow:fill', 1, 60)
+        filling, done = threading.Event(), threading.Event()
+
+        def owner():
+            with cache.fill('slow'):
+                filling.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=owner)
+        thread.start()
+        filling.wait(5)
+        # Times out on both the thread lock and the other worker's key
+        with cache.fill('slow') as entry:
+            self.assertIsNone(entry)
+        self.assertTrue(cache._fill_locks['slow'].locked())
+        self.assertEqual(backend.get('slow:fill'), 1)
+        done.set()
+        thread.join()
+        self.assertEqual(backend.get('slow:fill'), 1)
+        self.assertNotIn('slow', cache._fill_locks)
+
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='poller@example.com', name='Poller', password='password')
+        self.workout = Workout.objects.create(name='Plank', description='Hold it')
+
+    def test_not_modified_until_collection_changes(self):
+        first = self.client.get('/api/activity/')
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(1):
+            cached = self.client.get('/api/activity/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual((cached.status_code, cached.content), (304, b''))
+        since = self.client.get('/api/activity/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+        self.assertEqual(self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+        Activity.objects.create(user=self.user, activity_type='run', duration=5, date='2025-05-01T07:00:00Z')
+        changed = self.client.get('/api/activity/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertEqual(self.client.get('/api/leaderboard/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_if_match_guards_updates(self):
+        path = f'/api/workouts/{self.workout.pk}/'
+        etag = self.client.get(path)['ETag']
+        stale = self.client.patch(path, {'name': 'Side plank'}, content_type='application/json', HTTP_IF_MATCH='"workouts-0-0"')
+        self.assertEqual(stale.status_code, 412)
+        updated = self.client.patch(path, {'name': 'Side plank'}, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(updated.status_code, 200)
+        self.assertNotEqual(updated['ETag'], etag)
+        self.assertEqual(self.client.put(path, {'name': 'Plank', 'description': 'Hold it'}, content_type='application/json',
+                                         HTTP_IF_MATCH=etag).status_code, 412)
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=updated['ETag']).status_code, 304)
+
+    def test_version_bumps_are_merged_and_wait_for_the_commit(self):
+        def stored():
+            return ResourceVersion.objects.filter(name='activity').values_list('version', flat=True).first() or 0
+
+        # The test case's transaction never commits: flush what setUp deferred
+        versions._pending()()
+        before = stored()
+        with transaction.atomic():
+            for duration in (5, 10):
+                Activity.objects.create(user=self.user, activity_type='run', duration=duration, date='2025-05-01T07:00:00Z')
+        self.assertEqual(stored(), before)
+        # The writing transaction sees its own bumps
+        self.assertEqual(versions.current('activity')[0], before + 2)
+        with CaptureQueriesContext(connection) as queries:
+            versions._pending()()
+        self.assertEqual(stored(), before + 2)
+        # One UPDATE per namespace an activity write bumps
+        self.assertEqual(len([query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]), 4)
+
+    def test_objects_are_versioned_by_their_own_row(self):
+        path = f'/api/workouts/{self.workout.pk}/'
+        etag = self.client.get(path)['ETag']
+        activity = Activity.objects.create(user=self.user, activity_type='run', duration=5, date='2025-05-01T07:00:00Z')
+        activity_path = f'/api/activity/{activity.pk}/'
+        activity_etag = self.client.get(activity_path)['ETag']
+        expanded_etag = self.client.get(activity_path, {'expand': 'user'})['ETag']
+        # Writes to other objects of the collection
+        Workout.objects.create(name='Burpees', description='Jump')
+        Activity.objects.create(user=self.user, activity_type='swim', duration=10, date='2025-05-02T07:00:00Z')
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(activity_path, HTTP_IF_NONE_MATCH=activity_etag).status_code, 304)
+        # Expanded representations embed other tables and keep the collection version
+        self.assertEqual(self.client.get(activity_path, {'expand': 'user'}, HTTP_IF_NONE_MATCH=expanded_etag).status_code, 200)
+        updated = self.client.patch(path, {'name': 'Side plank'}, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(updated.status_code, 200)
+        self.assertEqual(self.client.get(path)['ETag'], updated['ETag'])
+
+class AsyncReadTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(email='async@example.com', name='Async', password='password')
+        Activity.objects.create(user=user, activity_type='run', duration=30, date='2025-05-16T08:30:00.250000Z')
+        Activity.objects.create(user=user, activity_type='swim', duration=20, date='2025-05-17T08:00:00+02:00')
+        self.workout = Workout.objects.create(name='Lunges', description='Alternate legs')
+        self.paths = ['/api/activity/', '/api/activity/?page_size=1&ordering=date', '/api/leaderboard/',
+                      '/api/workouts/', f'/api/workouts/{self.workout.pk}/', '/api/workouts/999/']
+
+    async def test_async_views_match_sync_viewsets(self):
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/api/activity/', ASYNC_URLCONF).func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/api/users/', ASYNC_URLCONF).func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/api/activity/').func))
+        with override_settings(OCTOFIT_RESPONSE_CACHE={'ENABLED': False}):
+            with patch('octofit_tracker.async_views._fetch', side_effect=async_views._fetch) as fetch:
+                served = [await self.async_client.get(path) for path in self.paths]
+            self.assertEqual(fetch.call_count, len(self.paths))
+            # Without the fast path the async views hand over to the sync viewsets
+            with override_settings(OCTOFIT_FAST_READS=False):
+                delegated = [await self.async_client.get(path) for path in self.paths]
+        self.assertEqual([(r.status_code, r.get('Allow'), r.content) for r in served],
+                         [(r.status_code, r.get('Allow'), r.content) for r in delegated])
+
+    async def test_writes_and_conditional_requests(self):
+        created = await self.async_client.post('/api/workouts/', {'name': 'Squats', 'description': 'Deep'},
+                                               content_type='application/json')
+        self.assertEqual(created.status_code, 201)
+        listed = await self.async_client.get('/api/workouts/')
+        self.assertEqual(len(listed.json()['results']), 2)
+        # Django 4.1's AsyncClient sends extra arguments as raw header names
+        cached = await self.async_client.get('/api/workouts/', **{'if-none-match': listed['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        invalid = await self.async_client.get('/api/activity/', {'cursor': 'bogus'})
+        self.assertEqual(invalid.status_code, 404)
+
+class LeaderboardStreamTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='live@example.com', name='Live', password='password')
+        self.teams = [Team.objects.create(name=f'Live {i}') for i in range(2)]
+        self.teams[0].members.add(self.user)
+        for team in self.teams:
+            Leaderboard.objects.get_or_create(team=team)
+
+    def log(self, duration):
+        Activity.objects.create(user=self.user, activity_type='run', duration=duration, date='2025-05-01T07:00:00Z')
+
+    async def test_changes_within_a_window_are_coalesced(self):
+        broadcaster = Broadcaster(window=1, queue_size=4, resync=60, overlap=5)
+        await broadcaster.reload()
+        await sync_to_async(self.log)(10)
+        await sync_to_async(self.log)(15)
+        changes = await broadcaster.poll()
+        self.assertEqual(changes, {self.teams[0].pk: 0})
+        self.assertEqual(await broadcaster.poll(), {})
+        leader, other = Subscriber(frozenset([self.teams[0].pk]), 4), Subscriber(frozenset([self.teams[1].pk]), 4)
+        broadcaster.subscribers.update([leader, other])
+        broadcaster.publish(changes, {})
+        event = leader.queue.get_nowait().decode()
+        self.assertIn('"changes":[{"team":%d,"points":25,"rank":1}]' % self.teams[0].pk, event)
+        # Overtaken without a change of its own
+        event = other.queue.get_nowait().decode()
+        self.assertIn('"changes":[{"team":%d,"points":0,"rank":2}]' % self.teams[1].pk, event)
+
+    async def test_rank_moves_are_published(self):
+        broadcaster = Broadcaster(window=1, queue_size=4, resync=60, overlap=5)
+        broadcaster.index.load([(1, 50), (2, 40), (3, 40), (4, 30), (5, 10)])
+        # Team 5 overtakes 4, 3 and 2; 1 and the new team 6 below it keep their rank
+        broadcaster.index.update_many({5: 45, 6: 0})
+        self.assertEqual(broadcaster.moved({5: 10, 6: None}, {}), [2, 3, 4])
+        broadcaster.index.remove(1)
+        self.assertEqual(broadcaster.moved({}, {1: 50}), [2, 3, 4, 5, 6])
+        self.assertEqual(broadcaster.moved({}, {}), [])
+
+    async def test_database_errors_are_retried(self):
+        broadcaster = Broadcaster(window=0.01, queue_size=4, resync=60, overlap=5)
+        reload, failures = broadcaster.reload, [DatabaseError('connection lost')]
+
+        async def flaky_reload():
+            if failures:
+                raise failures.pop()
+            return await reload()
+
+        broadcaster.reload = flaky_reload
+        with self.assertLogs('octofit_tracker.live', 'WARNING'):
+            subscriber = broadcaster.subscribe()
+            for _ in range(100):
+                if broadcaster.index.loaded:
+                    break
+                await asyncio.sleep(0.01)
+        task = broadcaster._task
+        broadcaster.unsubscribe(subscriber)
+        await task
+        self.assertEqual(len(broadcaster.index), 2)
+
+    async def test_slow_subscribers_are_dropped(self):
+        broadcaster = Broadcaster(window=1, queue_size=1, resync=60, overlap=5)
+        await broadcaster.reload()
+        slow = Subscriber(None, 1)
+        broadcaster.subscribers.add(slow)
+        broadcaster.publish({self.teams[0].pk: 0}, {})
+        broadcaster.publish({self.teams[0].pk: 0}, {})
+        self.assertEqual((broadcaster.dropped, broadcaster.subscribers), (1, set()))
+
+    async def test_stream_pushes_standings(self):
+        sent, disconnect = [], asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/leaderboard/stream/', 'query_string': b''}
+        with override_settings(OCTOFIT_LIVE={'WINDOW': 0.01}), patch('octofit_tracker.live._broadcaster', None):
+            connection = asyncio.ensure_future(LeaderboardStream(None)(scope, receive, send))
+            await asyncio.sleep(0.05)
+            await sync_to_async(self.log)(30)
+            for _ in range(100):
+                if any(b'event: standings' in message.get('body', b'') for message in sent):
+                    break
+                await asyncio.sleep(0.01)
+            disconnect.set()
+            await connection
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        events = [message['body'] for message in sent[1:] if b'event: standings' in message['body']]
+        self.assertEqual(len(events), 1)
+        self.assertIn(b'"points":30,"rank":1', events[0])
+@override_settings(OCTOFIT_DERIVED_DATA='deferred', OCTOFIT_JOBS={'DEBOUNCE': 0, 'WORKERS': 1})
+class DeferredJobsTest(TestCase):
+    def setUp(self):
+        rank_index.reset()
+        self.user = User.objects.create(email='jobs@example.com', name='Jobs User', password='password')
+        self.team = Team.objects.create(name='Team Jobs')
+        self.team.members.add(self.user)
+        call_command('run_jobs', once=True, stdout=StringIO())
+
+    def log(self, duration, when='2025-05-16T08:00:00Z'):
+        return Activity.objects.create(user=self.user, activity_type='run', duration=duration, date=when)
+
+    def test_writes_are_merged_into_keyed_jobs(self):
+        self.log(30)
+        self.log(15, '2025-05-16T18:00:00Z')
+        self.assertEqual(Leaderboard.objects.get(team=self.team).points, 0)
+        # Sketches and team counters are left to the jobs too
+        self.assertFalse(DurationSketchBin.objects.exists())
+        self.assertEqual(Team.objects.get(pk=self.team.pk).activity_count, 0)
+        self.assertEqual(dict(Job.objects.values_list('key', 'version')), {
+            'team:%d' % self.team.pk: 2, 'rollup:%d:2025-05-16' % self.user.pk: 2, 'sketch:run:2025-05': 2,
+        })
+        self.assertEqual(self.client.get('/api/metrics/jobs/').json()['pending'], 3)
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(Leaderboard.objects.get(team=self.team).points, 45)
+        self.assertEqual(list(ActivityRollup.objects.values_list('day', 'total_duration', 'activity_count')), [(date(2025, 5, 16), 45, 2)])
+        team = Team.objects.get(pk=self.team.pk)
+        self.assertEqual((team.member_count, team.total_duration, team.activity_count), (1, 45, 2))
+        bins = sorted(DurationSketchBin.objects.values_list('activity_type', 'team', 'period', 'bin', 'count'))
+        self.assertEqual(sum(count for *_, count in bins), 8)
+        rebuild_sketches()
+        self.assertEqual(sorted(DurationSketchBin.objects.values_list('activity_type', 'team', 'period', 'bin', 'count')), bins)
+        # Leaving the team recounts the months of the user's activity
+        self.team.members.remove(self.user)
+        self.assertEqual(set(Job.objects.values_list('key', flat=True)), {'team:%d' % self.team.pk, 'sketch:run:2025-05'})
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertFalse(DurationSketchBin.objects.filter(team=self.team.pk).exists())
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        self.log(30)
+        with patch.dict(jobs.HANDLERS, team=Mock(side_effect=RuntimeError('boom'))), self.assertLogs('octofit_tracker.jobs', 'ERROR'):
+            runner = JobRunner()
+            runner.run_once()
+        self.assertEqual((runner.processed, runner.failed), (2, 1))
+        job = Job.objects.get()
+        self.assertEqual((job.attempts, job.failed, job.locked_by), (1, False, None))
+        self.assertIn('boom', job.last_error)
+        self.assertGreater(job.available_at, job.enqueued_at)
+        Job.objects.update(available_at=job.enqueued_at)
+        JobRunner().run_once()
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(Leaderboard.objects.get(team=self.team).points, 30)
+class ImportUsersTest(TestCase):
+    def setUp(self):
+        User.objects.create(email='taken@example.com', name='Taken', password='password')
+
+    def test_command_imports_in_chunks_on_a_process_pool(self):
+        lines = [
+            'email,name,password',
+            'ada@example.com,Ada,secret-1',
+            'taken@example.com,Taken Again,secret-2',
+            'not-an-email,Nobody,secret-3',
+            'ben@example.com,Ben,',
+            'ada@example.com,Ada Twice,secret-4',
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as source:
+            source.write('\n'.join(lines) + '\n')
+        self.addCleanup(os.unlink, source.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_users', source.name, workers=2, chunk_size=2, stdout=out, stderr=err)
+        self.assertIn('Imported 2 users', out.getvalue())
+        errors = [json.loads(line) for line in err.getvalue().splitlines()]
+        self.assertEqual([(error['index'], error['status']) for error in errors], [(1, 'duplicate'), (2, 'invalid'), (4, 'duplicate')])
+        self.assertEqual(errors[2]['duplicate_of'], 0)
+        ada = User.objects.get(email='ada@example.com')
+        self.assertTrue(check_password('secret-1', ada.password))
+        self.assertFalse(User.objects.get(email='ben@example.com').password.startswith('pbkdf2'))
+
+    @override_settings(OCTOFIT_IMPORTS={'REQUEST_WORKERS': 1, 'MAX_REPORTED': 1})
+    def test_bulk_api_and_serializer_hash_passwords(self):
+        body = '{"email": "nia@example.com", "name": "Nia", "password": "pw"}\nnot json\n{"email": "taken@example.com", "name": "T"}\n'
+        response = self.client.post('/api/users/bulk/', body, content_type='application/x-ndjson')
+        # Counts, and the first rejected rows only
+        data = response.json()
+        self.assertEqual((data['created'], data['invalid'], data['duplicate']), (1, 1, 1))
+        self.assertEqual([(row['index'], row['status']) for row in data['rejected']], [(1, 'invalid')])
+        self.assertTrue(check_password('pw', User.objects.get(email='nia@example.com').password))
+        response = self.client.post('/api/users/', {'email': 'omar@example.com', 'name': 'Omar', 'password': 'pw'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(check_password('pw', User.objects.get(email='omar@example.com').password))
+
+    def test_emails_taken_during_the_import_are_duplicates(self):
+        def hash_while_another_writer_inserts(passwords):
+            User.objects.create(email='race@example.com', name='Racer', password='password')
+            return ['!'] * len(passwords)
+
+        rows = [{'email': 'race@example.com', 'name': 'Race'}, {'email': 'cal@example.com', 'name': 'Cal'}]
+        with patch('octofit_tracker.imports.hash_passwords', side_effect=hash_while_another_writer_inserts):
+            results = list(UserImport().run(rows))
+        self.assertEqual([result['status'] for result in results], ['duplicate', 'created'])
+        self.assertEqual(User.objects.filter(email='race@example.com').count(), 1)
+class WorkoutSearchTest(TestCase):
+    def setUp(self):
+        workout_index.reset()
+        self.addCleanup(workout_index.reset)
+        self.squats = Workout.objects.create(name='Squats', description='Squat with a barbell')
+        self.plank = Workout.objects.create(name='Plank', description='Hold a plank, then squat')
+        self.pushups = Workout.objects.create(name='Push-ups', description='Chest and triceps')
+
+    def test_index_folds_ranks_prefixes_and_updates(self):
+        index = SearchIndex()
+        index.load([(1, 'Crème Brûlée Squats', ''), (2, 'Rowing', 'squats to finish'), (3, 'Squash', '')])
+        self.assertEqual([doc_id for doc_id, _, _ in index.search('creme squats')[1]], [1])
+        count, results = index.search('squa')
+        self.assertEqual(count, 3)
+        # Name matches outrank description matches
+        self.assertLess([doc_id for doc_id, _, _ in results].index(1), [doc_id for doc_id, _, _ in results].index(2))
+        index.add(2, 'Rowing', 'long and steady')
+        index.remove(3)
+        self.assertEqual([doc_id for doc_id, _, _ in index.search('squa')[1]], [1])
+        self.assertEqual(index.search('nothing'), (0, []))
+        # Ids beyond 32 bits, as BigAutoField allows
+        index.add(2 ** 40, 'Squat jumps', '')
+        self.assertEqual([doc_id for doc_id, _, _ in index.search('squat jumps')[1]], [2 ** 40])
+
+    def test_search_endpoint_follows_writes(self):
+        response = self.client.get('/api/workouts/search/', {'q': 'squat'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['id'] for result in response.json()['results']], [self.squats.id, self.plank.id])
+        self.assertIn('ETag', response)
+        with self.captureOnCommitCallbacks(execute=True):
+            jumps = Workout.objects.create(name='Squat jumps', description='')
+            self.plank.delete()
+        version = workout_index.version
+        response = self.client.get('/api/workouts/search/', {'q': 'squat', 'limit': 1})
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual([result['name'] for result in response.json()['results']], [jumps.name])
+        # Applied incrementally, not rebuilt
+        self.assertEqual(workout_index.version, version)
+        self.assertEqual(self.client.get('/api/workouts/search/', {'q': ' '}).status_code, 400)
+
+    def test_changes_of_other_processes_rebuild_in_the_background(self):
+        index = get_search_index()
+        version = index.version
+        # As written by another worker
+        Workout.objects.bulk_create([Workout(name='Squat thrusts', description='')])
+        versions.bump('workouts')
+        with patch('octofit_tracker.search.rebuild_in_background') as rebuild, patch('octofit_tracker.search.build_index') as build:
+            self.assertEqual(self.client.get('/api/workouts/search/', {'q': 'squat'}).json()['count'], 2)
+        rebuild.assert_called_once()
+        build.assert_not_called()
+        fresh = build_index(SearchIndex())
+        index.replace(fresh)
+        self.assertEqual((index.version, index.search('squat')[0]), (version + 1, 3))
+        # A rebuild that finishes after newer changes were applied is dropped
+        stale = SearchIndex()
+        stale.load([], version)
+        index.replace(stale)
+        self.assertEqual(index.search('squat')[0], 3)
+@override_settings(OCTOFIT_RECOMMENDATIONS={'WINDOW': 0})
+class RecommendationTest(TestCase):
+    def setUp(self):
+        recommender.loaded = False
+        self.addCleanup(setattr, recommender, 'loaded', False)
+        self.runner = User.objects.create(email='runner@example.com', name='Runner', password='password')
+        self.yogi = User.objects.create(email='yogi@example.com', name='Yogi', password='password')
+        self.rookie = User.objects.create(email='rookie@example.com', name='Rookie', password='password')
+        team = Team.objects.create(name='Team Rec')
+        team.members.add(self.yogi, self.rookie)
+        self.run = Workout.objects.create(name='Cardio intermediate workout', description='Run intervals on the track')
+        self.yoga = Workout.objects.create(name='Flexibility beginner workout', description='Stretch and breathe')
+        self.lift = Workout.objects.create(name='Strength advanced workout', description='Barbell squat sets')
+        Activity.objects.create(user=self.runner, activity_type='running', duration=60, date='2025-05-16T00:00:00Z')
+        Activity.objects.create(user=self.yogi, activity_type='yoga', duration=30, date='2025-05-16T00:00:00Z')
+
+    def recommended(self, user):
+        response = self.client.get(f'/api/users/{user.id}/recommendations/', {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.json()['results']]
+
+    def test_history_and_teammates_drive_recommendations(self):
+        self.assertEqual(self.recommended(self.runner)[0], self.run.id)
+        self.assertEqual(self.recommended(self.yogi)[0], self.yoga.id)
+        # No history of their own, the teammate's yoga decides
+        self.assertEqual(self.recommended(self.rookie)[0], self.yoga.id)
+        for day in range(10, 14):
+            Activity.objects.create(user=self.rookie, activity_type='weightlifting', duration=90, date=f'2025-05-{day}T00:00:00Z')
+        self.assertEqual(self.recommended(self.rookie)[0], self.lift.id)
+        self.assertEqual(self.client.get('/api/users/999/recommendations/').status_code, 404)
+
+    def test_only_membership_changes_reload_memberships(self):
+        self.recommended(self.rookie)
+        with patch.object(recommender, '_load_memberships', wraps=recommender._load_memberships) as load:
+            Activity.objects.create(user=self.runner, activity_type='yoga', duration=30, date='2025-05-17T00:00:00Z')
+            User.objects.create(email='new@example.com', name='New', password='password')
+            self.recommended(self.rookie)
+            load.assert_not_called()
+            Team.objects.get(name='Team Rec').members.add(self.runner)
+            self.recommended(self.rookie)
+            load.assert_called_once()
+
+    def test_batch_command_scores_every_user(self):
+        out, err = StringIO(), StringIO()
+        call_command('recommend_workouts', limit=1, chunk_size=2, stdout=out, stderr=err)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([line['user'] for line in lines], [self.runner.id, self.yogi.id, self.rookie.id])
+        self.assertEqual(lines[0]['workouts'][0]['id'], self.run.id)
+        self.assertIn('Scored 3 users', err.getvalue())
+class DurationSketchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='sketch@example.com', name='Sketch', password='password')
+        self.other = User.objects.create(email='other@example.com', name='Other', password='password')
+        self.team = Team.objects.create(name='Team Sketch')
+        self.team.members.add(self.user)
+
+    def test_quantiles_stay_within_the_relative_error(self):
+        durations = [(value * 7919) % 500 + 1 for value in range(5000)]
+        bins = {}
+        for duration in durations:
+            bins[bin_of(duration)] = bins.get(bin_of(duration), 0) + 1
+        sketch, ordered = Sketch(bins), sorted(durations)
+        for q in (0.1, 0.5, 0.9, 0.99):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), 0.011 * exact)
+        self.assertAlmostEqual(sketch.rank(250), 50, delta=1)
+
+    def test_endpoint_follows_writes_and_matches_a_rebuild(self):
+        for duration in (10, 20, 30, 40):
+            Activity.objects.create(user=self.user, activity_type='run', duration=duration, date='2025-05-16T00:00:00Z')
+        late = Activity.objects.create(user=self.other, activity_type='run', duration=100, date='2025-06-01T00:00:00Z')
+        response = self.client.get('/api/stats/percentiles/', {'activity_type': 'run', 'q': '50,100', 'value': 30})
+        data = response.json()
+        self.assertEqual((data['count'], data['percentiles']['100']), (5, 100.49))
+        self.assertAlmostEqual(data['percentiles']['50'], 30, delta=0.3)
+        self.assertEqual(data['rank'], 50)
+        team = self.client.get('/api/stats/percentiles/', {'activity_type': 'run', 'team': self.team.id}).json()
+        self.assertEqual(team['count'], 4)
+        may = self.client.get('/api/stats/percentiles/', {'activity_type': 'run', 'since': '2025-05-01', 'until': '2025-05-31'}).json()
+        self.assertEqual(may['count'], 4)
+        late.duration = 50
+        late.save()
+        Activity.objects.filter(duration=10).delete()
+        bins = set(DurationSketchBin.objects.values_list('activity_type', 'team', 'period', 'bin', 'count'))
+        self.assertAlmostEqual(self.client.get('/api/stats/percentiles/', {'activity_type': 'run', 'q': 100}).json()['percentiles']['100'], 50, delta=0.5)
+        call_command('rebuild_sketches', stdout=StringIO())
+        self.assertEqual(set(DurationSketchBin.objects.values_list('activity_type', 'team', 'period', 'bin', 'count')), bins)
+        self.assertEqual(self.client.get('/api/stats/percentiles/').status_code, 400)
+
+    def test_team_sketches_follow_membership_changes(self):
+        activity = Activity.objects.create(user=self.user, activity_type='run', duration=30, date='2025-05-16T00:00:00Z')
+        moved = Team.objects.create(name='Team Sketch 2')
+        self.team.members.remove(self.user)
+        moved.members.add(self.user)
+        self.assertFalse(DurationSketchBin.objects.filter(team=self.team.pk).exists())
+        self.assertEqual(set(DurationSketchBin.objects.filter(team=moved.pk).values_list('period', 'count')), {('', 1), ('2025-05', 1)})
+        # The delete debits the team the activity is counted for now
+        activity.delete()
+        self.assertEqual(set(DurationSketchBin.objects.values_list('team', flat=True)), set())
+
+    def test_activity_writes_are_batched_and_atomic(self):
+        Team.objects.create(name='Team Sketch 2').members.add(self.user)
+        payload = {'user': self.user.pk, 'activity_type': 'run', 'duration': 30, 'date': '2025-05-16T00:00:00Z'}
+        self.client.post('/api/activity/', payload, content_type='application/json')
+        # The same six bins again: one read and one update
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/activity/', payload, content_type='application/json')
+        self.assertEqual(len([query for query in queries.captured_queries if 'durationsketchbin' in query['sql']]), 2)
+        with patch('octofit_tracker.signals.leaderboard.activity_changed', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/api/activity/', payload, content_type='application/json')
+        self.assertEqual(Activity.objects.count(), 2)
+        self.assertEqual(Team.objects.get(pk=self.team.pk).activity_count, 2)
+        self.assertEqual(DurationSketchBin.objects.get(team=0, period='').count, 2)
+class ThrottlingTest(TestCase):
+    def setUp(self):
+        throttling.reset_backend()
+        self.addCleanup(throttling.reset_backend)
+
+    @override_settings(OCTOFIT_THROTTLES={'RATES': {'read': '100/min', 'workout-create': '2/min'}})
+    def test_route_budgets_answer_429_with_retry_after(self):
+        statuses = [self.client.post('/api/workouts/', {'name': 'W', 'description': 'D'}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+        response = self.client.post('/api/workouts/', {'name': 'W', 'description': 'D'})
+        self.assertEqual(int(response['Retry-After']), 30)
+        # Other scopes keep their own budget, unlisted ones are not limited
+        self.assertEqual(self.client.get('/api/workouts/').status_code, 200)
+        self.assertEqual(self.client.post('/api/users/', {'email': 'budget@example.com', 'name': 'B', 'password': 'pw'}).status_code, 201)
+
+    def test_shared_memory_buckets_are_seen_by_every_mapping(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'buckets.bin')
+            first, second = throttling.SharedMemoryBackend(path, 64), throttling.SharedMemoryBackend(path, 64)
+            self.assertTrue(first.take('ip:1.2.3.4:write', 2, 0.001)[0])
+            self.assertTrue(second.take('ip:1.2.3.4:write', 2, 0.001)[0])
+            allowed, wait = first.take('ip:1.2.3.4:write', 2, 0.001)
+            self.assertFalse(allowed)
+            self.assertGreater(wait, 900)
+            self.assertTrue(second.take('ip:5.6.7.8:write', 2, 0.001)[0])
+
+class LoadSheddingTest(TestCase):
+    def setUp(self):
+        previous, shedding.monitor = shedding.monitor, shedding.LoadMonitor()
+        self.addCleanup(setattr, shedding, 'monitor', previous)
+
+    @override_settings(OCTOFIT_LOAD_SHEDDING={'DB_LATENCY_MS': 10.0, 'STATUS': 429, 'RETRY_AFTER': 7})
+    def test_sheds_writes_then_everything_as_latency_grows(self):
+        for _ in range(20):
+            shedding.monitor.observe(0.015, 1, 5.0)
+        response = self.client.post('/api/teams/', {'name': 'T'})
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '7'))
+        self.assertEqual(self.client.get('/api/teams/').status_code, 200)
+        for _ in range(20):
+            shedding.monitor.observe(0.03, 1, 5.0)
+        self.assertEqual(self.client.get('/api/teams/').status_code, 429)
+        metrics = self.client.get('/api/metrics/load/').json()
+        self.assertEqual(metrics['shed'], {'writes': 1, 'all': 1})
+        # The average decays once nothing is measured
+        self.assertLess(shedding.monitor.latency(5.0, time.monotonic() + 30), 10)
+class StartupTest(TestCase):
+    def setUp(self):
+        rank_index.reset()
+        self.addCleanup(rank_index.reset)
+        patcher = patch.object(startup, '_phases', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(OCTOFIT_STARTUP={'WARM_UP': ['database', 'urls', 'views', 'serializers', 'rank_index'], 'LOG': False})
+    def test_warm_up_runs_and_reports_steps(self):
+        report = startup.warm_up('wsgi')
+        names = [phase['name'] for phase in report['phases']]
+        self.assertEqual(names, ['warm database', 'warm urls', 'warm views', 'warm serializers', 'warm rank_index'])
+        self.assertTrue(all(phase['ok'] for phase in report['phases']))
+        self.assertTrue(rank_index.loaded)
+        body = self.client.get('/api/metrics/startup/').json()
+        self.assertEqual(body['interface'], 'wsgi')
+        self.assertEqual(body['phases'][-1]['name'], 'warm rank_index')
+
+    @override_settings(OCTOFIT_STARTUP={'WARM_UP': ['everything']})
+    def test_rejects_unknown_steps(self):
+        with self.assertRaises(ImproperlyConfigured):
+            startup.warm_up()
+
+    def test_import_times_by_package(self):
+        lines = [
+            'import time: self [us] | cumulative | imported package',
+            'import time:       500 |        500 |     django.contrib.admin.sites',
+            'import time:      1500 |       2000 |   django.contrib.admin',
+            'import time:      2000 |       2000 | numpy.core',
+        ]
+        self.assertEqual(dict(import_times(lines)), {'django.contrib.admin': 0.002, 'numpy': 0.002})
+
@@ -0,0 +1,273 @@
+"""Token bucket rate limits per client and route.
+
+``UserTokenBucketThrottle`` and ``IPTokenBucketThrottle`` give every
+authenticated user and every client address a bucket per route scope. A
+bucket holds up to ``capacity`` tokens, refills at ``capacity / period``
+tokens a second and every request takes one, so a client may burst up to the
+full budget and then keeps to the sustained rate. A request finding its
+bucket empty is answered ``429`` with a ``Retry-After`` of the time until
+the next token, by DRF's ``Throttled`` handling.
+
+``RATES`` maps scopes to DRF style rates (``"60/min"``). A view's scope is
+``<basename>-<action>`` (``activity-batch``, ``user-bulk``) when that is
+listed, otherwise ``read`` for safe methods and ``write`` for the others;
+scopes without a rate are not limited.
+
+Buckets live in one of three backends:
+
+* ``local``: a dict in each process, the budget then applies per process.
+* ``mmap``: a fixed size table in a memory mapped file (``PATH``) shared by
+  every worker process of the host. Each update locks a stripe of 16 slots
+  for the few microseconds it takes, a full stripe recycles its least
+  recently used slot.
+* ``django``: a configured Django cache, shared between hosts. Reads and
+  writes are not atomic, so concurrent requests may overrun a budget
+  slightly, and every check is a cache round trip.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'local',
+    # Table file of the mmap backend, defaults to the temporary directory
+    'PATH': None,
+    'SLOTS': 65536,
+    # Buckets kept by the local backend
+    'MAX_KEYS': 100000,
+    'CACHE_ALIAS': 'default',
+    'RATES': {
+        'read': '1200/min',
+        'write': '300/min',
+        'activity-batch': '60/min',
+        'user-bulk': '10/min',
+    },
+}
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_THROTTLES', {})}
+
+
+def parse_rate(rate):
+    """``(capacity, tokens per second)`` of a ``"<count>/<period>"`` rate"""
+    count, _, period = rate.partition('/')
+    return int(count), int(count) / PERIODS[period]
+
+
+def _refill(tokens, updated, now, capacity, refill):
+    return min(capacity, tokens + max(now - updated, 0.0) * refill)
+
+
+def _take(tokens, capacity, refill, cost):
+    """``(tokens left, allowed, seconds until allowed)``"""
+    if tokens >= cost:
+        return tokens - cost, True, 0.0
+    return tokens, False, (cost - tokens) / refill
+
+
+class LocalBackend:
+    """Buckets of this process, least recently used ones dropped past ``max_keys``"""
+
+    nonblocking = True
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens, allowed, wait = _take(_refill(tokens, updated, now, capacity, refill), capacity, refill, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedMemoryBackend:
+    """Buckets in a memory mapped table shared by the processes of a host"""
+
+    nonblocking = True
+    # Key hash, tokens, last update on the monotonic clock, which all
+    # processes of a host share
+    SLOT = struct.Struct('<Qdd')
+    STRIPE = 16
+
+    def __init__(self, path, slots):
+        self.stripes = max(slots // self.STRIPE, 1)
+        size = self.stripes * self.STRIPE * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # Record locks exclude other processes, not other threads of this one
+        self._lock = threading.Lock()
+
+    def _key_hash(self, key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def take(self, key, capacity, refill, cost=1):
+        key_hash = self._key_hash(key)
+        length = self.STRIPE * self.SLOT.size
+        start = (key_hash % self.stripes) * length
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                now = time.monotonic()
+                offset, tokens, updated = self._find(start, key_hash)
+                if offset is None:
+                    offset, tokens, updated = self._victim(start), capacity, now
+                tokens, allowed, wait = _take(_refill(tokens, updated, now, capacity, refill), capacity, refill, cost)
+                self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+        return allowed, wait
+
+    def _find(self, start, key_hash):
+        for offset in range(start, start + self.STRIPE * self.SLOT.size, self.SLOT.size):
+            slot_hash, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, updated
+        return None, None, None
+
+    def _victim(self, start):
+        """An empty slot of the stripe, or its least recently used one"""
+        slots = []
+        for offset in range(start, start + self.STRIPE * self.SLOT.size, self.SLOT.size):
+            slot_hash, _, updated = self.SLOT.unpack_from(self._map, offset)
+            if not slot_hash:
+                return offset
+            slots.append((updated, offset))
+        return min(slots)[1]
+
+    def clear(self):
+        with self._lock:
+            self._map[:] = bytes(len(self._map))
+
+
+class DjangoCacheBackend:
+    """Buckets in a Django cache, see the module docstring for the caveats"""
+
+    nonblocking = False
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, capacity, refill, cost=1):
+        cache_key = f'octofit:bucket:{key}'
+        now = time.time()
+        tokens, updated = self.cache.get(cache_key) or (capacity, now)
+        tokens, allowed, wait = _take(_refill(tokens, updated, now, capacity, refill), capacity, refill, cost)
+        # An idle bucket is full again after capacity / refill seconds
+        self.cache.set(cache_key, (tokens, now), int(capacity / refill) + 1)
+        return allowed, wait
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            config = get_config()
+            if config['BACKEND'] == 'mmap':
+                path = config['PATH'] or os.path.join(tempfile.gettempdir(), 'octofit-throttles.bin')
+                _backend = SharedMemoryBackend(path, config['SLOTS'])
+            elif config['BACKEND'] == 'django':
+                _backend = DjangoCacheBackend(config['CACHE_ALIAS'])
+            else:
+                _backend = LocalBackend(config['MAX_KEYS'])
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def scope_of(request, view, rates):
+    """The rate scope of a request, see the module docstring"""
+    basename, action = getattr(view, 'basename', None), getattr(view, 'action', None)
+    if basename and action and f'{basename}-{action}' in rates:
+        return f'{basename}-{action}'
+    return 'read' if request.method in SAFE_METHODS else 'write'
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Takes a token from the bucket of ``identity(request)`` for the view's scope"""
+    kind = None
+
+    def __init__(self):
+        self._wait = None
+
+    @property
+    def nonblocking(self):
+        """Whether checks do no I/O, so async views may run them on the event loop"""
+        return not get_config()['ENABLED'] or get_backend().nonblocking
+
+    def identity(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        config = get_config()
+        if not config['ENABLED']:
+            return True
+        identity = self.identity(request)
+        scope = scope_of(request, view, config['RATES'])
+        rate = config['RATES'].get(scope)
+        if identity is None or rate is None:
+            return True
+        key = f'{self.kind}:{identity}:{scope}'
+        # The async read views may hand a request over to the sync view, which
+        # checks the throttles again: charge each request once
+        charged = request._request.__dict__.setdefault('_octofit_throttled', {})
+        if key not in charged:
+            charged[key] = get_backend().take(key, *parse_rate(rate))
+        allowed, self._wait = charged[key]
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Budgets per authenticated user"""
+    kind = 'user'
+
+    def identity(self, request):
+        user = getattr(request, 'user', None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """Budgets per client address, honouring ``NUM_PROXIES`` like DRF"""
+    kind = 'ip'
+
+    def identity(self, request):
+        return self.get_ident(request)
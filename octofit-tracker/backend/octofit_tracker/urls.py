@@ -14,10 +14,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 from rest_framework import routers
 from . import views
+from .async_views import mount_async_reads
 
 router = routers.DefaultRouter()
 router.register(r'users', views.UserViewSet)
@@ -25,9 +26,27 @@ router.register(r'teams', views.TeamViewSet)
 router.register(r'activity', views.ActivityViewSet)
 router.register(r'leaderboard', views.LeaderboardViewSet)
 router.register(r'workouts', views.WorkoutViewSet)
+router.register(r'stats', views.StatsViewSet, basename='stats')
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', views.api_root, name='api-root'),
+    path('api/metrics/', views.metrics, name='metrics'),
+    path('api/metrics/cache/', views.cache_metrics, name='cache-metrics'),
+    path('api/metrics/jobs/', views.job_metrics, name='job-metrics'),
+    path('api/metrics/load/', views.load_metrics, name='load-metrics'),
+    path('api/metrics/startup/', views.startup_metrics, name='startup-metrics'),
     path('api/', include(router.urls)),
 ]
+
+# Left out of API-only workers, see OCTOFIT_API_ONLY
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
+
+# Requests served under ASGI resolve against octofit_tracker.async_urls, the
+# same routes with async list and retrieve views, see AsyncRoutesMiddleware
+async_urlpatterns = [
+    *urlpatterns[:-1],
+    path('api/', include(mount_async_reads(router.urls, ['activity', 'leaderboard', 'workout']))),
+]
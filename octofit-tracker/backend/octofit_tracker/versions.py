@@ -0,0 +1,179 @@
+"""Version counters of the API collections.
+
+Every collection (``users``, ``activity``, ...) has a ``ResourceVersion``
+row whose counter is incremented whenever a write can change any of its
+representations: an ``Activity`` write bumps ``activity``, ``leaderboard``
+and ``stats``. The increments are applied once the writing transaction
+commits, merged per namespace, see ``bump``; a process that dies between
+the commit and the increment leaves the counters behind until the next
+write. Reading a collection's current
+version is a single indexed lookup, which is all conditional requests
+(``ETag`` / ``Last-Modified``) and the response cache keys need.
+
+Counters are kept per collection rather than per object: most objects embed
+data of other tables (leaderboard points, team members, ``?expand=``), so an
+object's own row is not enough to tell whether its representation changed.
+Single objects of plain-row resources (activities, workouts) are the
+exception: their ETag is a hash of the row, see ``object_etag``, so that
+``If-Match`` on one object is not defeated by writes to the others.
+"""
+import hashlib
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.http import parse_etags, parse_http_date_safe
+
+from .models import ResourceVersion
+
+# Collections whose representations a write to each model can change
+DEPENDENCIES = {
+    'User': ('users', 'teams', 'activity'),
+    # memberships is not a collection: it tells the recommender when the
+    # teams' members, and nothing else about them, changed
+    'Team': ('teams', 'leaderboard', 'memberships'),
+    'Team_members': ('teams', 'leaderboard', 'memberships'),
+    # Teams carry their members' activity totals
+    'Activity': ('activity', 'teams', 'leaderboard', 'stats'),
+    'Leaderboard': ('leaderboard',),
+    'Workout': ('workouts',),
+}
+NAMESPACES = sorted({namespace for namespaces in DEPENDENCIES.values() for namespace in namespaces})
+
+
+class _PendingBumps:
+    """Increments a transaction defers to its commit, registered with ``on_commit``"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.modified = None
+        # Namespaces whose rows the transaction locked, bumped in place
+        self.locked = set()
+
+    def __call__(self):
+        counts, self.counts = self.counts, Counter()
+        _increment(counts, self.modified)
+
+
+def _pending(create=True):
+    """The deferred bumps of the current transaction, None outside one"""
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+    # Django drops the callbacks of a rolled back transaction or savepoint,
+    # and the bumps they deferred with them
+    for entry in connection.run_on_commit:
+        if isinstance(entry[1], _PendingBumps):
+            return entry[1]
+    if not create:
+        return None
+    pending = _PendingBumps()
+    transaction.on_commit(pending)
+    return pending
+
+
+def _increment(counts, now=None):
+    now = now or timezone.now()
+    # A fixed order keeps concurrent writers from deadlocking on the rows
+    for namespace in sorted(counts):
+        delta = counts[namespace]
+        updated = ResourceVersion.objects.filter(name=namespace).update(version=F('version') + delta, modified=now)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    ResourceVersion.objects.create(name=namespace, version=delta, modified=now)
+            except IntegrityError:
+                ResourceVersion.objects.filter(name=namespace).update(version=F('version') + delta, modified=now)
+
+
+def bump(*namespaces):
+    """Increment the version of ``namespaces`` once the current transaction commits.
+
+    The increments of a transaction are merged into one UPDATE per
+    namespace, run after the commit in autocommit mode, so writers do not
+    hold the counter rows for the length of their transactions. Outside a
+    transaction, and for rows the transaction locked with
+    ``current(lock=True)``, the counters are incremented right away.
+    """
+    counts = Counter(set(namespaces))
+    pending = _pending()
+    if pending is None:
+        _increment(counts)
+        return
+    locked = Counter({namespace: counts.pop(namespace) for namespace in pending.locked & set(counts)})
+    if locked:
+        _increment(locked)
+    if counts:
+        pending.counts.update(counts)
+        pending.modified = timezone.now()
+
+
+def changed(model_name):
+    """Bump every collection a write to ``model_name`` affects"""
+    bump(*DEPENDENCIES.get(model_name, ()))
+
+
+def bump_all():
+    bump(*NAMESPACES)
+
+
+def current(namespace, lock=False):
+    """``(version, modified)`` of ``namespace``, locking the row if ``lock``.
+
+    A transaction sees its own deferred bumps, as it sees its own writes.
+    """
+    rows = ResourceVersion.objects.filter(name=namespace)
+    pending = _pending(create=lock)
+    if lock:
+        rows = rows.select_for_update()
+        if pending is not None:
+            pending.locked.add(namespace)
+    version, modified = rows.values_list('version', 'modified').first() or (0, None)
+    if pending is not None and pending.counts[namespace]:
+        return version + pending.counts[namespace], pending.modified
+    return version, modified
+
+
+async def acurrent(namespace):
+    """Async ``current``"""
+    return await sync_to_async(current)(namespace)
+
+
+def etag(request, namespace, version, modified):
+    """Strong ETag of the representation of ``request`` at ``version``"""
+    url = request.build_absolute_uri(request.path)
+    query = sorted(request.query_params.lists())
+    renderer = getattr(request, 'accepted_media_type', '')
+    # The timestamp keeps tags unique should the counters ever be reset
+    stamp = modified.timestamp() if modified is not None else None
+    digest = hashlib.sha1(repr((url, query, renderer, stamp)).encode()).hexdigest()[:16]
+    return f'"{namespace}-{version}-{digest}"'
+
+
+def object_etag(request, namespace, row):
+    """Strong ETag of the representation of ``request`` for one object stored as ``row``"""
+    url = request.build_absolute_uri(request.path)
+    query = sorted(request.query_params.lists())
+    renderer = getattr(request, 'accepted_media_type', '')
+    digest = hashlib.sha1(repr((url, query, renderer, sorted(row.items()))).encode()).hexdigest()[:16]
+    return f'"{namespace}-object-{digest}"'
+
+
+def etag_matches(header, etag):
+    """Whether an ``If-Match`` / ``If-None-Match`` header lists ``etag``"""
+    tags = parse_etags(header)
+    return '*' in tags or etag in tags
+
+
+def not_modified(request, etag, modified):
+    """Whether a conditional GET can be answered with 304.
+
+    ``If-None-Match`` takes precedence; ``If-Modified-Since`` only has
+    second precision and is consulted when no ETag was sent.
+    """
+    if 'If-None-Match' in request.headers:
+        return etag_matches(request.headers['If-None-Match'], etag)
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and modified is not None and int(modified.timestamp()) <= since
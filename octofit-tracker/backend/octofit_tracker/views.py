@@ -1,8 +1,29 @@
-from rest_framework import viewsets
-from rest_framework.decorators import api_view
+import heapq
+from itertools import islice
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date
+from rest_framework import status, viewsets
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from .models import User, Team, Activity, Leaderboard, Workout
-from .serializers import UserSerializer, TeamSerializer, ActivitySerializer, LeaderboardSerializer, WorkoutSerializer
+from . import archive, imports, jobs, shedding, sketches, startup, teams, versions
+from .exports import EXPORT_FORMATS, export_lines
+from .fastpath import fast_reads_enabled, get_encoder
+from .filters import ActivityFilterBackend, activity_criteria, filter_activities, filter_rollups, parse_moment
+from .imports import IMPORT_FORMATS, UserImport, get_hash_pool, read_rows
+from .ingest import ingest_activities
+from .instrumentation import registry, timed
+from .leaderboard import get_rank_index
+from .models import User, Team, Activity, ActivityRollup, Leaderboard, Workout
+from .pagination import ActivityPagination, LeaderboardPagination, TeamPagination
+from .response_cache import get_response_cache
+from .rollups import period_totals
+from .search import get_search_index, tokenize
+from .serializers import UserSerializer, TeamSerializer, ActivitySerializer, LeaderboardSerializer, WorkoutSerializer, readable_fields, requested_expansions
 
 @api_view(['GET'])
 def api_root(request, format=None):
@@ -12,24 +33,634 @@ def api_root(request, format=None):
         'activity': '/api/activity/',
         'leaderboard': '/api/leaderboard/',
         'workouts': '/api/workouts/',
+        'stats': '/api/stats/',
+        'metrics': '/api/metrics/',
+        'cache': '/api/metrics/cache/',
+        'jobs': '/api/metrics/jobs/',
+        'load': '/api/metrics/load/',
+        'startup': '/api/metrics/startup/',
     })
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+def metrics(request, format=None):
+    """Per-route request timings collected by PerformanceMiddleware in this process"""
+    return Response(registry.snapshot())
+
+@api_view(['GET'])
+def cache_metrics(request, format=None):
+    """Hit and miss counts of the response cache in this process"""
+    cache = get_response_cache()
+    return Response(cache.snapshot() if cache is not None else {'enabled': False})
+
+@api_view(['GET'])
+def job_metrics(request, format=None):
+    """Depth and lag of the derived data job queue"""
+    return Response(jobs.stats())
+
+@api_view(['GET'])
+def load_metrics(request, format=None):
+    """Load shedding pressure and refusals in this process"""
+    return Response(shedding.monitor.snapshot())
+
+@api_view(['GET'])
+def startup_metrics(request, format=None):
+    """Start up timings of this worker process"""
+    return Response(startup.report())
+
+def _int_param(request, name, default=None, minimum=0, maximum=None):
+    value = request.query_params.get(name, default)
+    if value is None:
+        raise ValidationError({name: 'This query parameter is required.'})
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: 'A valid integer is required.'})
+    if value < minimum:
+        raise ValidationError({name: f'Must be at least {minimum}.'})
+    if maximum is not None and value > maximum:
+        raise ValidationError({name: f'Must be at most {maximum}.'})
+    return value
+
+class SparseFieldsetMixin:
+    """Limits GET list and retrieve to the fields named in ``?fields=``.
+
+    Without the parameter ``list_fields`` or ``detail_fields`` are served,
+    None meaning every field, and ``?fields=*`` asks for every field. Only
+    the columns of the selected fields (and of the pagination ordering) are
+    loaded from the database.
+    """
+    list_fields = None
+    detail_fields = None
+
+    def selected_fields(self):
+        """Serializer field names to render, in serializer order, or None for all"""
+        if not hasattr(self, '_selected_fields'):
+            self._selected_fields = self._select_fields()
+        return self._selected_fields
+
+    def _select_fields(self):
+        request = self.request
+        if request is None or request.method not in ('GET', 'HEAD') or self.action not in ('list', 'retrieve'):
+            return None
+        available = readable_fields(self.get_serializer_class())
+        value = request.query_params.get('fields')
+        if value is None:
+            names = self.detail_fields if self.action == 'retrieve' else self.list_fields
+        elif value.strip() == '*':
+            names = None
+        else:
+            names = [name.strip() for name in value.split(',') if name.strip()]
+            unknown = [name for name in names if name not in available]
+            if unknown or not names:
+                raise ValidationError({'fields': f'Expected some of {", ".join(available)}.'})
+        if names is None:
+            return None
+        return tuple(name for name in available if name in names)
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'fields': self.selected_fields()}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        columns = self.selected_columns(queryset.model)
+        return queryset if columns is None else queryset.only(*columns)
+
+    def selected_columns(self, model):
+        """Model fields backing the selected fieldset, or None to load them all"""
+        fields = self.selected_fields()
+        if fields is None:
+            return None
+        available = readable_fields(self.get_serializer_class())
+        columns = []
+        for name in fields:
+            try:
+                field = model._meta.get_field(available[name].source)
+            except FieldDoesNotExist:
+                # Computed from other attributes, their names are unknown
+                return None
+            if field.concrete and not field.many_to_many:
+                columns.append(field.name)
+        if self.paginator is not None and hasattr(self.paginator, 'get_ordering'):
+            # The keyset paginator reads its cursor key from the objects
+            columns += [name.lstrip('-') for name in self.paginator.get_ordering(self.request, self)]
+        return list(dict.fromkeys(columns))
+
+    def field_selected(self, name):
+        fields = self.selected_fields()
+        return fields is None or name in fields
+
+class FastReadMixin(SparseFieldsetMixin):
+    """Serves GET list and retrieve from ``values()`` rows when possible.
+
+    Rows are encoded with the precompiled ``fastpath.RowEncoder`` of the
+    serializer class and the selected fieldset, skipping model instances and
+    per-field serializer calls. Serializers that are not plain columns,
+    expanded requests and ``OCTOFIT_FAST_READS = False`` fall back to the
+    regular serializers. The fast path performs no object level permission
+    checks.
+    """
+
+    def get_row_encoder(self):
+        if not fast_reads_enabled() or requested_expansions(self.request):
+            return None
+        return get_encoder(self.get_serializer_class(), self.selected_fields())
+
+    def list(self, request, *args, **kwargs):
+        encoder = self.get_row_encoder()
+        if encoder is None:
+            return super().list(request, *args, **kwargs)
+        columns = list(encoder.columns)
+        if self.paginator is not None and hasattr(self.paginator, 'get_ordering'):
+            # The keyset paginator reads its cursor key from the rows
+            columns += [name.lstrip('-') for name in self.paginator.get_ordering(request, self)]
+        rows = self.filter_queryset(self.get_queryset()).values(*dict.fromkeys(columns))
+        page = self.paginate_queryset(rows)
+        with timed('serializer'):
+            data = [encoder(row) for row in (rows if page is None else page)]
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        encoder = self.get_row_encoder()
+        if encoder is None:
+            return super().retrieve(request, *args, **kwargs)
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        try:
+            row = self.filter_queryset(self.get_queryset()).filter(**lookup).values(*encoder.columns).first()
+        except (TypeError, ValueError, DjangoValidationError):
+            row = None
+        if row is None:
+            raise Http404
+        with timed('serializer'):
+            data = encoder(row)
+        return Response(data)
+
+class VersionedResourceMixin:
+    """Identifies the representation of a request by the version of its collection.
+
+    Single objects of ``object_versions`` viewsets, whose representation is
+    their own row, are identified by a hash of that row instead, so writes
+    to other objects of the collection leave their validators alone.
+    """
+    version_namespace = None
+    object_versions = False
+
+    def versions_object(self):
+        """Whether the request is for one object identified by its own row"""
+        if not self.object_versions:
+            return False
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        return lookup in self.kwargs and not requested_expansions(self.request)
+
+    def object_rows(self):
+        """Queryset of the stored row of the requested object"""
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.get_queryset().filter(**{self.lookup_field: lookup}).values()
+
+    def object_row(self, lock=False):
+        """The stored row of the requested object, or None"""
+        try:
+            rows = self.object_rows()
+            if lock:
+                rows = rows.select_for_update()
+            return rows.first()
+        except (TypeError, ValueError, DjangoValidationError):
+            return None
+
+    def current_version(self, lock=False):
+        """``(etag, last modified)`` of the requested representation, locking what it derives from if ``lock``"""
+        if self.versions_object():
+            row = self.object_row(lock=lock)
+            if row is not None:
+                return versions.object_etag(self.request, self.version_namespace, row), None
+        version, modified = versions.current(self.version_namespace, lock=lock)
+        return versions.etag(self.request, self.version_namespace, version, modified), modified
+
+    def resource_version(self):
+        """``(etag, last modified)`` of the requested representation"""
+        if not hasattr(self, '_resource_version'):
+            self._resource_version = self.current_version()
+        return self._resource_version
+
+class ConditionalRequestMixin(VersionedResourceMixin):
+    """``ETag`` and ``Last-Modified`` on GET, ``If-Match`` on PUT and PATCH.
+
+    The validators come from the collection version, or the object's own
+    row, alone, so a matching ``If-None-Match`` or ``If-Modified-Since`` is
+    answered with a 304 before any queryset is evaluated or body rendered.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalRequestMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalRequestMixin, self).retrieve(request, *args, **kwargs))
+
+    def conditional_response(self, request, respond):
+        if request.method not in ('GET', 'HEAD'):
+            return respond()
+        etag, modified = self.resource_version()
+        if versions.not_modified(request, etag, modified):
+            response = HttpResponseNotModified()
+        else:
+            response = respond()
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified.timestamp())
+        return response
+
+    def update(self, request, *args, **kwargs):
+        if 'If-Match' not in request.headers:
+            return super().update(request, *args, **kwargs)
+        with transaction.atomic():
+            # Hold the version or object row until the write commits, so the
+            # check and the write cannot interleave with another writer
+            current, _ = self.current_version(lock=True)
+            if not versions.etag_matches(request.headers['If-Match'], current):
+                return Response({'detail': 'The resource has changed.'}, status=status.HTTP_412_PRECONDITION_FAILED)
+            response = super().update(request, *args, **kwargs)
+            response['ETag'] = self.current_version()[0]
+        return response
+
+class CachedResponseMixin(VersionedResourceMixin):
+    """Serves GET list and retrieve from the shared response cache.
+
+    Entries are keyed by the representation's ETag, so writes to the
+    collection move readers to new keys, see ``response_cache``. Only the
+    ``cached_formats`` renderers are cached: the browsable API embeds
+    per-user CSRF tokens.
+    """
+    cached_formats = ('json',)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
+    def cached_response(self, request, respond):
+        cache = get_response_cache()
+        if cache is None or request.method not in ('GET', 'HEAD') or request.accepted_renderer.format not in self.cached_formats:
+            return respond()
+        key = cache.key(self.resource_version()[0])
+        entry = cache.get(key)
+        if entry is None:
+            with cache.fill(key) as entry:
+                if entry is None:
+                    response = respond()
+                    if response.status_code != 200:
+                        return response
+                    # Render now rather than in the handler so the bytes can be stored
+                    response.accepted_renderer = request.accepted_renderer
+                    response.accepted_media_type = request.accepted_media_type
+                    response.renderer_context = self.get_renderer_context()
+                    response.render()
+                    cache.set(key, (response.status_code, response['Content-Type'], response.content))
+                    response['X-Cache'] = 'MISS'
+                    return response
+        status_code, content_type, content = entry
+        response = HttpResponse(content, content_type=content_type, status=status_code)
+        response['X-Cache'] = 'HIT'
+        return response
+
+class UserViewSet(ConditionalRequestMixin, CachedResponseMixin, FastReadMixin, viewsets.ModelViewSet):
+    version_namespace = 'users'
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
-class TeamViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create many users from a JSON list, or a streamed CSV or NDJSON body"""
+        content_type = request.content_type.split(';')[0].strip()
+        import_format = next((name for name, media_type in IMPORT_FORMATS.items() if media_type == content_type), None)
+        if import_format is not None:
+            # Read the body line by line instead of through the parsers
+            rows = read_rows((line.decode('utf-8') for line in request._request), import_format)
+        else:
+            rows = request.data.get('users') if isinstance(request.data, dict) else request.data
+            if not isinstance(rows, list):
+                raise ValidationError({'users': 'Expected a list of users.'})
+        user_import = UserImport(get_hash_pool())
+        limit = imports.get_config()['MAX_REPORTED']
+        rejected = []
+        for result in user_import.run(rows):
+            if result['status'] != 'created' and len(rejected) < limit:
+                rejected.append(result)
+        return Response({**user_import.summary, 'rejected': rejected})
+
+    @action(detail=True)
+    def recommendations(self, request, pk=None):
+        """Workouts suited to the user's recent activity and their teammates'"""
+        limit = _int_param(request, 'limit', default=10, minimum=1, maximum=100)
+        try:
+            user_id = int(pk)
+        except ValueError:
+            raise Http404
+        if not User.objects.filter(pk=user_id).exists():
+            raise Http404
+        # Imported on use: NumPy is a large import for workers that never recommend
+        from .recommendations import get_recommender
+
+        results = get_recommender().recommend(user_id, limit)
+        return Response({
+            'user': user_id,
+            'results': [{'id': workout_id, 'name': name, 'score': round(score, 4)} for workout_id, name, score in results],
+        })
+
+class TeamViewSet(ConditionalRequestMixin, CachedResponseMixin, FastReadMixin, viewsets.ModelViewSet):
+    version_namespace = 'teams'
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    pagination_class = TeamPagination
+    members_limit = 10000
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('add_members', 'remove_members'):
+            return queryset.only('id')
+        if not self.field_selected('members'):
+            return queryset
+        # One query loads the members of every team on the page, with only
+        # the columns the representation needs
+        if 'members' in requested_expansions(self.request):
+            members = User.objects.only('id', 'email', 'name')
+        else:
+            members = User.objects.only('id')
+        return queryset.prefetch_related(Prefetch('members', queryset=members))
+
+    def member_ids(self, request):
+        ids = request.data.get('users') if isinstance(request.data, dict) else request.data
+        if not isinstance(ids, list) or not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in ids):
+            raise ValidationError({'users': 'Expected a list of user ids.'})
+        if len(ids) > self.members_limit:
+            raise ValidationError({'users': f'At most {self.members_limit} users per request.'})
+        return ids
+
+    def member_change_response(self, team_id, changed, key, others, others_key):
+        member_count = Team.objects.filter(pk=team_id).values_list('member_count', flat=True).first()
+        return Response({key: len(changed), others_key: others, 'member_count': member_count})
+
+    @action(detail=True, methods=['post'], url_path='members/add')
+    def add_members(self, request, pk=None):
+        """Add ``{"users": [ids]}`` to the team, ignoring current members"""
+        team = self.get_object()
+        added, missing = teams.add_members(team.pk, self.member_ids(request))
+        return self.member_change_response(team.pk, added, 'added', missing, 'missing')
+
+    @action(detail=True, methods=['post'], url_path='members/remove')
+    def remove_members(self, request, pk=None):
+        """Remove ``{"users": [ids]}`` from the team, ignoring non-members"""
+        team = self.get_object()
+        removed, not_members = teams.remove_members(team.pk, self.member_ids(request))
+        return self.member_change_response(team.pk, removed, 'removed', not_members, 'not_members')
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ArchiveMergeMixin:
+    """Merges archived activities into GET list and retrieve, see ``archive``.
+
+    When the requested date range reaches into archived months, the matching
+    archive rows are merged with the live page by ``(date, id)``, so filters
+    and cursors behave as if the activities had never moved.
+    """
+    merges_archive = True
+
+    def list(self, request, *args, **kwargs):
+        criteria = activity_criteria(request.query_params)
+        files = archive.segments(criteria.get('since'), criteria.get('until'), criteria.get('user_ids'))
+        if not files:
+            return super().list(request, *args, **kwargs)
+        paginator = self.paginator
+        live = paginator.prepare_queryset(self.filter_queryset(self.get_queryset()).values(*archive.COLUMNS), request, self)
+        descending = paginator.query_ordering[0].startswith('-')
+        archived = archive.select(criteria, descending, after=paginator.cursor_key, files=files)
+        merged = heapq.merge(live, archived, key=lambda row: (row['date'], row['id']), reverse=descending)
+        rows = paginator.paginate_rows(islice(merged, paginator.get_page_size(request) + 1))
+        return paginator.get_paginated_response(self.encode_rows(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            try:
+                row = archive.get(int(self.kwargs[self.lookup_url_kwarg or self.lookup_field]))
+            except ValueError:
+                row = None
+            if row is None:
+                raise
+        return Response(self.encode_rows([row])[0])
+
+    def object_row(self, lock=False):
+        row = super().object_row(lock=lock)
+        if row is None and not lock:
+            try:
+                row = archive.get(int(self.kwargs[self.lookup_url_kwarg or self.lookup_field]))
+            except ValueError:
+                row = None
+        return row
+
+    def encode_rows(self, rows):
+        """Representations of ``archive.COLUMNS`` row dicts"""
+        encoder = self.get_row_encoder()
+        if encoder is not None:
+            with timed('serializer'):
+                return [encoder(row) for row in rows]
+        activities = [Activity(**row) for row in rows]
+        if 'user' in requested_expansions(self.request):
+            prefetch_related_objects(activities, 'user')
+        return self.get_serializer(activities, many=True).data
+
+class ActivityViewSet(ConditionalRequestMixin, CachedResponseMixin, ArchiveMergeMixin, FastReadMixin, viewsets.ModelViewSet):
+    version_namespace = 'activity'
+    object_versions = True
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = ActivityPagination
+    filter_backends = [ActivityFilterBackend]
+    batch_limit = 5000
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if 'user' in requested_expansions(self.request) and self.field_selected('user'):
+            queryset = queryset.select_related('user')
+        return queryset
+
+    # The write and the derived data its signals update commit together
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            super().perform_update(serializer)
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
-    queryset = Leaderboard.objects.all()
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Store many activities at once, skipping already seen idempotency keys"""
+        items = request.data.get('activities') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            raise ValidationError({'activities': 'Expected a list of activities.'})
+        if len(items) > self.batch_limit:
+            raise ValidationError({'activities': f'At most {self.batch_limit} activities per batch.'})
+        results = ingest_activities(items)
+        summary = {status: 0 for status in ('created', 'duplicate', 'invalid')}
+        for result in results:
+            summary[result['status']] += 1
+        return Response({**summary, 'results': results})
+
+    @action(detail=False)
+    def export(self, request):
+        """Stream the filtered activities as ``?output=ndjson`` or ``csv``"""
+        export_format = request.query_params.get('output', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'output': f'Expected one of {", ".join(sorted(EXPORT_FORMATS))}.'})
+        queryset = filter_activities(Activity.objects.all(), request.query_params)
+        archived = archive.select(activity_criteria(request.query_params))
+        response = StreamingHttpResponse(export_lines(queryset, export_format, archived=archived), content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="activities.{export_format}"'
+        return response
+
+class LeaderboardViewSet(ConditionalRequestMixin, CachedResponseMixin, FastReadMixin, viewsets.ReadOnlyModelViewSet):
+    # Points are derived from the members' activity, see octofit_tracker.leaderboard
+    version_namespace = 'leaderboard'
+    queryset = Leaderboard.objects.order_by('-points', 'team_id')
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if 'team' in requested_expansions(self.request) and self.field_selected('team'):
+            queryset = queryset.select_related('team')
+        return queryset
+
+    @action(detail=False)
+    def top(self, request):
+        """The ``n`` best ranked teams"""
+        n = _int_param(request, 'n', default=10, maximum=1000)
+        return Response(get_rank_index().top(n))
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+    @action(detail=False)
+    def rank(self, request):
+        """Rank and points of the team given by ``?team=<id>``"""
+        team_id = _int_param(request, 'team')
+        index = get_rank_index()
+        rank = index.rank(team_id)
+        if rank is None:
+            raise Http404
+        return Response({'team': team_id, 'points': index.points(team_id), 'rank': rank, 'teams': len(index)})
+
+    @action(detail=False)
+    def around(self, request):
+        """The team given by ``?team=<id>`` and its ``radius`` neighbours"""
+        team_id = _int_param(request, 'team')
+        radius = _int_param(request, 'radius', default=5, maximum=100)
+        entries = get_rank_index().around(team_id, radius)
+        if not entries:
+            raise Http404
+        return Response(entries)
+
+class WorkoutViewSet(ConditionalRequestMixin, CachedResponseMixin, FastReadMixin, viewsets.ModelViewSet):
+    version_namespace = 'workouts'
+    object_versions = True
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    # Descriptions are long, list screens show names only
+    list_fields = ('id', 'name')
+
+    @action(detail=False)
+    def search(self, request):
+        """Workouts matching every word of ``?q=``, best first.
+
+        Answered from the in-memory index, so responses are not put in the
+        response cache, but still carry the collection's validators.
+        """
+        query = request.query_params.get('q', '')
+        if not tokenize(query):
+            raise ValidationError({'q': 'Expected at least one word to search for.'})
+        limit = _int_param(request, 'limit', default=20, minimum=1, maximum=100)
+
+        def respond():
+            with timed('search'):
+                count, results = get_search_index().search(query, limit)
+            return Response({
+                'query': query,
+                'count': count,
+                'results': [{'id': doc_id, 'name': name, 'score': round(score, 4)} for doc_id, name, score in results],
+            })
+        return self.conditional_response(request, respond)
+
+class StatsViewSet(ConditionalRequestMixin, CachedResponseMixin, viewsets.ViewSet):
+    """Weekly and monthly activity totals served from the daily rollups.
+
+    Both actions accept ``user``, ``team``, ``activity_type``, ``since`` and
+    ``until`` filters and return one row per period and activity type.
+    ``percentiles`` answers duration percentile queries from the sketches.
+    """
+
+    version_namespace = 'stats'
+
+    def list(self, request):
+        return Response({
+            'weekly': request.build_absolute_uri('weekly/'),
+            'monthly': request.build_absolute_uri('monthly/'),
+            'percentiles': request.build_absolute_uri('percentiles/'),
+        })
+
+    def _totals(self, request, period):
+        rollups = filter_rollups(ActivityRollup.objects.all(), request.query_params)
+        return self.conditional_response(request, lambda: self.cached_response(request, lambda: Response(period_totals(rollups, period))))
+
+    @action(detail=False)
+    def weekly(self, request):
+        return self._totals(request, 'weekly')
+
+    @action(detail=False)
+    def monthly(self, request):
+        return self._totals(request, 'monthly')
+
+    @action(detail=False)
+    def percentiles(self, request):
+        """Duration percentiles of an ``activity_type``, and the rank of ``?value=``.
+
+        ``team`` limits the durations to a team's members, ``since`` and
+        ``until`` to the months they fall in, ``q`` lists the percentiles to
+        report (default ``50,90,99``).
+        """
+        params = request.query_params
+        activity_type = params.get('activity_type')
+        if not activity_type:
+            raise ValidationError({'activity_type': 'This query parameter is required.'})
+        team = _int_param(request, 'team', default=sketches.EVERYONE)
+        since = parse_moment('since', params['since']) if params.get('since') else None
+        until = parse_moment('until', params['until']) if params.get('until') else None
+        try:
+            quantiles = [float(part) for part in params.get('q', '50,90,99').split(',') if part]
+        except ValueError:
+            raise ValidationError({'q': 'Expected a comma separated list of percentiles.'})
+        try:
+            value = float(params['value']) if params.get('value') else None
+        except ValueError:
+            raise ValidationError({'value': 'A valid number is required.'})
+        if not quantiles or any(not 0 <= quantile <= 100 for quantile in quantiles):
+            raise ValidationError({'q': 'Expected percentiles between 0 and 100.'})
+
+        def respond():
+            sketch = sketches.load(activity_type, team, since, until)
+            data = {
+                'activity_type': activity_type,
+                'team': team or None,
+                'count': sketch.count,
+                'relative_error': sketches.get_config()['ALPHA'],
+                'percentiles': {f'{quantile:g}': sketch.quantile(quantile / 100) for quantile in quantiles},
+            }
+            if value is not None:
+                data['value'] = value
+                data['rank'] = sketch.rank(value)
+            return Response(data)
+        return self.conditional_response(request, lambda: self.cached_response(request, respond))
@@ -9,8 +9,10 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
-
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "octofit_tracker.settings")
 
-application = get_wsgi_application()
+# Timed set up, and warm-up of the connections, URL resolvers, serializers
+# and in-process indexes before the first request (octofit_tracker.startup)
+from octofit_tracker.startup import wsgi_application  # noqa: E402
+
+application = wsgi_application()